@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, Request
+
+# Priority classes; lower runs first when upstream slots are contended
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BACKGROUND: "background"}
+PRIORITIES = {name: value for value, name in PRIORITY_NAMES.items()}
+# Rough prompt cost of one screenshot (a high-detail image at our resize caps)
+IMAGE_TOKENS = 1100
+
+
+class RequestBudget:
+    """Priority and deadline of the request being served, read by the
+    upstream client for every call made on its behalf."""
+
+    __slots__ = ("priority", "deadline")
+
+    def __init__(self, priority: int = NORMAL, deadline: Optional[float] = None) -> None:
+        self.priority = priority
+        # time.monotonic() value, or None for no deadline
+        self.deadline = deadline
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+_budget: ContextVar[Optional[RequestBudget]] = ContextVar("request_budget", default=None)
+
+
+def current_budget() -> RequestBudget:
+    # A fresh default each time: budgets get promoted in place, so they are never shared by accident
+    return _budget.get() or RequestBudget()
+
+
+def set_budget(budget: RequestBudget) -> None:
+    # Each request runs in its own task (and context), so this is not reset;
+    # streaming bodies produced after the handler returns still see it
+    _budget.set(budget)
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `capacity`. Reservations may take the
+    bucket below zero; the deficit is the wait before the reserved use."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, n: float) -> float:
+        """Seconds until `n` tokens are available, without taking them."""
+        self._refill()
+        return max(0.0, (n - self.tokens) / self.rate)
+
+    def reserve(self, n: float) -> float:
+        """Takes `n` tokens now; returns how long to wait before using them."""
+        self._refill()
+        self.tokens -= n
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, n: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + n)
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    """Upper-bound token cost of a Responses API payload: ~4 characters per
+    prompt token, a flat cost per image and the whole output allowance."""
+    chars = len(payload.get("instructions") or "")
+    images = 0
+    pending = [payload.get("input")]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, str):
+            chars += len(item)
+        elif isinstance(item, list):
+            pending.extend(item)
+        elif isinstance(item, dict):
+            if item.get("type") == "input_image":
+                images += 1
+            else:
+                pending.append(item.get("text"))
+                pending.append(item.get("content"))
+    return chars // 4 + images * IMAGE_TOKENS + int(payload.get("max_output_tokens") or 0)
+
+
+class ClientRateLimiter:
+    """Requests per minute per client (bearer token, else client address).
+    Over-limit requests are refused with 429 and Retry-After at once; they
+    never reach the upstream queue. 0 disables."""
+
+    def __init__(self, rpm: float = 0.0, burst: int = 10, max_clients: int = 10000) -> None:
+        self.rpm = rpm
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    @staticmethod
+    def client_key(request: Request) -> str:
+        auth = request.headers.get("authorization", "")
+        if auth.lower().startswith("bearer ") and auth[7:].strip():
+            # Keyed by a digest so raw tokens are not kept in memory
+            return "token:" + hashlib.sha256(auth[7:].strip().encode()).hexdigest()[:32]
+        return "addr:" + (request.client.host if request.client else "unknown")
+
+    def check(self, key: str) -> None:
+        if self.rpm <= 0:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rpm / 60.0, self.burst)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        wait = bucket.delay(1)
+        if wait > 0:
+            self.limited += 1
+            raise HTTPException(
+                status_code=429,
+                detail="rate limit exceeded for this client",
+                headers={"Retry-After": str(max(1, round(wait)))},
+            )
+        bucket.reserve(1)
+        self.allowed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rpm": self.rpm, "burst": self.burst, "clients": len(self._buckets), "allowed": self.allowed, "limited": self.limited}
+
+
+class ModelRateLimiter:
+    """Requests- and tokens-per-minute budget per upstream model, so calls
+    wait here instead of drawing 429s from the upstream. Token costs are
+    estimates made before the call (prompt size plus max_output_tokens)."""
+
+    def __init__(self, rpm: float = 0.0, tpm: float = 0.0) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self._buckets: Dict[str, tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self.delayed = 0
+        self.refused = 0
+        self.total_delay = 0.0
+
+    def _for(self, model: str) -> tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        pair = self._buckets.get(model)
+        if pair is None:
+            pair = self._buckets[model] = (
+                TokenBucket(self.rpm / 60.0, self.rpm) if self.rpm > 0 else None,
+                TokenBucket(self.tpm / 60.0, self.tpm) if self.tpm > 0 else None,
+            )
+        return pair
+
+    async def acquire(self, model: str, tokens: int, max_wait: Optional[float]) -> float:
+        """Waits until the model's budget covers one request of `tokens`;
+        returns the seconds waited. Refuses with 429 if that would take
+        longer than `max_wait`."""
+        if self.rpm <= 0 and self.tpm <= 0:
+            return 0.0
+        requests, token_bucket = self._for(model)
+        wait = max(
+            requests.delay(1) if requests else 0.0,
+            token_bucket.delay(tokens) if token_bucket else 0.0,
+        )
+        if max_wait is not None and wait > max_wait:
+            self.refused += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"upstream rate budget for {model} exhausted",
+                headers={"Retry-After": str(max(1, round(wait)))},
+            )
+        # Reserve now so later callers queue behind this one
+        wait = max(
+            requests.reserve(1) if requests else 0.0,
+            token_bucket.reserve(tokens) if token_bucket else 0.0,
+        )
+        if wait <= 0:
+            return 0.0
+        self.delayed += 1
+        self.total_delay += wait
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            if requests:
+                requests.refund(1)
+            if token_bucket:
+                token_bucket.refund(tokens)
+            raise
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "delayed": self.delayed,
+            "refused": self.refused,
+            "total_delay_s": round(self.total_delay, 3),
+            "models": {
+                model: {
+                    "requests_available": round(r.tokens, 1) if r else None,
+                    "tokens_available": round(t.tokens) if t else None,
+                }
+                for model, (r, t) in self._buckets.items()
+            },
+        }
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Returns once the client has gone away. Only for use after the body
+    has been read: it consumes the remaining receive messages."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
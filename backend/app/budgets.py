@@ -0,0 +1,78 @@
+import math
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+
+class OutputBudget:
+    """max_output_tokens per mode sized from recent replies.
+
+    The budget is the `quantile` of the last `window` output lengths times
+    `headroom`, kept between `floor` and `cap`. Until `min_samples` replies
+    have been seen (or with `adaptive` off) it is `cap`. A truncated reply
+    counts as a `cap`-long one, so budgets grow back quickly when outputs get
+    longer.
+    """
+
+    def __init__(
+        self,
+        cap: int = 800,
+        floor: int = 64,
+        quantile: float = 0.99,
+        headroom: float = 1.25,
+        window: int = 200,
+        min_samples: int = 20,
+        adaptive: bool = True,
+    ) -> None:
+        self.cap = cap
+        self.floor = min(floor, cap)
+        self.quantile = quantile
+        self.headroom = headroom
+        self.window = window
+        self.min_samples = min_samples
+        self.adaptive = adaptive
+        self._samples: Dict[str, Deque[int]] = {}
+        self._budgets: Dict[str, int] = {}
+        self.replies: Dict[str, int] = {}
+        self.truncated: Dict[str, int] = {}
+        self.retries: Dict[str, int] = {}
+
+    def for_mode(self, mode: str) -> int:
+        return self._budgets.get(mode, self.cap)
+
+    def observe(self, mode: str, output_tokens: Optional[int], truncated: bool, adapt: bool = True) -> None:
+        """Records one reply; `adapt=False` for calls that always get `cap`."""
+        self.replies[mode] = self.replies.get(mode, 0) + 1
+        if truncated:
+            self.truncated[mode] = self.truncated.get(mode, 0) + 1
+            output_tokens = self.cap
+        if output_tokens is None:
+            return
+        samples = self._samples.setdefault(mode, deque(maxlen=self.window))
+        samples.append(output_tokens)
+        if adapt and self.adaptive and len(samples) >= self.min_samples:
+            ordered = sorted(samples)
+            high = ordered[min(len(ordered) - 1, math.ceil(self.quantile * len(ordered)) - 1)]
+            self._budgets[mode] = max(self.floor, min(self.cap, math.ceil(high * self.headroom)))
+
+    def _average(self, mode: str) -> Optional[float]:
+        samples = self._samples.get(mode)
+        return round(sum(samples) / len(samples), 1) if samples else None
+
+    def stats(self) -> Dict[str, Any]:
+        modes = sorted(set(self.replies) | set(self._samples))
+        return {
+            "cap": self.cap,
+            "adaptive": self.adaptive,
+            "quantile": self.quantile,
+            "headroom": self.headroom,
+            "modes": {
+                mode: {
+                    "max_output_tokens": self.for_mode(mode),
+                    "replies": self.replies.get(mode, 0),
+                    "truncated": self.truncated.get(mode, 0),
+                    "retries": self.retries.get(mode, 0),
+                    "avg_output_tokens": self._average(mode),
+                }
+                for mode in modes
+            },
+        }
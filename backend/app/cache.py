@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from .upstream import env_float, env_int
+
+
+def normalize_dom(dom_html: str) -> str:
+    # Whitespace-only differences should not defeat the cache
+    return " ".join(dom_html.split())
+
+
+def content_key(mode: str, model: str, req: Any, uploads: Sequence[Any] = ()) -> str:
+    """Stable hash of everything that influences the model's answer.
+    `uploads` are multipart screenshots, hashed as they were received."""
+    h = hashlib.sha256()
+    for part in (mode, model, req.page_url or "", req.user_prompt or "", normalize_dom(req.dom_html)):
+        h.update(part.encode("utf-8", "surrogatepass"))
+        h.update(b"\x00")
+    for s in req.screenshots:
+        h.update(s.mime_type.encode())
+        h.update(hashlib.sha256(s.data_base64.encode("ascii", "replace")).digest())
+    for u in uploads:
+        h.update(u.content_type.encode())
+        h.update(u.sha256.digest())
+    return h.hexdigest()
+
+
+class _SqliteTier:
+    """Optional on-disk tier so cached results survive restarts."""
+
+    def __init__(self, path: str) -> None:
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value BLOB NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[Tuple[float, bytes]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, value FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] <= time.time():
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            return float(row[0]), bytes(row[1])
+
+    def put(self, key: str, expires_at: float, value: bytes) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, value),
+            )
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """Byte-budgeted LRU of parsed endpoint responses with a TTL per mode.
+
+    Values are stored as compact JSON bytes, which keeps the size accounting
+    exact and makes the optional SQLite tier a straight copy.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttls: Dict[str, float],
+        default_ttl: float = 300.0,
+        sqlite_path: Optional[str] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk: Optional[_SqliteTier] = _SqliteTier(sqlite_path) if sqlite_path else None
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            max_bytes=env_int("CACHE_MAX_BYTES", 64 * 1024 * 1024),
+            ttls={
+                "summary": env_float("CACHE_TTL_SUMMARY", 600.0),
+                "suggest": env_float("CACHE_TTL_SUGGEST", 120.0),
+                "analysis": env_float("CACHE_TTL_ANALYSIS", 120.0),
+            },
+            sqlite_path=os.getenv("CACHE_SQLITE_PATH") or None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def ttl_for(self, mode: str) -> float:
+        return self.ttls.get(mode, self.default_ttl)
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_memory(self, key: str, expires_at: float, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (expires_at, value)
+        self.bytes_used += len(value)
+        while self.bytes_used > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes_used -= len(entry[1])
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        value = self._get_memory(key)
+        if value is None and self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key)
+            if row is not None:
+                self._put_memory(key, row[0], row[1])
+                self.disk_hits += 1
+                value = row[1]
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def put(self, mode: str, key: str, result: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        value = json.dumps(result, separators=(",", ":")).encode()
+        expires_at = time.time() + self.ttl_for(mode)
+        self._put_memory(key, expires_at, value)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.put, key, expires_at, value)
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.purge_expired()
+            self._disk.close()
+            self._disk = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "ttl_s": dict(self.ttls),
+            "sqlite": self._disk is not None,
+        }
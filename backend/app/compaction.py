@@ -0,0 +1,338 @@
+import hashlib
+import html
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Markup handling for callers that send real HTML instead of innerText. Tag
+# patterns never cross a "<", so stray or unclosed tags cannot make them
+# rescan the rest of the page
+_DROP_NAMES = ("script", "style", "noscript", "svg", "template")
+_DROP_OPEN = re.compile(r"<(%s)\b[^<>]*>" % "|".join(_DROP_NAMES), re.I)
+_DROP_CLOSE = {name: re.compile(r"</%s\s*>" % name, re.I) for name in _DROP_NAMES}
+_BLOCK_TAGS = re.compile(
+    r"</?(p|div|section|article|main|header|footer|nav|aside|li|ul|ol|tr|table|h[1-6]|br|hr|form|blockquote|pre)\b[^<>]*>",
+    re.I,
+)
+_ANY_TAG = re.compile(r"<[^<>]+>")
+_WORD = re.compile(r"[a-z0-9]+")
+
+_BOILERPLATE = re.compile(
+    r"\b(cookies?|cookie (settings|policy|preferences)|accept all|privacy (policy|notice|settings)|"
+    r"terms (of (use|service))?|all rights reserved|copyright|skip to (main )?content|"
+    r"sign up for (our|the) newsletter|subscribe to (our|the) newsletter|follow us|"
+    r"advertisement|sponsored|do not sell my)\b|©",
+    re.I,
+)
+
+_STOPWORDS = {
+    "the", "a", "an", "and", "or", "of", "to", "in", "on", "for", "is", "are", "be", "this",
+    "that", "it", "with", "as", "at", "by", "from", "page", "please", "what", "how",
+}
+
+# Extra relevance hints per mode on top of the user prompt
+MODE_HINTS: Dict[str, Set[str]] = {
+    "summary": {"said", "announced", "report", "reports", "according", "total", "price", "date", "deadline"},
+    "suggest": {"reply", "send", "draft", "message", "email", "subject", "compose", "submit", "due", "invite"},
+    "analysis": {"button", "submit", "sign", "login", "search", "form", "error", "required"},
+}
+# Summary and suggest prompts share one compacted page so upstream prefix caching
+# can reuse it across the two; it ranks by both modes' hints
+MODE_HINTS["page"] = MODE_HINTS["summary"] | MODE_HINTS["suggest"]
+
+# Pages are cut to this many characters before any markup or block work
+MAX_INPUT_CHARS = 1_000_000
+# Output below this share of the budget (or of the page without repeated lines,
+# if smaller) means the heuristics threw away the page itself; plain head/tail
+# truncation is used then
+MIN_KEEP_FRACTION = 0.25
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate (~4 UTF-8 bytes per token). Good enough for
+    budgeting; exact counts come back in `usage_tokens`."""
+    return math.ceil(len(text.encode("utf-8", "surrogatepass")) / 4)
+
+
+def _terms(text: Optional[str]) -> Set[str]:
+    return {w for w in _WORD.findall((text or "").lower()) if len(w) > 2 and w not in _STOPWORDS}
+
+
+def _drop_elements(dom: str) -> str:
+    """Removes script/style/svg... elements in one forward pass. An opening
+    tag without a closing one is dropped on its own."""
+    out: List[str] = []
+    pos = 0
+    unclosed: Set[str] = set()
+    while True:
+        m = _DROP_OPEN.search(dom, pos)
+        if m is None:
+            break
+        name = m.group(1).lower()
+        out.append(dom[pos:m.start()])
+        out.append(" ")
+        close = None if name in unclosed else _DROP_CLOSE[name].search(dom, m.end())
+        if close is None:
+            # Later searches for this tag would fail the same way
+            unclosed.add(name)
+            pos = m.end()
+        else:
+            pos = close.end()
+    out.append(dom[pos:])
+    return "".join(out)
+
+
+def html_to_text(dom: str) -> str:
+    dom = _drop_elements(dom)
+    dom = _BLOCK_TAGS.sub("\n", dom)
+    dom = _ANY_TAG.sub(" ", dom)
+    return html.unescape(dom)
+
+
+def _looks_like_html(dom: str) -> bool:
+    head = dom[:2000].lstrip().lower()
+    return head.startswith("<") and ("<div" in head or "<html" in head or "<body" in head or "<p" in head)
+
+
+class CompactionReport:
+    __slots__ = (
+        "input_chars", "output_chars", "input_tokens", "output_tokens",
+        "blocks_in", "blocks_kept", "duplicate_lines", "boilerplate_blocks", "truncated", "elapsed_ms",
+    )
+
+    def __init__(self) -> None:
+        self.input_chars = 0
+        self.output_chars = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.blocks_in = 0
+        self.blocks_kept = 0
+        self.duplicate_lines = 0
+        self.boilerplate_blocks = 0
+        # Fell back to head/tail truncation
+        self.truncated = False
+        self.elapsed_ms = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# innerText often has no blank lines at all; cap blocks so ranking still has units to work with
+MAX_BLOCK_LINES = 12
+
+
+def _split_blocks(text: str, report: CompactionReport) -> List[List[str]]:
+    """Paragraph-ish blocks (runs of non-blank lines, at most MAX_BLOCK_LINES
+    long), with exact repeated lines collapsed to their first occurrence."""
+    seen: Set[str] = set()
+    blocks: List[List[str]] = []
+    cur: List[str] = []
+    for raw in text.splitlines():
+        line = " ".join(raw.split())
+        if not line:
+            if cur:
+                blocks.append(cur)
+                cur = []
+            continue
+        key = line.lower()
+        if key in seen:
+            report.duplicate_lines += 1
+            continue
+        seen.add(key)
+        cur.append(line)
+        if len(cur) >= MAX_BLOCK_LINES:
+            blocks.append(cur)
+            cur = []
+    if cur:
+        blocks.append(cur)
+    return blocks
+
+
+def _is_boilerplate(lines: List[str]) -> bool:
+    joined = " ".join(lines)
+    words = len(joined.split())
+    if words < 80 and _BOILERPLATE.search(joined):
+        return True
+    # Menus: many very short lines (e.g. "Home", "Products", "About us")
+    if len(lines) >= 4:
+        short = sum(1 for l in lines if len(l.split()) <= 3)
+        if short / len(lines) >= 0.8 and words / len(lines) <= 2.5:
+            return True
+    return False
+
+
+def _score(lines: List[str], index: int, total: int, query: Set[str]) -> float:
+    joined = " ".join(lines)
+    words = joined.split()
+    if not words:
+        return 0.0
+    # Prose density: long lines read as content, short ones as chrome
+    avg_words = len(words) / len(lines)
+    score = min(avg_words / 12.0, 1.5)
+    if query:
+        # query terms are pre-filtered, so a raw word set is enough here
+        hits = len(query.intersection(_WORD.findall(joined.lower())))
+        score += 2.0 * hits / math.sqrt(len(query))
+    # Mild preference for what appears first on the page
+    score += 0.5 * (1.0 - index / max(total, 1))
+    return score
+
+
+def _head_tail(text: str, token_budget: int) -> str:
+    """The start and end of `text` within `token_budget`."""
+    data = text.encode("utf-8", "surrogatepass")
+    limit = token_budget * 4
+    if len(data) <= limit:
+        return text
+    head = limit * 3 // 4
+    tail = max(0, limit - head - 8)
+    return (
+        data[:head].decode("utf-8", "ignore") + "\n…\n" + data[len(data) - tail:].decode("utf-8", "ignore")
+    ).strip()
+
+
+def compact_dom(
+    dom: str, mode: str, user_prompt: Optional[str], token_budget: int
+) -> Tuple[str, CompactionReport]:
+    """Fit `dom` into `token_budget`. A page that fits is returned unchanged.
+    Otherwise repeats are collapsed, boilerplate and menus dropped (only
+    until the page fits), and the remaining blocks ranked by relevance to
+    `mode`/`user_prompt` and kept (in page order) until the budget is spent.
+    If that leaves too little, the page is truncated head and tail instead."""
+    started = time.perf_counter()
+    report = CompactionReport()
+    report.input_chars = len(dom)
+    report.input_tokens = estimate_tokens(dom)
+    out = dom if report.input_tokens <= token_budget else _compact(dom, mode, user_prompt, token_budget, report)
+    report.output_chars = len(out)
+    report.output_tokens = estimate_tokens(out)
+    report.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+    return out, report
+
+
+def _compact(dom: str, mode: str, user_prompt: Optional[str], token_budget: int, report: CompactionReport) -> str:
+    dom = dom[:MAX_INPUT_CHARS]
+    text = html_to_text(dom) if _looks_like_html(dom) else dom
+    blocks = _split_blocks(text, report)
+    report.blocks_in = len(blocks)
+
+    query = _terms(user_prompt) | MODE_HINTS.get(mode, set())
+    # (score, index, body, cost)
+    candidates: List[Tuple[float, int, str, int]] = []
+    boilerplate: List[Tuple[float, int, str, int]] = []
+    for i, lines in enumerate(blocks):
+        body = "\n".join(lines)
+        candidate = (_score(lines, i, len(blocks), query), i, body, estimate_tokens(body) + 1)
+        candidates.append(candidate)
+        if _is_boilerplate(lines):
+            boilerplate.append(candidate)
+
+    # Boilerplate goes first, least relevant first, and only while over budget
+    total = deduplicated = sum(c[3] for c in candidates)
+    dropped: Set[int] = set()
+    for score, i, body, cost in sorted(boilerplate):
+        if total <= token_budget:
+            break
+        dropped.add(i)
+        total -= cost
+    report.boilerplate_blocks = len(dropped)
+    candidates = [c for c in candidates if c[1] not in dropped]
+
+    kept: List[Tuple[int, str]] = []
+    if total <= token_budget:
+        kept = [(i, body) for _, i, body, _ in candidates]
+    else:
+        remaining = token_budget
+        for score, i, body, cost in sorted(candidates, key=lambda c: (-c[0], c[1])):
+            if cost <= remaining:
+                kept.append((i, body))
+                remaining -= cost
+            elif remaining > 64 and not kept:
+                # A single huge block (e.g. one-line innerText): keep its head
+                cut = body.encode("utf-8", "surrogatepass")[: remaining * 4].decode("utf-8", "ignore")
+                kept.append((i, cut))
+                remaining = 0
+            if remaining <= 0:
+                break
+    report.blocks_kept = len(kept)
+    out = "\n\n".join(body for _, body in sorted(kept))
+
+    if not out.strip() or estimate_tokens(out) < MIN_KEEP_FRACTION * min(token_budget, deduplicated):
+        report.truncated = True
+        out = _head_tail(text if text.strip() else dom, token_budget)
+    return out
+
+
+class CompactionStats:
+    """Running totals for /api/compaction/stats."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.input_chars = 0
+        self.output_chars = 0
+        self.truncated = 0
+        self.last: Optional[Dict[str, Any]] = None
+
+    def record(self, report: CompactionReport) -> None:
+        self.requests += 1
+        self.input_tokens += report.input_tokens
+        self.output_tokens += report.output_tokens
+        self.input_chars += report.input_chars
+        self.output_chars += report.output_chars
+        self.truncated += report.truncated
+        self.last = report.as_dict()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "input_tokens_est": self.input_tokens,
+            "output_tokens_est": self.output_tokens,
+            "input_chars": self.input_chars,
+            "output_chars": self.output_chars,
+            "truncated": self.truncated,
+            "ratio": round(self.output_tokens / self.input_tokens, 4) if self.input_tokens else 1.0,
+            "last": self.last,
+        }
+
+
+class CompactionMemo:
+    """Small LRU of compaction results, so back-to-back calls for the same
+    page (summary then suggest, or /api/insights) compact it once. Safe to
+    call from worker threads."""
+
+    def __init__(self, max_entries: int = 64) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compact(
+        self, dom: str, mode: str, user_prompt: Optional[str], token_budget: int
+    ) -> Tuple[str, Optional[CompactionReport]]:
+        """compact_dom, memoized; the report is None when served from memory."""
+        h = hashlib.sha256(dom.encode("utf-8", "surrogatepass"))
+        h.update(f"\x00{mode}\x00{user_prompt or ''}\x00{token_budget}".encode("utf-8", "surrogatepass"))
+        key = h.hexdigest()
+        with self._lock:
+            out = self._entries.get(key)
+            if out is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return out, None
+            self.misses += 1
+        out, report = compact_dom(dom, mode, user_prompt, token_budget)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = out
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return out, report
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,218 @@
+import gzip
+import json
+import zlib
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, Optional
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+
+try:  # zstd is optional: the stdlib module (3.14+) or the `zstandard` package
+    from compression import zstd as _zstd_stdlib  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - depends on the environment
+    _zstd_stdlib = None
+try:
+    import zstandard as _zstandard  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - depends on the environment
+    _zstandard = None
+
+# Decompressed bytes produced per step, so a small bomb cannot allocate much at once
+DECODE_CHUNK = 64 * 1024
+# Input per call for the `zstandard` binding, which cannot cap its output: an
+# RLE block turns ~4 bytes into 128 KiB, so this bounds one call to ~2 MiB
+ZSTD_INPUT_SLICE = 64
+
+
+def zstd_available() -> bool:
+    return _zstd_stdlib is not None or _zstandard is not None
+
+
+class _GzipDecoder:
+    def __init__(self) -> None:
+        self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        while data and not self._d.eof:
+            out = self._d.decompress(data, DECODE_CHUNK)
+            data = self._d.unconsumed_tail
+            if out:
+                yield out
+
+    @property
+    def complete(self) -> bool:
+        return self._d.eof
+
+
+class _ZstdDecoder:
+    def __init__(self) -> None:
+        if _zstd_stdlib is not None:
+            self._d = _zstd_stdlib.ZstdDecompressor()
+        else:
+            self._d = _zstandard.ZstdDecompressor().decompressobj()
+        self._done = False
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        if _zstd_stdlib is not None:
+            while not self._d.eof and (data or not self._d.needs_input):
+                out = self._d.decompress(data, DECODE_CHUNK)
+                data = b""
+                if out:
+                    yield out
+            self._done = self._d.eof
+            return
+        # zstandard cannot cap output per call; small input slices bound it instead
+        for i in range(0, len(data), ZSTD_INPUT_SLICE):
+            if self._d.eof:
+                break
+            out = self._d.decompress(data[i:i + ZSTD_INPUT_SLICE])
+            if out:
+                yield out
+        self._done = self._d.eof
+
+    @property
+    def complete(self) -> bool:
+        return self._done
+
+
+def _decoder(encoding: str) -> Optional[Any]:
+    if encoding in ("gzip", "x-gzip"):
+        return _GzipDecoder()
+    if encoding == "zstd" and zstd_available():
+        return _ZstdDecoder()
+    return None
+
+
+async def _send_error(send: Any, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class DecompressionMiddleware:
+    """Decodes `Content-Encoding: gzip` (and `zstd` when available) request
+    bodies as they stream in. The limit applies to the decoded size, so a
+    small compressed body cannot expand past `max_size`."""
+
+    def __init__(self, app: Any, max_size: int = 64 * 1024 * 1024) -> None:
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = Headers(scope=scope).get("content-encoding", "").strip().lower()
+        if encoding in ("", "identity"):
+            await self.app(scope, receive, send)
+            return
+        decoder = _decoder(encoding)
+        if decoder is None:
+            await _send_error(send, 415, f"unsupported content-encoding {encoding!r}")
+            return
+
+        # Handlers see a plain body of unknown length
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        scope = {**scope, "headers": headers}
+        pending: Deque[bytes] = deque()
+        decoded = 0
+        finished = False
+
+        async def receive_decoded() -> Dict[str, Any]:
+            nonlocal decoded, finished
+            if finished and not pending:
+                # Body done: later receives (http.disconnect) come from the server
+                return await receive()
+            while not pending and not finished:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                try:
+                    for out in decoder.feed(message.get("body", b"")):
+                        decoded += len(out)
+                        if decoded > self.max_size:
+                            raise HTTPException(status_code=413, detail=f"decoded request body over {self.max_size} bytes")
+                        pending.append(out)
+                except HTTPException:
+                    raise
+                except Exception as e:
+                    # zlib.error, or the zstd binding's own error type
+                    raise HTTPException(status_code=400, detail=f"invalid {encoding} body: {e}")
+                if not message.get("more_body", False):
+                    if not decoder.complete:
+                        raise HTTPException(status_code=400, detail=f"truncated {encoding} body")
+                    finished = True
+            body = pending.popleft() if pending else b""
+            return {"type": "http.request", "body": body, "more_body": bool(pending) or not finished}
+
+        await self.app(scope, receive_decoded, send)
+
+
+def _accepted(accept_encoding: str) -> set:
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    return accepted
+
+
+class CompressionMiddleware:
+    """Compresses JSON responses sent in one piece (zstd when the client
+    accepts it and it is available, else gzip). Streaming responses such as
+    SSE and NDJSON pass through untouched so every event is flushed as-is."""
+
+    def __init__(self, app: Any, minimum_size: int = 1024, gzip_level: int = 5, zstd_level: int = 3) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+
+    def _encoding(self, scope: Dict[str, Any]) -> Optional[str]:
+        accepted = _accepted(Headers(scope=scope).get("accept-encoding", ""))
+        if "zstd" in accepted and zstd_available():
+            return "zstd"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "gzip":
+            return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        if _zstd_stdlib is not None:
+            return _zstd_stdlib.compress(body, level=self.zstd_level)
+        return _zstandard.ZstdCompressor(level=self.zstd_level).compress(body)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        encoding = self._encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start: Optional[Dict[str, Any]] = None
+
+        async def send_compressed(message: Dict[str, Any]) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if headers.get("content-type", "").startswith("application/json") and "content-encoding" not in headers:
+                    # Held until the body shows whether it comes in one piece
+                    start = message
+                    return
+            elif message["type"] == "http.response.body" and start is not None:
+                held, start = start, None
+                body = message.get("body", b"")
+                if not message.get("more_body", False) and len(body) >= self.minimum_size:
+                    compressed = self._compress(body, encoding)
+                    headers = MutableHeaders(scope=held)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(compressed))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": compressed}
+                await send(held)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
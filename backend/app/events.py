@@ -0,0 +1,73 @@
+import asyncio
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+# (seq, sse event name or None for the default "message", JSON data)
+RunEvent = Tuple[int, Optional[str], str]
+
+
+class EventLog:
+    """Per-run ring buffer of events with monotonically increasing ids.
+
+    Every subscriber keeps its own cursor into the same log, so any number
+    of streams see every event (fan-out without per-subscriber copies) and a
+    reconnecting client resumes from its Last-Event-ID. Waiting subscribers
+    sleep on an asyncio.Event that is swapped on each append, so idle streams
+    cost nothing until there is something to send.
+    """
+
+    def __init__(self, capacity: int = 1000) -> None:
+        self._events: Deque[RunEvent] = deque(maxlen=max(1, capacity))
+        self._last_seq = 0
+        self._changed = asyncio.Event()
+        self.closed = False
+        self.subscribers = 0
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    @property
+    def first_seq(self) -> int:
+        return self._events[0][0] if self._events else self._last_seq + 1
+
+    def append(self, data: str, event: Optional[str] = None, seq: Optional[int] = None) -> int:
+        # An explicit seq mirrors an event numbered elsewhere (shared run backends)
+        self._last_seq = seq if seq is not None else self._last_seq + 1
+        self._events.append((self._last_seq, event, data))
+        if event == "done":
+            # A run's last event; streams end once they have sent it
+            self.closed = True
+        self._wake()
+        return self._last_seq
+
+    def close(self) -> None:
+        """No more events will be appended; wakes all waiters."""
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def since(self, after_seq: int) -> List[RunEvent]:
+        """Events with seq > after_seq still held in the buffer. If the
+        cursor fell behind the buffer, replay starts at the oldest event."""
+        if after_seq >= self._last_seq or not self._events:
+            return []
+        start = max(0, after_seq + 1 - self.first_seq)
+        if start == 0:
+            return list(self._events)
+        return [self._events[i] for i in range(start, len(self._events))]
+
+    async def wait(self, after_seq: int, timeout: Optional[float] = None) -> bool:
+        """Blocks until an event newer than `after_seq` exists (True), the log
+        is closed (True) or `timeout` passes (False)."""
+        if self._last_seq > after_seq or self.closed:
+            return True
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
@@ -0,0 +1,195 @@
+import asyncio
+import base64
+import hashlib
+import io
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, BinaryIO, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+try:  # Pillow is optional; without it screenshots are only deduped exactly
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None  # type: ignore[assignment]
+
+
+class ProcessedImage:
+    __slots__ = ("mime_type", "data_base64", "phash", "bytes_in", "bytes_out")
+
+    def __init__(self, mime_type: str, data_base64: str, phash: int, bytes_in: int, bytes_out: int) -> None:
+        self.mime_type = mime_type
+        self.data_base64 = data_base64
+        self.phash = phash
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+
+
+def _dhash(img: Any) -> int:
+    """64-bit difference hash: robust to rescaling and re-encoding."""
+    small = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# Base64 text from a JSON body, or a binary file such as a spooled multipart upload
+ImageData = Union[str, BinaryIO]
+
+
+def to_base64(data: ImageData) -> str:
+    if isinstance(data, str):
+        return data
+    data.seek(0)
+    return base64.b64encode(data.read()).decode("ascii")
+
+
+def process_image(mime_type: str, data: ImageData, max_edge: int, fmt: str, quality: int) -> ProcessedImage:
+    """Decode once, downscale to `max_edge`, re-encode. Runs in a worker.
+    Files are decoded straight from the file, without a bytes copy."""
+    if isinstance(data, str):
+        raw = base64.b64decode(data, validate=False)
+        source: BinaryIO = io.BytesIO(raw)
+        size = len(raw)
+    else:
+        source = data
+        size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+    if Image is None:
+        # Exact-content hash only; no resizing available
+        digest = int.from_bytes(hashlib.sha256(source.read()).digest()[:8], "big")
+        return ProcessedImage(mime_type, to_base64(data), digest, size, size)
+    with Image.open(source) as img:
+        # JPEGs can be decoded at a reduced scale, which keeps 4K frames out of memory
+        img.draft("RGB", (max_edge, max_edge))
+        img.load()
+        phash = _dhash(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        if fmt == "webp":
+            img.save(out, format="WEBP", quality=quality, method=4)
+        else:
+            img.save(out, format=fmt.upper(), quality=quality, optimize=True)
+    encoded = out.getvalue()
+    if len(encoded) >= size and mime_type.startswith("image/"):
+        # Re-encoding did not help (already small); keep the original bytes
+        return ProcessedImage(mime_type, to_base64(data), phash, size, size)
+    return ProcessedImage(f"image/{fmt}", base64.b64encode(encoded).decode("ascii"), phash, size, len(encoded))
+
+
+class ImagePipeline:
+    """Downscales, re-encodes and dedupes screenshots off the event loop.
+
+    Near-duplicates (by perceptual hash) of a screenshot already kept in the
+    same request are dropped, as are near-duplicates of screenshots recently
+    sent for the same URL, as long as the request keeps at least one image.
+    """
+
+    def __init__(
+        self,
+        max_edge: int = 1280,
+        fmt: str = "webp",
+        quality: int = 75,
+        max_distance: int = 4,
+        recent_urls: int = 256,
+        recent_per_url: int = 8,
+        workers: int = 2,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.max_edge = max_edge
+        self.fmt = fmt.lower()
+        self.quality = quality
+        self.max_distance = max_distance
+        self.recent_urls = recent_urls
+        self.recent_per_url = recent_per_url
+        self._executor = executor or ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="images")
+        self._recent: "OrderedDict[str, Deque[int]]" = OrderedDict()
+        self.images_in = 0
+        self.images_out = 0
+        self.duplicates_dropped = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def _is_near(self, phash: int, seen: Sequence[int]) -> bool:
+        return any(_hamming(phash, other) <= self.max_distance for other in seen)
+
+    async def process(
+        self, screenshots: Sequence[Tuple[str, ImageData]], page_url: Optional[str]
+    ) -> Tuple[List[Tuple[str, str]], Dict[str, int]]:
+        """Takes (mime_type, base64 or file) pairs; returns (mime_type, data_base64)
+        pairs plus a per-request report."""
+        loop = asyncio.get_running_loop()
+        jobs = [
+            loop.run_in_executor(self._executor, process_image, mime, data, self.max_edge, self.fmt, self.quality)
+            for mime, data in screenshots
+        ]
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+
+        recent = self._recent.get(page_url or "") if page_url else None
+        kept: List[ProcessedImage] = []
+        passthrough: List[Tuple[str, str]] = []
+        report = {"images_in": len(screenshots), "bytes_in": 0, "bytes_out": 0, "dropped": 0}
+        for (mime, data), res in zip(screenshots, results):
+            if isinstance(res, BaseException):
+                # Undecodable images are forwarded untouched; the upstream decides
+                self.failed += 1
+                passthrough.append((mime, to_base64(data)))
+                continue
+            report["bytes_in"] += res.bytes_in
+            if self._is_near(res.phash, [k.phash for k in kept]):
+                report["dropped"] += 1
+                continue
+            kept.append(res)
+
+        if recent and len(kept) > 1:
+            fresh = [k for k in kept if not self._is_near(k.phash, recent)]
+            report["dropped"] += len(kept) - max(len(fresh), 1)
+            kept = fresh or kept[:1]
+
+        if page_url:
+            ring = self._recent.setdefault(page_url, deque(maxlen=self.recent_per_url))
+            self._recent.move_to_end(page_url)
+            ring.extend(k.phash for k in kept)
+            while len(self._recent) > self.recent_urls:
+                self._recent.popitem(last=False)
+
+        out = [(k.mime_type, k.data_base64) for k in kept] + passthrough
+        report["bytes_out"] = sum(k.bytes_out for k in kept)
+        report["images_out"] = len(out)
+        self.images_in += report["images_in"]
+        self.images_out += len(out)
+        self.duplicates_dropped += report["dropped"]
+        self.bytes_in += report["bytes_in"]
+        self.bytes_out += report["bytes_out"]
+        return out, report
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pillow": self.available,
+            "max_edge": self.max_edge,
+            "format": self.fmt,
+            "quality": self.quality,
+            "images_in": self.images_in,
+            "images_out": self.images_out,
+            "duplicates_dropped": self.duplicates_dropped,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
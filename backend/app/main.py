@@ -1,60 +1,188 @@
 import asyncio
 import json
 import time
-import uuid
 import os
+from contextlib import asynccontextmanager
+import anyio
 from dotenv import load_dotenv
-from typing import Any, AsyncGenerator, Dict, List, Optional
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, Sequence, TypeVar
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel, Field
-import httpx
-
-
-class RunState:
-    IDLE = "idle"
-    RUNNING = "running"
-    PAUSED = "paused"
-    STOPPED = "stopped"
-    DONE = "done"
-
-
-class Run:
-    def __init__(self, task: str) -> None:
-        self.id: str = str(uuid.uuid4())
-        self.task: str = task
-        self.state: str = RunState.RUNNING
-        self.created_at: float = time.time()
-        self._queue: asyncio.Queue[str] = asyncio.Queue()
-        self._status_queue: asyncio.Queue[str] = asyncio.Queue()
-        self._worker: Optional[asyncio.Task[Any]] = None
-
-    async def log(self, message: str) -> None:
-        await self._queue.put(json.dumps({"type": "log", "message": message}))
-
-    async def chat(self, role: str, content: str) -> None:
-        payload = json.dumps({
-            "type": "chat",
-            "message": {
-                "role": role,
-                "content": content
-            }
-        })
-        await self._queue.put(payload)
-
-    async def set_state(self, next_state: str) -> None:
-        self.state = next_state
-        await self._status_queue.put(json.dumps({"state": self.state}))
-
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError, model_validator
+
+from .admission import (
+    BACKGROUND,
+    INTERACTIVE,
+    NORMAL,
+    PRIORITIES,
+    PRIORITY_NAMES,
+    ClientRateLimiter,
+    RequestBudget,
+    current_budget,
+    set_budget,
+    wait_for_disconnect,
+)
+from .budgets import OutputBudget
+from .cache import ResponseCache, content_key
+from .compaction import CompactionMemo, CompactionStats, estimate_tokens as estimate_text_tokens
+from .compression import CompressionMiddleware, DecompressionMiddleware
+from .images import ImagePipeline, to_base64
+from .metrics import Metrics, TimingMiddleware, mark_parsed, stage
+from .parsing import (
+    OUTPUT_SCHEMAS,
+    ReasoningContentParser,
+    SummaryItemParser,
+    parse_reasoning_and_content,
+    parse_structured_output,
+    split_summary_items,
+)
+from .prefetch import PrefetchJob, Prefetcher
+from .router import Attempt, FormatRejectedError, UpstreamRouter
+from .runs import Run, RunState
+from .runstore import run_backend_from_env
+from .scheduler import RunScheduler, load_planner
+from .similarity import NearDuplicateIndex, url_scope
+from .singleflight import SingleFlight
+from .snapshots import Snapshot, SnapshotStore, apply_delta, changed_regions
+from .sse import sse_event, stream_event_log
+from .upstream import UpstreamClient, env_bool, env_float, env_int
+from .uploads import UploadLimits, UploadedFile, read_multipart
 
-runs: Dict[str, Run] = {}
 
 # Load .env once at startup
 load_dotenv()
 
-app = FastAPI(title="Overlay Backend API", version="0.0.2")
+# Events kept per run for Last-Event-ID replay, and the idle heartbeat interval
+AGENT_EVENT_BUFFER = env_int("AGENT_EVENT_BUFFER", 1000)
+AGENT_HEARTBEAT_INTERVAL = env_float("AGENT_HEARTBEAT_INTERVAL", 15.0)
+# Events arriving this soon after the previous write share one chunk
+AGENT_SSE_COALESCE = env_float("AGENT_SSE_COALESCE_MS", 20.0) / 1000
+# Live agent runs are capped and expire; evicted ones are kept as small archived records.
+# AGENT_RUN_BACKEND=sqlite shares runs between uvicorn workers (see backend/app/runstore.py)
+runs = run_backend_from_env(event_buffer=AGENT_EVENT_BUFFER)
+# Executes run steps with a cap on concurrently running runs; the rest queue
+scheduler = RunScheduler(
+    load_planner(os.getenv("AGENT_PLANNER", "")),
+    max_concurrent=env_int("AGENT_MAX_CONCURRENT_RUNS", 64),
+    max_queued=env_int("AGENT_MAX_QUEUED_RUNS", 1000),
+    stop_grace=env_float("AGENT_STOP_GRACE", 2.0),
+)
+
+# One pooled client for every upstream call (see backend/app/upstream.py)
+upstream = UpstreamClient.from_env()
+# How long learned upstream capabilities (multimodal input, JSON schemas) are trusted
+CAPABILITY_TTL = env_float("UPSTREAM_CAPABILITY_TTL", 3600.0)
+# Spreads calls over OPENAI_BASE_URLS with circuit breaking, capability memory and hedging
+router = UpstreamRouter(
+    upstream,
+    base_urls=[
+        u.strip()
+        for u in (os.getenv("OPENAI_BASE_URLS") or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")).split(",")
+        if u.strip()
+    ],
+    failure_threshold=env_int("UPSTREAM_BREAKER_FAILURES", 5),
+    reset_timeout=env_float("UPSTREAM_BREAKER_RESET", 30.0),
+    capability_ttl=CAPABILITY_TTL,
+    hedge=env_bool("UPSTREAM_HEDGE", False),
+    hedge_min_delay=env_float("UPSTREAM_HEDGE_MIN_DELAY", 1.0),
+    hedge_default_delay=env_float("UPSTREAM_HEDGE_DEFAULT_DELAY", 8.0),
+)
+# Parsed results for summarize/suggest/analysis keyed by page content
+response_cache = ResponseCache.from_env()
+# Identical requests in flight share one upstream call
+inflight: SingleFlight[Dict[str, Any]] = SingleFlight()
+# Page text is compacted to this many (estimated) tokens before prompting; 0 disables
+COMPACT_TOKEN_BUDGET = env_int("COMPACT_TOKEN_BUDGET", 12000)
+# Larger pages are compacted on a worker thread, off the event loop
+COMPACT_THREAD_CHARS = env_int("COMPACT_THREAD_CHARS", 64 * 1024)
+compaction_stats = CompactionStats()
+compaction_memo = CompactionMemo(env_int("COMPACT_MEMO_ENTRIES", 64))
+# Recently analyzed page texts, so clients can send deltas against them
+snapshots = SnapshotStore(
+    max_entries=env_int("SNAPSHOT_MAX_ENTRIES", 512),
+    max_chars=env_int("SNAPSHOT_MAX_CHARS", 64 * 1024 * 1024),
+    ttl=env_float("SNAPSHOT_TTL", 1800.0),
+)
+# Screenshots are downscaled, re-encoded and deduped on a worker pool before upstream
+IMAGE_PIPELINE = env_bool("IMAGE_PIPELINE", True)
+images = ImagePipeline(
+    max_edge=env_int("IMAGE_MAX_EDGE", 1280),
+    fmt=os.getenv("IMAGE_FORMAT", "webp"),
+    quality=env_int("IMAGE_QUALITY", 75),
+    max_distance=env_int("IMAGE_DEDUPE_DISTANCE", 4),
+    workers=env_int("IMAGE_WORKERS", 2),
+)
+# Size limits for multipart uploads, enforced while the body streams in
+upload_limits = UploadLimits.from_env()
+# Latency histograms per endpoint and stage, served by GET /metrics
+metrics = Metrics()
+# Open analysis/batch SSE and NDJSON streams, by kind (agent streams count on the run)
+open_streams: Dict[str, int] = {"analysis": 0, "batch": 0}
+# Requests per minute per bearer token (or client address) before 429; 0 disables
+client_limits = ClientRateLimiter(rpm=env_float("CLIENT_RPM", 0.0), burst=env_int("CLIENT_BURST", 20))
+# /api/prefetch has its own per-client budget, so speculative work can never
+# use up (or borrow from) the one real requests draw on
+prefetch_limits = ClientRateLimiter(
+    rpm=env_float("PREFETCH_CLIENT_RPM", env_float("CLIENT_RPM", 0.0)), burst=env_int("PREFETCH_CLIENT_BURST", 20)
+)
+# Default time budget for analysis requests; X-Deadline-Ms can shorten it. 0 means none
+REQUEST_DEADLINE = env_float("REQUEST_DEADLINE_MS", 0.0) / 1000
+# JSON requests abandoned by the client or their deadline, whose work was cancelled
+abandoned: Dict[str, int] = {"disconnect": 0, "deadline": 0}
+# Speculative summary/suggest work from /api/prefetch. Jobs only start while
+# no more than PREFETCH_MAX_UPSTREAM_QUEUE real calls wait for an upstream slot
+PREFETCH_MAX_UPSTREAM_QUEUE = env_int("PREFETCH_MAX_UPSTREAM_QUEUE", 0)
+prefetcher = Prefetcher(
+    workers=env_int("PREFETCH_WORKERS", 2),
+    max_queue=env_int("PREFETCH_MAX_QUEUE", 32),
+    track=env_int("PREFETCH_TRACK", 1024),
+    busy=lambda: upstream.limiter.queue_depth > PREFETCH_MAX_UPSTREAM_QUEUE,
+)
+# Reuse of results across near-identical pages: "off", "serve" the closest
+# earlier page's result, or "revalidate" (serve it, refresh in the background).
+# Pages are only compared within a bucket of the same URL (or origin)
+NEAR_DUP = os.getenv("NEAR_DUP", "off").strip().lower()
+NEAR_DUP_SCOPE = os.getenv("NEAR_DUP_SCOPE", "url").strip().lower()
+near_index = NearDuplicateIndex(
+    threshold=env_float("NEAR_DUP_THRESHOLD", 0.9),
+    max_entries=env_int("NEAR_DUP_MAX_ENTRIES", 10000),
+)
+# Summary/suggest/analysis replies constrained to a JSON schema and parsed in
+# one pass; streams keep the text format their incremental parsers expect
+STRUCTURED_OUTPUT = env_bool("STRUCTURED_OUTPUT", False)
+structured_results = {"parsed": 0, "fallback": 0, "rejected": 0}
+# model -> when the upstream last refused its JSON schema; plain text is
+# requested for it until UPSTREAM_CAPABILITY_TTL has passed
+structured_rejected: Dict[str, float] = {}
+# max_output_tokens per mode, sized from recent reply lengths (at most OUTPUT_MAX_TOKENS)
+output_budget = OutputBudget(
+    cap=env_int("OUTPUT_MAX_TOKENS", 800),
+    floor=env_int("OUTPUT_MIN_TOKENS", 64),
+    quantile=env_float("OUTPUT_BUDGET_QUANTILE", 0.99),
+    headroom=env_float("OUTPUT_BUDGET_HEADROOM", 1.25),
+    window=env_int("OUTPUT_BUDGET_WINDOW", 200),
+    min_samples=env_int("OUTPUT_BUDGET_MIN_SAMPLES", 20),
+    adaptive=env_bool("OUTPUT_BUDGET_ADAPTIVE", True),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await upstream.start()
+    await runs.start()
+    try:
+        yield
+    finally:
+        await runs.close()
+        await upstream.aclose()
+        response_cache.close()
+        images.shutdown()
+
+
+app = FastAPI(title="Overlay Backend API", version="0.0.2", lifespan=lifespan)
 
 # CORS: during development we allow all origins.
 app.add_middleware(
@@ -63,49 +191,30 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache", "Server-Timing"],
 )
+# gzip/zstd request bodies, limited by their decoded size
+app.add_middleware(DecompressionMiddleware, max_size=env_int("REQUEST_MAX_DECODED_BYTES", 64 * 1024 * 1024))
+# Compressed JSON responses; streams are left alone
+if env_bool("RESPONSE_COMPRESSION", True):
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=env_int("RESPONSE_COMPRESS_MIN_BYTES", 1024),
+        gzip_level=env_int("RESPONSE_GZIP_LEVEL", 5),
+    )
+# Per-stage timings: Server-Timing header plus the histograms behind /metrics
+app.add_middleware(TimingMiddleware, metrics=metrics)
 
 
-async def sse_event(data: str, event: Optional[str] = None) -> str:
-    lines = []
-    if event:
-        lines.append(f"event: {event}")
-    for line in data.splitlines():
-        lines.append(f"data: {line}")
-    lines.append("")
-    return "\n".join(lines) + "\n"
-
-
-async def run_worker(run: Run) -> None:
-    try:
-        await run.log("Worker started")
-        await run.chat("assistant", f"Starting task: {run.task}")
-        steps = [
-            "Analyzing the page…",
-            "Planning actions…",
-            "Executing step 1…",
-            "Executing step 2…",
-            "Finalizing…",
-        ]
-        for step in steps:
-            # Pause loop
-            while run.state == RunState.PAUSED:
-                await asyncio.sleep(0.2)
-            if run.state in (RunState.STOPPED, RunState.DONE):
-                break
-            await run.log(step)
-            await asyncio.sleep(0.8)
-
-        if run.state not in (RunState.STOPPED,):
-            await run.chat("assistant", "Task completed successfully.")
-            await run.set_state(RunState.DONE)
-            await run.log("Worker finished")
-    except asyncio.CancelledError:
-        # Propagate cancellation
-        raise
-    except Exception as e:
-        await run.log(f"Worker error: {e}")
-        await run.set_state("error")
+async def live_run(run_id: str) -> Run:
+    run = await runs.get(run_id)
+    if run:
+        if run.finished:
+            raise HTTPException(status_code=409, detail="run has already finished")
+        return run
+    if await runs.lookup(run_id):
+        raise HTTPException(status_code=409, detail="run has been archived")
+    raise HTTPException(status_code=404, detail="run not found")
 
 
 @app.post("/api/agent/start")
@@ -113,19 +222,22 @@ async def start_agent(payload: Dict[str, Any]) -> Dict[str, Any]:
     task = str(payload.get("task") or "")
     if not task:
         raise HTTPException(status_code=400, detail="task is required")
-    run = Run(task=task)
-    runs[run.id] = run
-    await run.set_state(RunState.RUNNING)
-    run._worker = asyncio.create_task(run_worker(run))
+    # Reserved before the run exists, so a full queue never leaves it without a worker
+    scheduler.reserve()
+    try:
+        run = await runs.create(task)
+        await run.set_state(RunState.RUNNING)
+    except BaseException:
+        scheduler.release()
+        raise
+    scheduler.submit(run, reserved=True)
     return {"runId": run.id}
 
 
 @app.post("/api/agent/pause")
 async def pause_agent(payload: Dict[str, Any]) -> Dict[str, Any]:
     run_id = str(payload.get("runId") or "")
-    run = runs.get(run_id)
-    if not run:
-        raise HTTPException(status_code=404, detail="run not found")
+    run = await live_run(run_id)
     await run.set_state(RunState.PAUSED)
     await run.log("Paused by user")
     return {"ok": True}
@@ -134,9 +246,7 @@ async def pause_agent(payload: Dict[str, Any]) -> Dict[str, Any]:
 @app.post("/api/agent/resume")
 async def resume_agent(payload: Dict[str, Any]) -> Dict[str, Any]:
     run_id = str(payload.get("runId") or "")
-    run = runs.get(run_id)
-    if not run:
-        raise HTTPException(status_code=404, detail="run not found")
+    run = await live_run(run_id)
     await run.set_state(RunState.RUNNING)
     await run.log("Resumed by user")
     return {"ok": True}
@@ -145,52 +255,66 @@ async def resume_agent(payload: Dict[str, Any]) -> Dict[str, Any]:
 @app.post("/api/agent/stop")
 async def stop_agent(payload: Dict[str, Any]) -> Dict[str, Any]:
     run_id = str(payload.get("runId") or "")
-    run = runs.get(run_id)
-    if not run:
-        raise HTTPException(status_code=404, detail="run not found")
+    run = await live_run(run_id)
     await run.set_state(RunState.STOPPED)
     await run.log("Stopped by user")
-    if run._worker and not run._worker.done():
-        run._worker.cancel()
-        try:
-            await run._worker
-        except asyncio.CancelledError:
-            pass
+    await scheduler.join(run)
+    await run.finish()
     return {"ok": True}
 
 
-@app.get("/api/agent/stream")
-async def stream_agent(runId: str, request: Request) -> StreamingResponse:
-    run = runs.get(runId)
+@app.get("/api/agent/status")
+async def agent_status(runId: str) -> Dict[str, Any]:
+    run = await runs.lookup(runId)
     if not run:
         raise HTTPException(status_code=404, detail="run not found")
+    return run.summary()
+
+
+@app.get("/api/agent/stats")
+async def agent_stats() -> Dict[str, Any]:
+    return {**await runs.stats(), "scheduler": scheduler.stats()}
+
+
+@app.get("/api/agent/stream")
+async def stream_agent(runId: str, request: Request, lastEventId: Optional[int] = None) -> Response:
+    # EventSource sends Last-Event-ID when it reconnects; the query param is for manual resumes
+    header_id = request.headers.get("last-event-id", "")
+    cursor = int(header_id) if header_id.isdigit() else (lastEventId or 0)
+
+    run = await runs.get(runId)
+    if not run:
+        archived = await runs.lookup(runId)
+        if not archived:
+            raise HTTPException(status_code=404, detail="run not found")
+        if cursor >= archived.events:
+            # 204 is the one answer that stops EventSource from reconnecting
+            return Response(status_code=204)
+
+        async def archived_status() -> AsyncGenerator[bytes, None]:
+            # The event buffer is gone; the final state is all there is to send
+            data = json.dumps({"state": archived.state})
+            frames = sse_event(data, event="status") + sse_event(data, event="done", id=archived.events)
+            yield frames.encode()
+
+        return StreamingResponse(archived_status(), media_type="text/event-stream")
+
+    if run.events.closed and cursor >= run.events.last_seq:
+        # Reconnect after the final `done` event: nothing left to send
+        return Response(status_code=204)
 
     async def event_generator() -> AsyncGenerator[bytes, None]:
-        status_queue = run._status_queue
-        queue = run._queue
-        # Send initial status
-        yield (await sse_event(json.dumps({"state": run.state}), event="status")).encode()
+        run.events.subscribers += 1
         try:
-            while True:
-                if await request.is_disconnected():
-                    break
-                # Prefer status messages first to keep UI state fresh
-                try:
-                    status_msg = status_queue.get_nowait()
-                    yield (await sse_event(status_msg, event="status")).encode()
-                    continue
-                except asyncio.QueueEmpty:
-                    pass
-
-                try:
-                    msg = await asyncio.wait_for(queue.get(), timeout=0.5)
-                    yield (await sse_event(msg)).encode()
-                except asyncio.TimeoutError:
-                    # Periodic heartbeat to keep connection alive
-                    yield (await sse_event(json.dumps({"type": "ping", "t": time.time()}))).encode()
+            # Send initial status
+            yield sse_event(json.dumps({"state": run.state}), event="status").encode()
+            frames = stream_event_log(
+                run.events, cursor, request.is_disconnected, AGENT_HEARTBEAT_INTERVAL, AGENT_SSE_COALESCE
+            )
+            async for chunk in frames:
+                yield chunk
         finally:
-            # On disconnect, do nothing special
-            ...
+            run.events.subscribers -= 1
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -207,11 +331,36 @@ class Screenshot(BaseModel):
     data_base64: str = Field(..., description="Base64-encoded image data (no data URI prefix)")
 
 
+class DeltaHunk(BaseModel):
+    start: int = Field(..., ge=0, description="First base line replaced (lines are dom_html.split('\\n'))")
+    end: int = Field(..., ge=0, description="One past the last base line replaced; equal to start for a pure insert")
+    lines: List[str] = Field(default_factory=list)
+
+
+class PageDelta(BaseModel):
+    hunks: List[DeltaHunk] = Field(default_factory=list)
+
+
 class AnalysisRequest(BaseModel):
     page_url: Optional[str] = None
-    dom_html: str
+    dom_html: str = ""
     screenshots: List[Screenshot] = Field(default_factory=list)
     user_prompt: Optional[str] = Field(default=None, description="Optional instruction or question from the user")
+    base_snapshot_id: Optional[str] = Field(default=None, description="snapshot_id of a previous response; send with delta instead of dom_html")
+    delta: Optional[PageDelta] = None
+    # Set on the framed delta prompt built by focus_on_changes, which is
+    # already within budget and must not be compacted again
+    _framed: bool = PrivateAttr(default=False)
+
+    @model_validator(mode="after")
+    def _page_or_delta(self) -> "AnalysisRequest":
+        if self.delta is not None and not self.base_snapshot_id:
+            raise ValueError("delta requires base_snapshot_id")
+        if self.base_snapshot_id and self.delta is None:
+            raise ValueError("base_snapshot_id requires delta")
+        if not self.dom_html and not self.base_snapshot_id:
+            raise ValueError("dom_html is required (or base_snapshot_id with delta)")
+        return self
 
 
 class Suggestion(BaseModel):
@@ -223,6 +372,8 @@ class AnalysisResponse(BaseModel):
     suggestions: List[Suggestion]
     model: str
     usage_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    snapshot_id: Optional[str] = None
 
 
 class SuggestResponse(BaseModel):
@@ -230,6 +381,8 @@ class SuggestResponse(BaseModel):
     content: str
     model: str
     usage_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    snapshot_id: Optional[str] = None
 
 
 def get_gpt_settings() -> Dict[str, str]:
@@ -240,21 +393,32 @@ def get_gpt_settings() -> Dict[str, str]:
     }
 
 
-async def call_gpt_api(payload: Dict[str, Any]) -> Dict[str, Any]:
-    settings = get_gpt_settings()
-    api_key = settings["api_key"]
+def gpt_headers() -> Dict[str, str]:
+    api_key = get_gpt_settings()["api_key"]
     if not api_key:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY not configured")
-    headers = {
+    return {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
-    url = f"{settings['base_url'].rstrip('/')}/responses"
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        if resp.status_code >= 400:
-            raise HTTPException(status_code=resp.status_code, detail=resp.text)
-        return resp.json()
+
+
+async def call_gpt_api(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return await router.complete([("text", payload)], gpt_headers())
+
+
+@app.get("/api/upstream/stats")
+async def upstream_stats() -> Dict[str, Any]:
+    return {
+        **upstream.stats(),
+        "router": router.stats(),
+        "admission": {"request_deadline_s": REQUEST_DEADLINE or None, "clients": client_limits.stats(), "prefetch_clients": prefetch_limits.stats(), "abandoned": abandoned},
+    }
+
+
+# Hard ceiling on page text in a prompt; compaction normally keeps it far smaller
+MAX_DOM_CHARS = 120000
+DEFAULT_USER_PROMPT = "Please analyze this page and suggest next UI actions."
 
 
 def build_input_text(req: AnalysisRequest) -> str:
@@ -264,16 +428,17 @@ def build_input_text(req: AnalysisRequest) -> str:
         "actions with rationale."
     )
 
-    max_dom_chars = 120000
-    dom_excerpt = req.dom_html[:max_dom_chars]
-    user_prompt = req.user_prompt or "Please analyze this page and suggest next UI actions."
+    dom_excerpt = req.dom_html[:MAX_DOM_CHARS]
+    user_prompt = req.user_prompt or DEFAULT_USER_PROMPT
 
+    # Stable page content first and the instruction last, so calls for the same
+    # page in different modes share a prefix the upstream can cache
     parts: List[str] = [
         f"[SYSTEM]\n{system_prompt}",
         f"[URL]\n{req.page_url or 'unknown'}",
-        f"[INSTRUCTION]\n{user_prompt}",
         "[DOM_TRUNCATED]",
         dom_excerpt,
+        f"[INSTRUCTION]\n{user_prompt}",
     ]
     # Note: screenshots omitted in text mode to maximize compatibility
     return "\n\n".join(parts)
@@ -289,12 +454,10 @@ def build_input_blocks(req: AnalysisRequest) -> List[Dict[str, Any]]:
     blocks: List[Dict[str, Any]] = [
         {"type": "text", "text": f"[SYSTEM]\n{system_prompt}"},
         {"type": "text", "text": f"[URL]\n{req.page_url or 'unknown'}"},
-        {"type": "text", "text": (req.user_prompt or "Please analyze this page and suggest next UI actions.")},
     ]
 
     # Attach DOM content (truncate to keep payload reasonable)
-    max_dom_chars = 120000
-    dom_excerpt = req.dom_html[:max_dom_chars]
+    dom_excerpt = req.dom_html[:MAX_DOM_CHARS]
     blocks.append({"type": "text", "text": f"[DOM_TRUNCATED]\n{dom_excerpt}"})
 
     # Attach screenshots as image blocks if provided (multimodal)
@@ -309,93 +472,22 @@ def build_input_blocks(req: AnalysisRequest) -> List[Dict[str, Any]]:
             },
         })
 
+    # Instruction last, after the page and screenshots (see build_input_text)
+    blocks.append({"type": "text", "text": (req.user_prompt or DEFAULT_USER_PROMPT)})
     return blocks
 
 
-@app.post("/api/analysis", response_model=AnalysisResponse)
-async def analyze_page(req: AnalysisRequest) -> AnalysisResponse:
-    settings = get_gpt_settings()
-    # Prefer multimodal when screenshots provided; fallback to text-only on 400
-    use_blocks = len(req.screenshots) > 0
-    data: Dict[str, Any]
-    try:
-        if use_blocks:
-            payload_blocks = {
-                "model": settings["model"],
-                "input": build_input_blocks(req),
-                "reasoning": {"effort": "minimal"},
-                "text": {"verbosity": "low"},
-                "max_output_tokens": 800,
-            }
-            data = await call_gpt_api(payload_blocks)
-        else:
-            raise HTTPException(status_code=599, detail="skip-to-text")
-    except HTTPException as he:
-        if he.status_code in (400, 415, 422, 599):
-            input_text = build_input_text(req)
-            payload_text = {
-                "model": settings["model"],
-                "input": input_text,
-                "reasoning": {"effort": "minimal"},
-                "text": {"verbosity": "low"},
-                "max_output_tokens": 800,
-            }
-            data = await call_gpt_api(payload_text)
-        else:
-            raise
-
-    # Extract text from Responses API
-    text = ""
-    usage_tokens: Optional[int] = None
-    try:
-        # Try SDK-like output_text if present
-        text = data.get("output_text") or ""
-    except Exception:
-        text = ""
-    if not text:
-        # Fallback: concatenate output items or raw data
-        try:
-            if isinstance(data.get("output"), list):
-                parts: List[str] = []
-                for item in data["output"]:
-                    if item.get("type") == "message":
-                        # message may contain array of content parts
-                        for c in item.get("content", []):
-                            if c.get("type") == "output_text" and "text" in c:
-                                parts.append(str(c["text"]))
-                    elif item.get("type") == "output_text" and "text" in item:
-                        parts.append(str(item["text"]))
-                text = "\n".join([p for p in parts if p])
-        except Exception:
-            text = ""
-    try:
-        usage_tokens = int(data.get("usage", {}).get("total_tokens"))
-    except Exception:
-        usage_tokens = None
-
-    # Very light parsing: split into bullet-like suggestions
-    lines = [l.strip(" -•\t") for l in text.splitlines() if l.strip()]
-    suggestions = [Suggestion(description=l, actions=[]) for l in lines[:10]]
-
-    return AnalysisResponse(suggestions=suggestions, model=settings["model"], usage_tokens=usage_tokens)
-
-
 # --------- Specialized endpoints: summarize and suggest ---------
 
 class SummaryResponse(BaseModel):
     summary: List[str]
     model: str
     usage_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    snapshot_id: Optional[str] = None
 
 
-async def run_responses_api(req: AnalysisRequest, mode: str) -> Dict[str, Any]:
-    """mode: 'summary' | 'suggest'
-    Reuses the multimodal-with-fallback flow, but changes the instruction.
-    """
-    settings = get_gpt_settings()
-
-    base_instruction = (
-        """Analyze this page and determine if it's a news source (news website, article, blog, etc.). 
+SUMMARY_INSTRUCTION = """Analyze this page and determine if it's a news source (news website, article, blog, etc.). 
 
 If it's a news source, extract each news story/article as a separate bullet point. Each bullet should be a complete news item with: headline, brief summary (1-2 sentences), and key details.
 
@@ -407,46 +499,139 @@ EXAMPLES for news sources:
 • "Local Hospital Expands Emergency Services - City General Hospital opened a new 24-bed emergency wing to address growing patient demand. The expansion includes state-of-the-art trauma facilities and will create 50 new healthcare jobs."
 
 If it's NOT a news source, write a concise description of the page content that begins with 'This page contains'. Focus on factual information visible in the UI: key entities, values, labels, statuses, deadlines, totals, and noteworthy items. Use present tense, neutral tone. Do not describe layout or visuals. Avoid jargon and do not mention DOM, HTML, or screenshots."""
-        if mode == "summary"
-        else (
-            "Identify the main activity on this page and propose the next concrete actions that I, the AI assistant, can take to move it forward. Prioritize high-impact, assistant-executable steps. If the context is a message/email/chat composer or reply view, include a concise draft reply. Keep suggestions specific and safe; avoid low-value navigation tips. Write in paragraphs rather than bullet points."
-            "\n\nSTRICT FORMAT:\nReasoning: 2–4 sentences describing how I can help you next (assistant actions only; no meta commentary).\nContent: a short, well-formed paragraph with the drafted reply email/message if applicable; otherwise 'n/a'."
-        )
-    )
-    # Build text
-    req_for_text = AnalysisRequest(
-        page_url=req.page_url,
-        dom_html=req.dom_html,
-        screenshots=req.screenshots,
-        user_prompt=base_instruction,
-    )
 
-    # Prefer multimodal if screenshots provided; fallback to text-only
-    use_blocks = len(req.screenshots) > 0
-    try:
-        if use_blocks:
-            blocks = build_input_blocks(req_for_text)
-            payload_blocks = {
-                "model": settings["model"],
-                "input": blocks,
-                "reasoning": {"effort": "minimal"},
-                "text": {"verbosity": "low"},
-                "max_output_tokens": 800,
-            }
-            return await call_gpt_api(payload_blocks)
-        raise HTTPException(status_code=599, detail="skip-to-text")
-    except HTTPException as he:
-        if he.status_code in (400, 415, 422, 599):
-            text_input = build_input_text(req_for_text)
-            payload_text = {
+SUGGEST_TASK = "Identify the main activity on this page and propose the next concrete actions that I, the AI assistant, can take to move it forward. Prioritize high-impact, assistant-executable steps. If the context is a message/email/chat composer or reply view, include a concise draft reply. Keep suggestions specific and safe; avoid low-value navigation tips. Write in paragraphs rather than bullet points."
+SUGGEST_INSTRUCTION = (
+    SUGGEST_TASK
+    + "\n\nSTRICT FORMAT:\nReasoning: 2–4 sentences describing how I can help you next (assistant actions only; no meta commentary).\nContent: a short, well-formed paragraph with the drafted reply email/message if applicable; otherwise 'n/a'."
+)
+
+# Appended to the instruction in structured mode, naming the schema's fields
+STRUCTURED_HINTS = {
+    "summary": "Return each bullet point (or the single description) as one string in `summary`, without bullet characters.",
+    "suggest": "Return `reasoning`: 2–4 sentences describing how I can help you next (assistant actions only; no meta commentary), and `content`: a short, well-formed paragraph with the drafted reply email/message if applicable; otherwise 'n/a'.",
+    "analysis": "Return each suggestion in `suggestions` with a one-sentence `description` and the concrete UI `actions` it takes.",
+}
+
+
+def mode_instruction(req: AnalysisRequest, mode: str, structured: bool = False) -> Optional[str]:
+    if mode == "summary":
+        instruction = SUMMARY_INSTRUCTION
+    elif mode == "suggest":
+        instruction = SUGGEST_TASK if structured else SUGGEST_INSTRUCTION
+    else:
+        # 'analysis' keeps the caller's own prompt
+        instruction = req.user_prompt
+    if not structured:
+        return instruction
+    return f"{instruction or DEFAULT_USER_PROMPT}\n\n{STRUCTURED_HINTS[mode]}"
+
+
+def structured_supported(model: str) -> bool:
+    rejected = structured_rejected.get(model)
+    return rejected is None or time.monotonic() - rejected > CAPABILITY_TTL
+
+
+def output_format(mode: str, model: str, stream: bool) -> Dict[str, Any]:
+    """The payload's `text` settings: a strict JSON schema in structured mode."""
+    if not STRUCTURED_OUTPUT or stream or mode not in OUTPUT_SCHEMAS or not structured_supported(model):
+        return {"verbosity": "low"}
+    return {
+        "format": {"type": "json_schema", "name": f"{mode}_result", "schema": OUTPUT_SCHEMAS[mode], "strict": True},
+        "verbosity": "low",
+    }
+
+
+async def compact_page(dom_html: str, mode: str, user_prompt: Optional[str], token_budget: int = 0) -> str:
+    # summary and suggest compact the page the same way, keeping their prompt prefixes identical
+    compaction_mode = "page" if mode in ("summary", "suggest") else mode
+    args = (dom_html, compaction_mode, user_prompt, token_budget or COMPACT_TOKEN_BUDGET)
+    if len(dom_html) > COMPACT_THREAD_CHARS:
+        dom_html, report = await anyio.to_thread.run_sync(compaction_memo.compact, *args)
+    else:
+        dom_html, report = compaction_memo.compact(*args)
+    if report is not None:
+        compaction_stats.record(report)
+    return dom_html
+
+
+async def build_payloads(req: AnalysisRequest, mode: str, stream: bool = False) -> List[Attempt]:
+    """Upstream payloads to try in order: multimodal first when screenshots
+    are provided, then text-only. Streams get the full output allowance,
+    since a cut-off stream cannot be retried unseen."""
+    settings = get_gpt_settings()
+    text_format = output_format(mode, settings["model"], stream)
+
+    dom_html = req.dom_html
+    if COMPACT_TOKEN_BUDGET > 0 and not req._framed:
+        dom_html = await compact_page(dom_html, mode, req.user_prompt)
+
+    # Build text; model_copy shares the screenshot strings instead of revalidating them
+    req_for_text = req.model_copy(
+        update={
+            "dom_html": dom_html,
+            "user_prompt": mode_instruction(req, mode, "format" in text_format),
+            "base_snapshot_id": None,
+            "delta": None,
+        }
+    )
+    inputs: List[tuple[str, Any]] = []
+    if req.screenshots:
+        inputs.append(("multimodal", build_input_blocks(req_for_text)))
+    inputs.append(("text", build_input_text(req_for_text)))
+    return [
+        (
+            kind,
+            {
                 "model": settings["model"],
-                "input": text_input,
+                "input": input_value,
                 "reasoning": {"effort": "minimal"},
-                "text": {"verbosity": "low"},
-                "max_output_tokens": 800,
-            }
-            return await call_gpt_api(payload_text)
-        raise
+                "text": text_format,
+                "max_output_tokens": output_budget.cap if stream else output_budget.for_mode(mode),
+            },
+        )
+        for kind, input_value in inputs
+    ]
+
+
+async def run_responses_api(req: AnalysisRequest, mode: str) -> Dict[str, Any]:
+    """mode: 'summary' | 'suggest' | 'analysis'
+    Reuses the multimodal-with-fallback flow, but changes the instruction.
+    The router skips the multimodal attempt for upstreams known to reject it.
+    """
+    with stage("prompt"):
+        attempts = await build_payloads(req, mode)
+    try:
+        data = await router.complete(attempts, gpt_headers())
+    except FormatRejectedError:
+        # The schema was refused, not the page: ask for plain text, which the
+        # text parsers handle, and stop sending the schema to this model
+        structured_results["rejected"] += 1
+        structured_rejected[str(attempts[0][1]["model"])] = time.monotonic()
+        with stage("prompt"):
+            attempts = await build_payloads(req, mode)
+        data = await router.complete(attempts, gpt_headers())
+    truncated = output_truncated(data)
+    output_budget.observe(mode, extract_output_tokens(data), truncated)
+    if truncated and attempts[0][1]["max_output_tokens"] < output_budget.cap:
+        # The adaptive budget was too tight for this page: retry once at the cap
+        output_budget.retries[mode] = output_budget.retries.get(mode, 0) + 1
+        attempts = [(kind, {**payload, "max_output_tokens": output_budget.cap}) for kind, payload in attempts]
+        data = await router.complete(attempts, gpt_headers())
+        output_budget.observe(mode, extract_output_tokens(data), output_truncated(data))
+    return data
+
+
+def output_truncated(data: Dict[str, Any]) -> bool:
+    details = data.get("incomplete_details") or {}
+    return data.get("status") == "incomplete" and details.get("reason") == "max_output_tokens"
+
+
+def extract_output_tokens(data: Dict[str, Any]) -> Optional[int]:
+    try:
+        return int(data["usage"]["output_tokens"])
+    except (KeyError, TypeError, ValueError):
+        return None
 
 
 def extract_output_text(data: Dict[str, Any]) -> tuple[str, Optional[int]]:
@@ -468,93 +653,921 @@ def extract_output_text(data: Dict[str, Any]) -> tuple[str, Optional[int]]:
     return text, usage_tokens
 
 
-@app.post("/api/summarize", response_model=SummaryResponse)
-async def summarize_page(req: AnalysisRequest) -> SummaryResponse:
-    data = await run_responses_api(req, mode="summary")
+def split_suggestion_lines(text: str) -> List[Suggestion]:
+    # Very light parsing: split into bullet-like suggestions
+    lines = [l.strip(" -•\t") for l in text.splitlines() if l.strip()]
+    return [Suggestion(description=l, actions=[]) for l in lines[:10]]
+
+
+def extract_cached_tokens(data: Dict[str, Any]) -> Optional[int]:
+    """Prompt tokens the upstream served from its prefix cache, if reported."""
+    details = (data.get("usage") or {}).get("input_tokens_details") or {}
+    try:
+        return int(details["cached_tokens"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def count_usage(model: str, usage_tokens: Optional[int], cached_tokens: Optional[int] = None) -> None:
+    if usage_tokens:
+        metrics.usage_tokens.inc(model, amount=usage_tokens)
+    if cached_tokens:
+        metrics.cached_tokens.inc(model, amount=cached_tokens)
+
+
+def parse_mode_output(data: Dict[str, Any], mode: str, model: str) -> BaseModel:
+    with stage("parse_output"):
+        return _parse_mode_output(data, mode, model)
+
+
+def _parse_mode_output(data: Dict[str, Any], mode: str, model: str) -> BaseModel:
     text, usage_tokens = extract_output_text(data)
-    # Split summary text into list items. Prefer bullet/line splits, fallback to sentences.
-    items: List[str] = []
-    raw_lines = [l.strip() for l in (text or "").splitlines()]
-    for raw in raw_lines:
-        if not raw:
-            continue
-        # Split by common bullet separators within a line
-        parts = [p.strip() for p in raw.split("•")]
-        for p in parts:
-            if not p:
-                continue
-            items.append(p.lstrip("-• \t"))
-    # If still empty, fall back to splitting sentences.
-    if not items:
-        # naive sentence split on period/question/exclamation
-        buf = []
-        s = (text or "").strip()
-        cur = ""
-        for ch in s:
-            cur += ch
-            if ch in ".!?":
-                part = cur.strip()
-                if part:
-                    buf.append(part)
-                cur = ""
-        tail = cur.strip()
-        if tail:
-            buf.append(tail)
-        items = [b for b in (x.strip() for x in buf) if b]
-    # Normalize and cap list size
-    items = [i.strip().rstrip("-• ") for i in items]
-    items = [i for i in items if i]
-    items = items[:10]
-    return SummaryResponse(summary=items, model=get_gpt_settings()["model"], usage_tokens=usage_tokens)
-
-
-def parse_reasoning_and_content(text: str) -> tuple[str, str]:
-    # Expecting sections labeled "Reasoning:" and "Content:" per the strict format
-    lines = [l.rstrip() for l in text.splitlines()]
-    reasoning: List[str] = []
-    content_lines: List[str] = []
-    mode: Optional[str] = None
-    for raw in lines:
-        line = raw.strip()
-        if not line:
-            # preserve blank lines only for content accumulation
-            if mode == "content":
-                content_lines.append("")
-            continue
-        lower = line.lower()
-        if lower.startswith("reasoning:"):
-            mode = "reasoning"
-            after = line[len("Reasoning:"):].strip()
-            if after:
-                reasoning.append(after.lstrip("-• "))
-            continue
-        if lower.startswith("content:"):
-            mode = "content"
-            after = line[len("Content:"):].strip()
-            if after:
-                content_lines.append(after)
-            continue
-        if mode == "reasoning":
-            reasoning.append(line.lstrip("-• \t"))
-        elif mode == "content":
-            content_lines.append(raw)
-    # Post-process
-    reasoning = [r for r in (s.strip() for s in reasoning) if r]
-    # Join reasoning lines into one paragraph
-    reasoning_paragraph = " ".join(reasoning).strip()
-    # Normalize whitespace
-    reasoning_paragraph = " ".join(reasoning_paragraph.split())
-    content = "\n".join(content_lines).strip()
-    if not content:
-        content = "n/a"
-    return reasoning_paragraph, content
+    cached_tokens = extract_cached_tokens(data)
+    count_usage(model, usage_tokens, cached_tokens)
+    usage = {"model": model, "usage_tokens": usage_tokens, "cached_tokens": cached_tokens}
+    # Plain-text replies (streams, or a model that refused the schema) skip this
+    if STRUCTURED_OUTPUT and mode in OUTPUT_SCHEMAS and text.lstrip().startswith("{"):
+        fields = parse_structured_output(text, mode)
+        structured_results["parsed" if fields is not None else "fallback"] += 1
+        if fields is not None:
+            if mode == "summary":
+                return SummaryResponse(**fields, **usage)
+            if mode == "suggest":
+                return SuggestResponse(**fields, **usage)
+            return AnalysisResponse(**fields, **usage)
+    if mode == "summary":
+        return SummaryResponse(summary=split_summary_items(text), **usage)
+    if mode == "suggest":
+        reasoning, content = parse_reasoning_and_content(text)
+        return SuggestResponse(reasoning=reasoning, content=content, **usage)
+    return AnalysisResponse(suggestions=split_suggestion_lines(text), **usage)
+
+
+def resolve_snapshot(
+    req: AnalysisRequest,
+) -> tuple[AnalysisRequest, Snapshot, Optional[tuple[Snapshot, List[tuple[int, int]]]]]:
+    """Expands a `{base_snapshot_id, delta}` request to the full page and
+    records the page as a snapshot. Returns (full_request, snapshot, base)
+    where base is (base_snapshot, changed_line_ranges) for delta requests."""
+    with stage("snapshot"):
+        return _resolve_snapshot(req)
+
+
+def _resolve_snapshot(
+    req: AnalysisRequest,
+) -> tuple[AnalysisRequest, Snapshot, Optional[tuple[Snapshot, List[tuple[int, int]]]]]:
+    base_info = None
+    if req.base_snapshot_id:
+        base = snapshots.get(req.base_snapshot_id)
+        if base is None:
+            snapshots.delta_misses += 1
+            raise HTTPException(status_code=409, detail="snapshot not found; resend the full dom_html")
+        hunks = req.delta.hunks if req.delta else []
+        text, changed = apply_delta(base.text, hunks)
+        snapshots.delta_requests += 1
+        sent = sum(len(line) for h in hunks for line in h.lines)
+        snapshots.delta_chars_saved += max(0, len(text) - sent)
+        req = req.model_copy(update={"dom_html": text, "base_snapshot_id": None, "delta": None})
+        base_info = (base, changed)
+    snap = snapshots.put(req.dom_html, req.page_url)
+    return req, snap, base_info
+
+
+def render_result(result: Dict[str, Any]) -> str:
+    if "summary" in result:
+        return "\n".join(f"• {item}" for item in result["summary"])
+    if "reasoning" in result:
+        return f"Reasoning: {result['reasoning']}\nContent: {result['content']}"
+    return "\n".join(f"- {s['description']}" for s in result.get("suggestions", []))
+
+
+async def focus_on_changes(
+    req: AnalysisRequest, mode: str, base_info: Optional[tuple[Snapshot, List[tuple[int, int]]]]
+) -> AnalysisRequest:
+    """For small deltas against a page we already analyzed in this mode, send
+    the previous result plus only the changed regions instead of the page.
+    Only the changed regions are compacted, to what the previous result
+    leaves of the budget."""
+    if base_info is None:
+        return req
+    base, changed = base_info
+    previous = base.results.get(mode)
+    if previous is None:
+        return req
+    changed_lines = sum(end - start for start, end in changed)
+    if changed_lines * 2 > req.dom_html.count("\n") + 1:
+        return req
+    rendered = render_result(previous)
+    regions = changed_regions(req.dom_html, changed)
+    if COMPACT_TOKEN_BUDGET > 0:
+        budget = max(COMPACT_TOKEN_BUDGET // 2, COMPACT_TOKEN_BUDGET - estimate_text_tokens(rendered))
+        regions = await compact_page(regions, mode, req.user_prompt, budget)
+    text = "\n\n".join([
+        "[PREVIOUS RESULT FOR UNCHANGED CONTENT]",
+        rendered,
+        "[CHANGED REGIONS]",
+        regions,
+        "[NOTE]\nThe page was analyzed before and only the changed regions are shown. "
+        "Return the complete, updated result in the same format, keeping the parts of "
+        "the previous result that still apply.",
+    ])
+    framed = req.model_copy(update={"dom_html": text})
+    framed._framed = True
+    return framed
+
+
+def upload_mime(upload: UploadedFile) -> str:
+    # FormData blobs may arrive as application/octet-stream
+    return upload.content_type if upload.content_type.startswith("image/") else "image/png"
+
+
+async def prepare_screenshots(req: AnalysisRequest, uploads: Sequence[UploadedFile] = ()) -> AnalysisRequest:
+    """Runs screenshots through the image pipeline. Multipart `uploads` are
+    read from their spooled files and base64-encoded once, after resizing."""
+    if uploads:
+        with stage("images"):
+            if IMAGE_PIPELINE:
+                pairs, _ = await images.process([(upload_mime(u), u.file) for u in uploads], req.page_url)
+            else:
+                loop = asyncio.get_running_loop()
+                pairs = [(upload_mime(u), await loop.run_in_executor(None, to_base64, u.file)) for u in uploads]
+        shots = [Screenshot(mime_type=m, data_base64=d) for m, d in pairs]
+        return req.model_copy(update={"screenshots": list(req.screenshots) + shots})
+    if not req.screenshots or not IMAGE_PIPELINE:
+        return req
+    with stage("images"):
+        pairs, _ = await images.process([(s.mime_type, s.data_base64) for s in req.screenshots], req.page_url)
+    return req.model_copy(update={"screenshots": [Screenshot(mime_type=m, data_base64=d) for m, d in pairs]})
+
+
+# --------- Admission (priority, deadline, client rate limit) ---------
+
+T = TypeVar("T")
+
+
+def admit(request: Request, priority: int, limits: Optional[ClientRateLimiter] = None) -> RequestBudget:
+    """Applies the client rate limit (`limits`, client_limits by default) and
+    sets the priority and deadline that every upstream call made for this
+    request runs with. X-Priority may lower the endpoint's class, never
+    raise it; X-Deadline-Ms may only shorten REQUEST_DEADLINE_MS."""
+    limits = limits or client_limits
+    limits.check(limits.client_key(request))
+    asked = PRIORITIES.get(request.headers.get("x-priority", "").strip().lower())
+    if asked is not None:
+        priority = max(priority, asked)
+    seconds = REQUEST_DEADLINE
+    header = request.headers.get("x-deadline-ms", "").strip()
+    if header.isdigit() and int(header) > 0:
+        seconds = min(seconds, int(header) / 1000) if seconds > 0 else int(header) / 1000
+    budget = RequestBudget(priority, time.monotonic() + seconds if seconds > 0 else None)
+    set_budget(budget)
+    return budget
+
+
+def join_flight(leader: RequestBudget) -> None:
+    """A request joining a call in flight lends it its priority, so an
+    interactive request waiting on a prefetch is not queued or shed as
+    background work."""
+    priority = current_budget().priority
+    if priority < leader.priority:
+        leader.priority = priority
+        upstream.limiter.promote(leader, priority)
+
+
+async def until_disconnected(request: Request, budget: RequestBudget, work: Awaitable[T]) -> T:
+    """Awaits `work` unless the client disconnects or the deadline passes
+    first; then the work is cancelled, and with it any upstream call that
+    no other request shares. Only once the request body has been read."""
+    task = asyncio.ensure_future(work)
+    gone = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, gone}, timeout=budget.remaining(), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        gone.cancel()
+        if not task.done():
+            task.cancel()
+    if task in done:
+        return task.result()
+    await asyncio.gather(task, return_exceptions=True)
+    if gone in done:
+        abandoned["disconnect"] += 1
+        # nginx's "client closed request"; nobody is left to read it
+        raise HTTPException(status_code=499, detail="client closed request")
+    abandoned["deadline"] += 1
+    raise HTTPException(status_code=504, detail="request deadline exceeded")
+
+
+async def run_analysis(req: AnalysisRequest, mode: str) -> tuple[Dict[str, Any], str]:
+    """Parsed result for `mode`, served from the response cache when possible
+    and coalesced with identical requests already in flight.
+    Returns (result, source) where source is HIT, MISS or SHARED."""
+    mark_parsed()
+    req, snap, base_info = resolve_snapshot(req)
+    return await analyze_resolved(req, snap, base_info, mode)
+
+
+async def analyze_resolved(
+    req: AnalysisRequest,
+    snap: Snapshot,
+    base_info: Optional[tuple[Snapshot, List[tuple[int, int]]]],
+    mode: str,
+    uploads: Sequence[UploadedFile] = (),
+    prepare: Optional[Callable[[], Awaitable[AnalysisRequest]]] = None,
+) -> tuple[Dict[str, Any], str]:
+    """run_analysis for a request already passed through resolve_snapshot.
+    `uploads` are multipart screenshots, added after `req.screenshots`.
+    `prepare` replaces prepare_screenshots, e.g. to share it between modes."""
+    model = get_gpt_settings()["model"]
+    key = content_key(mode, model, req, uploads)
+    cached, source = await cached_result(req, snap, base_info, mode, model, key, uploads)
+    if cached is not None:
+        snap.results[mode] = cached
+        return {**cached, "snapshot_id": snap.id}, source
+
+    result, shared = await inflight.do(
+        key,
+        lambda: compute_result(req, base_info, mode, model, key, uploads, prepare),
+        tag=current_budget(),
+        on_join=join_flight,
+    )
+    if shared:
+        prefetcher.note_served(key)
+    snap.results[mode] = result
+    return {**result, "snapshot_id": snap.id}, "SHARED" if shared else "MISS"
+
+
+async def compute_result(
+    req: AnalysisRequest,
+    base_info: Optional[tuple[Snapshot, List[tuple[int, int]]]],
+    mode: str,
+    model: str,
+    key: str,
+    uploads: Sequence[UploadedFile] = (),
+    prepare: Optional[Callable[[], Awaitable[AnalysisRequest]]] = None,
+) -> Dict[str, Any]:
+    """The cache-miss path: prompt, upstream call, parse, cache."""
+    prepared = await prepare() if prepare is not None else await prepare_screenshots(req, uploads)
+    prompt_req = await focus_on_changes(prepared, mode, base_info)
+    data = await run_responses_api(prompt_req, mode)
+    result = parse_mode_output(data, mode, model).model_dump()
+    await response_cache.put(mode, key, result)
+    bucket = near_bucket(req, mode, model, uploads)
+    if bucket is not None:
+        near_index.add(bucket, key, req.dom_html)
+    return result
+
+
+def near_bucket(req: AnalysisRequest, mode: str, model: str, uploads: Sequence[UploadedFile] = ()) -> Optional[tuple]:
+    """Pages are only near-duplicates of pages in the same bucket: same mode,
+    model, prompt, screenshot count and URL (or origin)."""
+    if NEAR_DUP not in ("serve", "revalidate") or not response_cache.enabled:
+        return None
+    scope = url_scope(req.page_url, NEAR_DUP_SCOPE)
+    if scope is None:
+        return None
+    return (mode, model, req.user_prompt or "", len(req.screenshots) + len(uploads), scope)
+
+
+async def cached_result(
+    req: AnalysisRequest,
+    snap: Snapshot,
+    base_info: Optional[tuple[Snapshot, List[tuple[int, int]]]],
+    mode: str,
+    model: str,
+    key: str,
+    uploads: Sequence[UploadedFile] = (),
+) -> tuple[Optional[Dict[str, Any]], str]:
+    """(result, "HIT") from the response cache, else (result, "NEAR") from a
+    near-identical earlier page when NEAR_DUP is on, else (None, "")."""
+    with stage("cache"):
+        cached = await response_cache.get(key)
+        if cached is not None:
+            prefetcher.note_served(key)
+            return cached, "HIT"
+        bucket = near_bucket(req, mode, model, uploads)
+        found = near_index.find(bucket, key, req.dom_html) if bucket is not None else None
+        if found is None:
+            return None, ""
+        cached = await response_cache.get(found[0])
+    if cached is None:
+        # Its result expired; the page is no use as a stand-in any more
+        near_index.discard(found[0])
+        return None, ""
+    if NEAR_DUP == "revalidate" and not uploads:
+        # Refreshed off the request path; the next visit is an exact hit
+        prefetcher.submit(None, [PrefetchJob(
+            None, key, mode,
+            lambda: prefetch_mode(req, snap, base_info, mode, model, key),
+            ttl=response_cache.ttl_for(mode),
+        )])
+    return cached, "NEAR"
+
+
+@app.post("/api/analysis", response_model=AnalysisResponse)
+async def analyze_page(req: AnalysisRequest, request: Request, response: Response) -> AnalysisResponse:
+    budget = admit(request, NORMAL)
+    result, source = await until_disconnected(request, budget, run_analysis(req, "analysis"))
+    response.headers["X-Cache"] = source
+    return AnalysisResponse(**result)
+
+
+@app.post("/api/summarize", response_model=SummaryResponse)
+async def summarize_page(req: AnalysisRequest, request: Request, response: Response) -> SummaryResponse:
+    budget = admit(request, NORMAL)
+    result, source = await until_disconnected(request, budget, run_analysis(req, "summary"))
+    response.headers["X-Cache"] = source
+    return SummaryResponse(**result)
 
 
 @app.post("/api/suggest", response_model=SuggestResponse)
-async def suggest_actions(req: AnalysisRequest) -> SuggestResponse:
-    data = await run_responses_api(req, mode="suggest")
-    text, usage_tokens = extract_output_text(data)
-    reasoning, content = parse_reasoning_and_content(text)
-    return SuggestResponse(reasoning=reasoning, content=content, model=get_gpt_settings()["model"], usage_tokens=usage_tokens)
+async def suggest_actions(req: AnalysisRequest, request: Request, response: Response) -> SuggestResponse:
+    budget = admit(request, INTERACTIVE)
+    result, source = await until_disconnected(request, budget, run_analysis(req, "suggest"))
+    response.headers["X-Cache"] = source
+    return SuggestResponse(**result)
+
+
+# --------- Page insights (summary + suggestions in one call) ---------
+
+# Delay before the second mode's upstream call, so it can hit the prefix the
+# first one just cached upstream; 0 sends both at once
+INSIGHTS_STAGGER = env_float("INSIGHTS_STAGGER_MS", 0.0) / 1000
+
+
+class InsightsResponse(BaseModel):
+    summary: SummaryResponse
+    suggest: SuggestResponse
+    usage_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    snapshot_id: Optional[str] = None
+
+
+def shared_preparation(req: AnalysisRequest) -> Callable[[], Awaitable[AnalysisRequest]]:
+    """prepare_screenshots run at most once, however many modes ask for it;
+    only started if some mode misses the cache."""
+    task: Optional["asyncio.Future[AnalysisRequest]"] = None
+
+    async def prepare() -> AnalysisRequest:
+        nonlocal task
+        if task is None:
+            task = asyncio.ensure_future(prepare_screenshots(req))
+        return await asyncio.shield(task)
+
+    return prepare
+
+
+def _sum_optional(values: Sequence[Optional[int]]) -> Optional[int]:
+    present = [v for v in values if v is not None]
+    return sum(present) if present else None
+
+
+async def run_insights(req: AnalysisRequest) -> tuple[InsightsResponse, str]:
+    """Summary and suggestions for one page, plus the X-Cache value. The page
+    is parsed, resolved, compacted and its screenshots processed once; both
+    upstream calls share the same prompt prefix and run concurrently."""
+    mark_parsed()
+    req, snap, base_info = resolve_snapshot(req)
+    prepare = shared_preparation(req)
+
+    async def suggest() -> tuple[Dict[str, Any], str]:
+        if INSIGHTS_STAGGER > 0:
+            await asyncio.sleep(INSIGHTS_STAGGER)
+        return await analyze_resolved(req, snap, base_info, "suggest", prepare=prepare)
+
+    (summary, summary_source), (suggestion, suggest_source) = await asyncio.gather(
+        analyze_resolved(req, snap, base_info, "summary", prepare=prepare), suggest()
+    )
+    return InsightsResponse(
+        summary=SummaryResponse(**summary),
+        suggest=SuggestResponse(**suggestion),
+        usage_tokens=_sum_optional([summary.get("usage_tokens"), suggestion.get("usage_tokens")]),
+        cached_tokens=_sum_optional([summary.get("cached_tokens"), suggestion.get("cached_tokens")]),
+        snapshot_id=snap.id,
+    ), f"summary={summary_source}, suggest={suggest_source}"
+
+
+@app.post("/api/insights", response_model=InsightsResponse)
+async def page_insights(req: AnalysisRequest, request: Request, response: Response) -> InsightsResponse:
+    budget = admit(request, INTERACTIVE)
+    insights, source = await until_disconnected(request, budget, run_insights(req))
+    response.headers["X-Cache"] = source
+    return insights
+
+
+# --------- Speculative prefetch ---------
+
+class PrefetchRequest(AnalysisRequest):
+    tab_id: Optional[str] = Field(default=None, description="New content from the same tab supersedes its older prefetches")
+    modes: List[Literal["summary", "suggest"]] = Field(default_factory=lambda: ["summary", "suggest"], min_length=1)
+
+
+class PrefetchResponse(BaseModel):
+    # mode -> queued, duplicate or dropped
+    modes: Dict[str, str]
+    snapshot_id: Optional[str] = None
+
+
+async def prefetch_mode(
+    req: AnalysisRequest,
+    snap: Snapshot,
+    base_info: Optional[tuple[Snapshot, List[tuple[int, int]]]],
+    mode: str,
+    model: str,
+    key: str,
+) -> str:
+    """One prefetch job: fills the response cache for `key` unless it is
+    already there, at background priority."""
+    set_budget(RequestBudget(BACKGROUND))
+    cached = await response_cache.get(key)
+    if cached is None:
+        cached, shared = await inflight.do(
+            key, lambda: compute_result(req, base_info, mode, model, key), tag=current_budget(), on_join=join_flight
+        )
+        snap.results[mode] = cached
+        return "shared" if shared else "computed"
+    snap.results[mode] = cached
+    return "cached"
+
+
+@app.post("/api/prefetch", response_model=PrefetchResponse, status_code=202)
+async def prefetch_page(req: PrefetchRequest, request: Request) -> PrefetchResponse:
+    """Queues summary/suggest work for a page the user may ask about, so a
+    later /api/summarize or /api/suggest for the same content is a cache hit.
+    Returns at once; work is dropped rather than queued when the pool is
+    full or real requests are waiting for the upstream."""
+    admit(request, BACKGROUND, prefetch_limits)
+    mark_parsed()
+    if not response_cache.enabled:
+        raise HTTPException(status_code=503, detail="prefetch needs the response cache (CACHE_MAX_BYTES > 0)")
+    full, snap, base_info = resolve_snapshot(req)
+    model = get_gpt_settings()["model"]
+    jobs = []
+    for mode in dict.fromkeys(req.modes):
+        key = content_key(mode, model, full)
+        jobs.append(PrefetchJob(
+            req.tab_id, key, mode,
+            lambda mode=mode, key=key: prefetch_mode(full, snap, base_info, mode, model, key),
+            ttl=response_cache.ttl_for(mode),
+        ))
+    return PrefetchResponse(modes=prefetcher.submit(req.tab_id, jobs), snapshot_id=snap.id)
+
+
+@app.get("/api/prefetch/stats")
+async def prefetch_stats() -> Dict[str, Any]:
+    return {"max_upstream_queue": PREFETCH_MAX_UPSTREAM_QUEUE, **prefetcher.stats()}
+
+
+# --------- Multipart variants (screenshots as binary parts) ---------
+
+# Form fields of the multipart endpoints; screenshots are file parts named "screenshot"
+UPLOAD_TEXT_FIELDS = ("page_url", "dom_html", "user_prompt", "base_snapshot_id")
+UPLOAD_FILE_FIELDS = ("screenshot", "screenshots")
+
+
+async def run_upload(request: Request, mode: str, priority: int) -> tuple[Dict[str, Any], str]:
+    """run_analysis for a multipart/form-data body. Screenshots stay raw
+    bytes in bounded spooled files until the image pipeline reads them."""
+    # Admitted before the body is read, so a limited client uploads nothing
+    budget = admit(request, priority)
+    form = await read_multipart(request, upload_limits)
+    try:
+        for upload in form.files:
+            if upload.name not in UPLOAD_FILE_FIELDS:
+                raise HTTPException(status_code=400, detail=f"unexpected file part {upload.name!r}")
+        req = AnalysisRequest(
+            **{name: form.fields[name] for name in UPLOAD_TEXT_FIELDS if name in form.fields},
+            delta=PageDelta.model_validate_json(form.fields["delta"]) if form.fields.get("delta") else None,
+        )
+    except ValidationError as e:
+        form.close()
+        raise RequestValidationError(e.errors(include_url=False))
+    except HTTPException:
+        form.close()
+        raise
+    mark_parsed()
+    req, snap, base_info = resolve_snapshot(req)
+    result = await until_disconnected(request, budget, analyze_resolved(req, snap, base_info, mode, form.files))
+    # Closed on success only: a coalesced call outliving a failed or cancelled
+    # request may still read the files, which then go with the last reference
+    form.close()
+    return result
+
+
+@app.post("/api/analysis/upload", response_model=AnalysisResponse)
+async def analyze_page_upload(request: Request, response: Response) -> AnalysisResponse:
+    result, source = await run_upload(request, "analysis", NORMAL)
+    response.headers["X-Cache"] = source
+    return AnalysisResponse(**result)
+
+
+@app.post("/api/summarize/upload", response_model=SummaryResponse)
+async def summarize_page_upload(request: Request, response: Response) -> SummaryResponse:
+    result, source = await run_upload(request, "summary", NORMAL)
+    response.headers["X-Cache"] = source
+    return SummaryResponse(**result)
+
+
+@app.post("/api/suggest/upload", response_model=SuggestResponse)
+async def suggest_actions_upload(request: Request, response: Response) -> SuggestResponse:
+    result, source = await run_upload(request, "suggest", INTERACTIVE)
+    response.headers["X-Cache"] = source
+    return SuggestResponse(**result)
+
+
+@app.get("/api/compaction/stats")
+async def compaction_stats_endpoint() -> Dict[str, Any]:
+    return {
+        "token_budget": COMPACT_TOKEN_BUDGET,
+        **compaction_stats.stats(),
+        "memo": compaction_memo.stats(),
+    }
+
+
+@app.get("/api/images/stats")
+async def image_stats() -> Dict[str, Any]:
+    return {"enabled": IMAGE_PIPELINE, **images.stats()}
+
+
+@app.get("/api/snapshots/stats")
+async def snapshot_stats() -> Dict[str, Any]:
+    return snapshots.stats()
+
+
+@app.get("/api/cache/stats")
+async def cache_stats() -> Dict[str, Any]:
+    return {
+        **response_cache.stats(),
+        "single_flight": inflight.stats(),
+        "near_duplicates": {"mode": NEAR_DUP, "scope": NEAR_DUP_SCOPE, **near_index.stats()},
+    }
+
+
+@app.get("/api/output/stats")
+async def output_stats() -> Dict[str, Any]:
+    return {"structured": {"enabled": STRUCTURED_OUTPUT, **structured_results}, **output_budget.stats()}
+
+
+# --------- Streaming variants (SSE) ---------
+
+async def stream_responses_api(req: AnalysisRequest, mode: str) -> AsyncGenerator[Dict[str, Any], None]:
+    """Streamed counterpart of run_responses_api. Falls back to text-only
+    when the multimodal attempt is rejected before any event arrives."""
+    headers = {**gpt_headers(), "Accept": "text/event-stream"}
+    with stage("prompt"):
+        attempts = await build_payloads(req, mode, stream=True)
+    async for event in router.stream(attempts, headers):
+        yield event
+
+
+async def stream_analysis(req: AnalysisRequest, mode: str) -> AsyncGenerator[bytes, None]:
+    """SSE events for summary ('item' per bullet) or suggest ('reasoning',
+    'content'), then 'done' with the same body the JSON endpoint returns."""
+    try:
+        req, snap, base_info = resolve_snapshot(req)
+    except HTTPException as he:
+        yield sse_event(json.dumps({"status": he.status_code, "detail": he.detail}), event="error").encode()
+        return
+    model = get_gpt_settings()["model"]
+    key = content_key(mode, model, req)
+    cached, source = await cached_result(req, snap, base_info, mode, model, key)
+    if cached is not None:
+        snap.results[mode] = cached
+        if mode == "summary":
+            for i, item in enumerate(cached["summary"]):
+                yield sse_event(json.dumps({"index": i, "text": item}), event="item").encode()
+        else:
+            yield sse_event(json.dumps({"reasoning": cached["reasoning"]}), event="reasoning").encode()
+            yield sse_event(json.dumps({"content": cached["content"]}), event="content").encode()
+        yield sse_event(json.dumps({**cached, "snapshot_id": snap.id, "cache": source}), event="done").encode()
+        return
+
+    summary_parser = SummaryItemParser()
+    suggest_parser = ReasoningContentParser()
+    reasoning_sent = False
+    received_text = False
+    usage_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+
+    async def feed(chunk: str) -> AsyncGenerator[bytes, None]:
+        nonlocal reasoning_sent
+        if mode == "summary":
+            start = len(summary_parser.items)
+            for i, item in enumerate(summary_parser.feed(chunk), start=start):
+                yield sse_event(json.dumps({"index": i, "text": item}), event="item").encode()
+        else:
+            reasoning = suggest_parser.feed(chunk)
+            if reasoning is not None and not reasoning_sent:
+                reasoning_sent = True
+                yield sse_event(json.dumps({"reasoning": reasoning}), event="reasoning").encode()
+
+    try:
+        prompt_req = await focus_on_changes(await prepare_screenshots(req), mode, base_info)
+        async for event in stream_responses_api(prompt_req, mode):
+            etype = event.get("type")
+            if etype == "response.output_text.delta":
+                received_text = True
+                async for frame in feed(str(event.get("delta") or "")):
+                    yield frame
+            elif etype in ("response.completed", "response.incomplete"):
+                final = event.get("response") or {}
+                # Kept apart from the JSON calls, whose budget these must not skew
+                output_budget.observe(
+                    f"{mode}_stream", extract_output_tokens(final), output_truncated(final), adapt=False
+                )
+                text, usage_tokens = extract_output_text(final)
+                cached_tokens = extract_cached_tokens(final)
+                count_usage(model, usage_tokens, cached_tokens)
+                if not received_text and text:
+                    async for frame in feed(text):
+                        yield frame
+            elif etype in ("error", "response.failed"):
+                raise HTTPException(status_code=502, detail=json.dumps(event))
+    except HTTPException as he:
+        yield sse_event(json.dumps({"status": he.status_code, "detail": he.detail}), event="error").encode()
+        return
+
+    result: BaseModel
+    if mode == "summary":
+        start = len(summary_parser.items)
+        for i, item in enumerate(summary_parser.finish(), start=start):
+            yield sse_event(json.dumps({"index": i, "text": item}), event="item").encode()
+        result = SummaryResponse(
+            summary=summary_parser.items, model=model, usage_tokens=usage_tokens, cached_tokens=cached_tokens
+        )
+    else:
+        reasoning, content = suggest_parser.finish()
+        if not reasoning_sent:
+            yield sse_event(json.dumps({"reasoning": reasoning}), event="reasoning").encode()
+        yield sse_event(json.dumps({"content": content}), event="content").encode()
+        result = SuggestResponse(
+            reasoning=reasoning, content=content, model=model, usage_tokens=usage_tokens, cached_tokens=cached_tokens
+        )
+    body = result.model_dump()
+    await response_cache.put(mode, key, body)
+    snap.results[mode] = body
+    yield sse_event(json.dumps({**body, "snapshot_id": snap.id, "cache": "MISS"}), event="done").encode()
+
+
+async def counted_stream(kind: str, frames: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+    open_streams[kind] += 1
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        open_streams[kind] -= 1
+
+
+# Streams are cancelled by StreamingResponse when the client disconnects;
+# their deadline bounds the wait for an upstream slot, not the whole stream
+@app.post("/api/summarize/stream")
+async def summarize_page_stream(req: AnalysisRequest, request: Request) -> StreamingResponse:
+    admit(request, NORMAL)
+    mark_parsed()
+    return StreamingResponse(counted_stream("analysis", stream_analysis(req, "summary")), media_type="text/event-stream")
+
+
+@app.post("/api/suggest/stream")
+async def suggest_actions_stream(req: AnalysisRequest, request: Request) -> StreamingResponse:
+    admit(request, INTERACTIVE)
+    mark_parsed()
+    return StreamingResponse(counted_stream("analysis", stream_analysis(req, "suggest")), media_type="text/event-stream")
+
+
+# --------- Batch analysis (many tabs in one request) ---------
+
+# Items per /api/batch request, and how many of them run at once
+BATCH_MAX_ITEMS = env_int("BATCH_MAX_ITEMS", 50)
+BATCH_CONCURRENCY = env_int("BATCH_CONCURRENCY", 8)
+
+
+class BatchItem(AnalysisRequest):
+    mode: Literal["summary", "suggest", "analysis"] = "summary"
+    id: Optional[str] = Field(default=None, description="Echoed back with the item's result")
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1)
+
+
+async def stream_batch(items: List[BatchItem], sse: bool) -> AsyncGenerator[bytes, None]:
+    """One line (or SSE 'item' event) per item in completion order, then a
+    'done' summary. Items with identical content run once."""
+    started = time.perf_counter()
+    model = get_gpt_settings()["model"]
+
+    def frame(body: Dict[str, Any], event: str = "item") -> bytes:
+        data = json.dumps(body)
+        return sse_event(data, event=event).encode() if sse else (data + "\n").encode()
+
+    def header(i: int) -> Dict[str, Any]:
+        return {"index": i, "id": items[i].id, "mode": items[i].mode}
+
+    failed: List[Dict[str, Any]] = []
+    # content key -> indexes of the items sharing it, and the resolved request
+    groups: Dict[str, List[int]] = {}
+    resolved: Dict[str, tuple[AnalysisRequest, Snapshot, Any, str]] = {}
+    for i, item in enumerate(items):
+        try:
+            req, snap, base_info = resolve_snapshot(item)
+        except HTTPException as he:
+            failed.append({**header(i), "status": he.status_code, "error": he.detail})
+            continue
+        key = content_key(item.mode, model, req)
+        if key not in groups:
+            groups[key] = []
+            resolved[key] = (req, snap, base_info, item.mode)
+        groups[key].append(i)
+
+    slots = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def run_group(key: str) -> tuple[str, Dict[str, Any]]:
+        req, snap, base_info, mode = resolved[key]
+        async with slots:
+            t0 = time.perf_counter()
+            try:
+                result, source = await analyze_resolved(req, snap, base_info, mode)
+                body: Dict[str, Any] = {"status": 200, "cache": source, "result": result}
+            except HTTPException as he:
+                body = {"status": he.status_code, "error": he.detail}
+            except Exception as e:
+                # One bad item must not take the rest of the batch down
+                body = {"status": 500, "error": f"{type(e).__name__}: {e}"}
+            body["elapsed_ms"] = round(1000 * (time.perf_counter() - t0), 1)
+            return key, body
+
+    tasks = [asyncio.ensure_future(run_group(key)) for key in groups]
+    errors = len(failed)
+    try:
+        for body in failed:
+            yield frame(body)
+        for next_done in asyncio.as_completed(tasks):
+            key, body = await next_done
+            first, *rest = groups[key]
+            if body["status"] != 200:
+                errors += 1 + len(rest)
+            yield frame({**header(first), **body})
+            for i in rest:
+                yield frame({**header(i), **body, "duplicate_of": first})
+        yield frame(
+            {
+                "done": True,
+                "items": len(items),
+                "unique": len(groups),
+                "errors": errors,
+                "elapsed_ms": round(1000 * (time.perf_counter() - started), 1),
+            },
+            event="done",
+        )
+    finally:
+        # Client went away: stop work nobody will read
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/api/batch")
+async def batch_analyze(batch: BatchRequest, request: Request, format: Optional[str] = None) -> StreamingResponse:
+    """Streams NDJSON by default; SSE with ?format=sse or Accept: text/event-stream.
+    Runs at background priority: interactive requests get upstream slots first."""
+    admit(request, BACKGROUND)
+    mark_parsed()
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"at most {BATCH_MAX_ITEMS} items per batch")
+    sse = format == "sse" or (format is None and "text/event-stream" in request.headers.get("accept", ""))
+    return StreamingResponse(
+        counted_stream("batch", stream_batch(batch.items, sse)),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+    )
+
+
+# --------- Prometheus metrics ---------
+
+def _upstream_statuses() -> List[tuple[tuple[str, ...], float]]:
+    return [
+        ((ep.base_url, status), n)
+        for ep in router.endpoints
+        for status, n in sorted(ep.statuses.items())
+    ]
+
+
+def _run_states() -> List[tuple[tuple[str, ...], float]]:
+    states: Dict[str, int] = {}
+    for run in runs.registry:
+        states[run.state] = states.get(run.state, 0) + 1
+    return [((state,), n) for state, n in sorted(states.items())]
+
+
+def _subscribers() -> List[tuple[tuple[str, ...], float]]:
+    agent = sum(run.events.subscribers for run in runs.registry)
+    return [(("agent",), agent)] + [((kind,), n) for kind, n in open_streams.items()]
+
+
+metrics.collected(
+    "upstream_responses_total", "Upstream responses by endpoint and status code", "counter",
+    ("upstream", "status"), _upstream_statuses,
+)
+metrics.collected(
+    "upstream_fallbacks_total", "Multimodal-to-text fallbacks, skipped multimodal attempts, failovers and hedges",
+    "counter", ("kind",),
+    lambda: [
+        (("text_fallback",), router.fallbacks),
+        (("skipped_multimodal",), router.skipped_multimodal),
+        (("failover",), router.failovers),
+        (("hedge",), router.hedges),
+        (("hedge_win",), router.hedge_wins),
+    ],
+)
+metrics.collected(
+    "upstream_in_flight", "Upstream calls holding a limiter slot", "gauge", (),
+    lambda: [((), upstream.limiter.in_flight)],
+)
+metrics.collected(
+    "upstream_queue_depth", "Upstream calls waiting for a limiter slot", "gauge", (),
+    lambda: [((), upstream.limiter.queue_depth)],
+)
+metrics.collected(
+    "upstream_rejected_total", "Requests refused or dropped before reaching the upstream, by reason", "counter",
+    ("reason",),
+    lambda: [
+        (("client_rate_limit",), client_limits.limited),
+        (("prefetch_rate_limit",), prefetch_limits.limited),
+        (("model_rate_limit",), upstream.rate_limits.refused),
+        (("queue_full",), upstream.limiter.rejected),
+        (("shed",), upstream.limiter.shed),
+        (("queue_timeout",), upstream.limiter.timed_out),
+        (("client_disconnect",), abandoned["disconnect"]),
+        (("deadline",), abandoned["deadline"]),
+    ],
+)
+metrics.collected(
+    "upstream_queue_wait_seconds_total", "Time spent waiting for an upstream slot, by priority", "counter",
+    ("priority",),
+    lambda: [((PRIORITY_NAMES.get(p, str(p)),), round(total, 6)) for p, (_, total) in sorted(upstream.limiter.by_priority.items())],
+)
+metrics.collected(
+    "prefetch_jobs_total", "Prefetch jobs by outcome", "counter", ("outcome",),
+    lambda: [((name,), n) for name, n in prefetcher.outcomes.items()],
+)
+metrics.collected(
+    "prefetch_results_total", "Prefetched results served at least once (useful) or expired or cancelled unserved (wasted)",
+    "counter", ("result",),
+    lambda: [(("useful",), prefetcher.useful), (("wasted",), prefetcher.wasted)],
+)
+metrics.collected(
+    "prefetch_served_total", "Requests answered from a prefetched result or by joining a running prefetch", "counter",
+    ("source",),
+    lambda: [(("result",), prefetcher.served), (("in_flight",), prefetcher.served_in_flight)],
+)
+metrics.collected(
+    "prefetch_jobs", "Prefetch jobs running or queued", "gauge", ("status",),
+    lambda: [(("running",), prefetcher.running), (("queued",), prefetcher.queue_depth)],
+)
+metrics.collected(
+    "cache_lookups_total", "Response cache lookups by result", "counter", ("result",),
+    lambda: [(("hit",), response_cache.hits), (("miss",), response_cache.misses)],
+)
+metrics.collected(
+    "cache_bytes", "Bytes held by the in-memory response cache", "gauge", (),
+    lambda: [((), response_cache.bytes_used)],
+)
+metrics.collected(
+    "near_duplicate_lookups_total", "Near-duplicate page lookups after an exact cache miss, by result", "counter",
+    ("result",),
+    lambda: [(("hit",), near_index.hits), (("miss",), near_index.lookups - near_index.hits)],
+)
+metrics.collected(
+    "near_duplicate_entries", "Pages in the near-duplicate index", "gauge", (),
+    lambda: [((), len(near_index))],
+)
+metrics.collected(
+    "output_token_budget", "Current max_output_tokens for non-streamed calls, by mode", "gauge", ("mode",),
+    lambda: [((mode,), output_budget.for_mode(mode)) for mode in sorted(output_budget.replies)],
+)
+metrics.collected(
+    "output_truncated_total", "Upstream replies cut off at max_output_tokens, by mode", "counter", ("mode",),
+    lambda: [((mode,), n) for mode, n in sorted(output_budget.truncated.items())],
+)
+metrics.collected(
+    "output_budget_retries_total", "Calls repeated at the full output allowance after truncation, by mode", "counter",
+    ("mode",),
+    lambda: [((mode,), n) for mode, n in sorted(output_budget.retries.items())],
+)
+metrics.collected(
+    "structured_output_total", "Structured-output replies parsed as JSON or handed to the text parsers", "counter",
+    ("result",),
+    lambda: [((result,), n) for result, n in structured_results.items()],
+)
+metrics.collected(
+    "single_flight_coalesced_total", "Requests that shared an identical in-flight call", "counter", (),
+    lambda: [((), inflight.followers)],
+)
+metrics.collected("agent_runs", "Live agent runs in this worker by state", "gauge", ("state",), _run_states)
+metrics.collected(
+    "agent_runs_scheduled", "Agent runs executing or waiting for a slot", "gauge", ("status",),
+    lambda: [(("executing",), scheduler.slots.in_flight), (("queued",), scheduler.slots.queue_depth)],
+)
+metrics.collected("stream_subscribers", "Open SSE/NDJSON streams by kind", "gauge", ("stream",), _subscribers)
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,222 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+# Seconds; wide enough for cached hits (ms) and slow multimodal calls (tens of s)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[str, ...]
+# Scrape-time callback: (label values, value) pairs read from existing stats
+Collect = Callable[[], Iterable[Tuple[Labels, float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name: str, labels: Sequence[str], values: Labels, value: float, extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labels, values)]
+    if extra:
+        pairs.append(extra)
+    body = "{" + ",".join(pairs) + "}" if pairs else ""
+    return f"{name}{body} {value}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(_series(self.name, self.labels, k, v) for k, v in sorted(self._values.items()))
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; one observe is a bisect and three adds."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._values: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, *values: str) -> None:
+        series = self._values.get(values)
+        if series is None:
+            series = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(_series(f"{self.name}_bucket", self.labels, key, cumulative, f'le="{bound:g}"'))
+            lines.append(_series(f"{self.name}_bucket", self.labels, key, count, 'le="+Inf"'))
+            lines.append(_series(f"{self.name}_sum", self.labels, key, round(total, 6)))
+            lines.append(_series(f"{self.name}_count", self.labels, key, count))
+        return lines
+
+
+class Collected:
+    """Gauge or counter whose values are read from existing stats at scrape
+    time, so the hot path pays nothing for it."""
+
+    def __init__(self, name: str, help: str, kind: str, labels: Sequence[str], collect: Collect) -> None:
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(_series(self.name, self.labels, k, v) for k, v in self.collect())
+        return lines
+
+
+class RequestTimings:
+    """Stage durations for one request, filled in by `stage` blocks."""
+
+    __slots__ = ("started", "stages")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={1000 * s:.1f}" for name, s in self.stages.items()]
+        parts.append(f"total;dur={1000 * (time.perf_counter() - self.started):.1f}")
+        return ", ".join(parts)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times the block as stage `name` of the current request, if any."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - t0)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def mark_parsed() -> None:
+    """Called first thing in a handler: everything before it (body read, JSON
+    decode, validation) is the `parse` stage."""
+    timings = _timings.get()
+    if timings is not None and "parse" not in timings.stages:
+        timings.add("parse", time.perf_counter() - timings.started)
+
+
+class Metrics:
+    """Registry rendered by GET /metrics in the Prometheus text format."""
+
+    def __init__(self, prefix: str = "overlay") -> None:
+        self.prefix = prefix
+        self._metrics: List[Any] = []
+        self.requests = self.add(Histogram(
+            f"{prefix}_http_request_duration_seconds",
+            "Time to the end of the response body",
+            ("endpoint", "method", "status"),
+        ))
+        self.stages = self.add(Histogram(
+            f"{prefix}_stage_duration_seconds",
+            "Time spent per request stage",
+            ("endpoint", "stage"),
+        ))
+        self.usage_tokens = self.add(Counter(
+            f"{prefix}_usage_tokens_total",
+            "Tokens reported by the upstream, by model",
+            ("model",),
+        ))
+        self.cached_tokens = self.add(Counter(
+            f"{prefix}_cached_tokens_total",
+            "Prompt tokens served from the upstream prefix cache, by model",
+            ("model",),
+        ))
+
+    def add(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def collected(self, name: str, help: str, kind: str, labels: Sequence[str], collect: Collect) -> None:
+        self.add(Collected(f"{self.prefix}_{name}", help, kind, labels, collect))
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float, stages: Dict[str, float]) -> None:
+        self.requests.observe(seconds, endpoint, method, str(status))
+        for name, s in stages.items():
+            self.stages.observe(s, endpoint, name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class TimingMiddleware:
+    """Pure ASGI middleware: gives each HTTP request a RequestTimings, adds a
+    Server-Timing header with the stages finished before the response starts
+    and records every stage once the body has been sent."""
+
+    def __init__(self, app: Any, metrics: Metrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            # Route templates keep the label set small; unknown paths share one label
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            self.metrics.observe_request(
+                endpoint, scope["method"], status, time.perf_counter() - timings.started, timings.stages
+            )
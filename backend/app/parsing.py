@@ -0,0 +1,260 @@
+import json
+from typing import Any, Dict, List, Optional
+
+
+class _LineBuffer:
+    """Splits streamed text into the same lines `str.splitlines()` would give
+    for the full text, releasing each line once its terminator has arrived."""
+
+    def __init__(self) -> None:
+        self._pending = ""
+
+    @property
+    def partial(self) -> str:
+        return self._pending
+
+    def feed(self, chunk: str) -> List[str]:
+        self._pending += chunk
+        pieces = self._pending.splitlines(keepends=True)
+        if not pieces:
+            return []
+        last = pieces[-1]
+        # A trailing "\r" may still become "\r\n"; hold it back with any unterminated tail
+        if last.splitlines()[0] == last or last.endswith("\r"):
+            self._pending = last
+            pieces = pieces[:-1]
+        else:
+            self._pending = ""
+        return [p.splitlines()[0] if p.splitlines() else "" for p in pieces]
+
+    def finish(self) -> List[str]:
+        rest, self._pending = self._pending, ""
+        return rest.splitlines()
+
+
+class SummaryItemParser:
+    """Incremental form of the summary bullet splitter.
+
+    Lines are split on "•" and each part becomes an item; an item is final as
+    soon as the next "•" or the end of its line arrives. If the whole text
+    yields no items, `finish()` falls back to a sentence split.
+    """
+
+    max_items = 10
+
+    def __init__(self) -> None:
+        self._lines = _LineBuffer()
+        self._text: List[str] = []
+        self._emitted_in_line = 0
+        self._saw_item = False
+        self.items: List[str] = []
+
+    def _take(self, part: str, bullet: bool = True) -> List[str]:
+        p = part.strip()
+        if not p:
+            return []
+        if bullet:
+            self._saw_item = True
+            p = p.lstrip("-• \t")
+        item = p.strip().rstrip("-• ")
+        if not item or len(self.items) >= self.max_items:
+            return []
+        self.items.append(item)
+        return [item]
+
+    def _complete_line(self, line: str) -> List[str]:
+        out: List[str] = []
+        parts = line.strip().split("•")
+        for part in parts[self._emitted_in_line:]:
+            out.extend(self._take(part))
+        self._emitted_in_line = 0
+        return out
+
+    def feed(self, chunk: str) -> List[str]:
+        """Returns the items completed by this chunk."""
+        self._text.append(chunk)
+        out: List[str] = []
+        for line in self._lines.feed(chunk):
+            out.extend(self._complete_line(line))
+        # Parts of the open line that are already followed by a bullet are final
+        parts = self._lines.partial.lstrip().split("•")
+        for part in parts[self._emitted_in_line:-1]:
+            out.extend(self._take(part))
+        self._emitted_in_line = max(self._emitted_in_line, len(parts) - 1)
+        return out
+
+    def finish(self) -> List[str]:
+        out: List[str] = []
+        for line in self._lines.finish():
+            out.extend(self._complete_line(line))
+        if not self._saw_item:
+            for sentence in split_sentences("".join(self._text)):
+                out.extend(self._take(sentence, bullet=False))
+        return out
+
+
+def split_sentences(text: str) -> List[str]:
+    # naive sentence split on period/question/exclamation
+    buf: List[str] = []
+    start = 0
+    s = (text or "").strip()
+    for i, ch in enumerate(s):
+        if ch in ".!?":
+            part = s[start:i + 1].strip()
+            if part:
+                buf.append(part)
+            start = i + 1
+    tail = s[start:].strip()
+    if tail:
+        buf.append(tail)
+    return buf
+
+
+def split_summary_items(text: str) -> List[str]:
+    # Split summary text into list items. Prefer bullet/line splits, fallback to sentences.
+    parser = SummaryItemParser()
+    parser.feed(text or "")
+    parser.finish()
+    return parser.items
+
+
+class ReasoningContentParser:
+    """Incremental form of the "Reasoning:" / "Content:" section parser.
+
+    `feed()` reports the reasoning paragraph once the Content section starts;
+    `finish()` returns the final (reasoning, content) pair.
+    """
+
+    def __init__(self) -> None:
+        self._lines = _LineBuffer()
+        self._reasoning: List[str] = []
+        self._content: List[str] = []
+        self._mode: Optional[str] = None
+
+    def _line(self, raw: str) -> bool:
+        """Consumes one line; True when it closes the reasoning section."""
+        raw = raw.rstrip()
+        line = raw.strip()
+        if not line:
+            # preserve blank lines only for content accumulation
+            if self._mode == "content":
+                self._content.append("")
+            return False
+        lower = line.lower()
+        if lower.startswith("reasoning:"):
+            self._mode = "reasoning"
+            after = line[len("Reasoning:"):].strip()
+            if after:
+                self._reasoning.append(after.lstrip("-• "))
+            return False
+        if lower.startswith("content:"):
+            closes = self._mode != "content"
+            self._mode = "content"
+            after = line[len("Content:"):].strip()
+            if after:
+                self._content.append(after)
+            return closes
+        if self._mode == "reasoning":
+            self._reasoning.append(line.lstrip("-• \t"))
+        elif self._mode == "content":
+            self._content.append(raw)
+        return False
+
+    @property
+    def reasoning(self) -> str:
+        parts = [r for r in (s.strip() for s in self._reasoning) if r]
+        # Join reasoning lines into one paragraph and normalize whitespace
+        return " ".join(" ".join(parts).split())
+
+    @property
+    def content(self) -> str:
+        return "\n".join(self._content).strip() or "n/a"
+
+    def feed(self, chunk: str) -> Optional[str]:
+        closed = False
+        for line in self._lines.feed(chunk):
+            closed = self._line(line) or closed
+        return self.reasoning if closed else None
+
+    def finish(self) -> tuple[str, str]:
+        for line in self._lines.finish():
+            self._line(line)
+        return self.reasoning, self.content
+
+
+def parse_reasoning_and_content(text: str) -> tuple[str, str]:
+    # Expecting sections labeled "Reasoning:" and "Content:" per the strict format
+    parser = ReasoningContentParser()
+    parser.feed(text)
+    return parser.finish()
+
+
+# JSON schemas for structured output (Responses API `text.format`, strict
+# mode: every property required, no extra keys)
+_STRINGS = {"type": "array", "items": {"type": "string"}}
+OUTPUT_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "summary": {
+        "type": "object",
+        "properties": {"summary": _STRINGS},
+        "required": ["summary"],
+        "additionalProperties": False,
+    },
+    "suggest": {
+        "type": "object",
+        "properties": {"reasoning": {"type": "string"}, "content": {"type": "string"}},
+        "required": ["reasoning", "content"],
+        "additionalProperties": False,
+    },
+    "analysis": {
+        "type": "object",
+        "properties": {
+            "suggestions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"description": {"type": "string"}, "actions": _STRINGS},
+                    "required": ["description", "actions"],
+                    "additionalProperties": False,
+                },
+            }
+        },
+        "required": ["suggestions"],
+        "additionalProperties": False,
+    },
+}
+
+
+def _strings(value: Any) -> Optional[List[str]]:
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        return None
+    return [v.strip() for v in value if v.strip()]
+
+
+def parse_structured_output(text: str, mode: str) -> Optional[Dict[str, Any]]:
+    """Fields of a schema-constrained reply in one json.loads, or None when
+    the text is not a complete object of the expected shape (the caller
+    falls back to the text parsers)."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if mode == "summary":
+        items = _strings(data.get("summary"))
+        return None if items is None else {"summary": items[:SummaryItemParser.max_items]}
+    if mode == "suggest":
+        reasoning, content = data.get("reasoning"), data.get("content")
+        if not isinstance(reasoning, str) or not isinstance(content, str):
+            return None
+        return {"reasoning": " ".join(reasoning.split()), "content": content.strip() or "n/a"}
+    suggestions = data.get("suggestions")
+    if not isinstance(suggestions, list):
+        return None
+    out = []
+    for item in suggestions[:10]:
+        actions = _strings(item.get("actions", [])) if isinstance(item, dict) else None
+        if actions is None or not isinstance(item.get("description"), str):
+            return None
+        out.append({"description": item["description"].strip(), "actions": actions})
+    return {"suggestions": out}
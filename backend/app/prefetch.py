@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+# Job outcomes counted in Prefetcher.outcomes
+OUTCOMES = (
+    "queued",
+    "duplicate",
+    "computed",
+    "cached",
+    "shared",
+    "failed",
+    "dropped_saturated",
+    "dropped_busy",
+    "superseded_queued",
+    "superseded_running",
+)
+
+
+class PrefetchJob:
+    __slots__ = ("tab", "key", "mode", "run", "ttl", "task", "served")
+
+    def __init__(self, tab: Optional[str], key: str, mode: str, run: Callable[[], Awaitable[str]], ttl: float) -> None:
+        self.tab = tab
+        self.key = key
+        self.mode = mode
+        # Returns "computed", "cached" or "shared"
+        self.run = run
+        self.ttl = ttl
+        self.task: Optional["asyncio.Future[str]"] = None
+        # Requests that joined the call while it ran
+        self.served = 0
+
+
+class Prefetcher:
+    """Bounded pool for speculative summary/suggest work.
+
+    At most `workers` jobs run at once and `max_queue` wait; beyond that new
+    jobs are dropped rather than queued, and a job about to start is dropped
+    while `busy()` says the upstream has real work waiting. New content for a
+    tab supersedes that tab's older jobs, queued or running.
+
+    Prefetched results are remembered for their cache TTL (at most `track`
+    of them) so later requests can be attributed: a result served at least
+    once is useful, one that expires unserved or is cancelled mid-call is
+    wasted.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_queue: int = 32,
+        track: int = 1024,
+        busy: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.track = track
+        self.busy = busy
+        self._queue: Deque[PrefetchJob] = deque()
+        self._running: Dict[str, PrefetchJob] = {}
+        # tab -> its content keys currently queued or running
+        self._tabs: Dict[str, List[str]] = {}
+        # content key -> [expires_at (monotonic), times served]
+        self._done: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.outcomes: Dict[str, int] = {name: 0 for name in OUTCOMES}
+        self.served = 0
+        self.served_in_flight = 0
+        self.useful = 0
+        self.wasted = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def _pending(self, key: str) -> bool:
+        return key in self._running or any(job.key == key for job in self._queue)
+
+    def submit(self, tab: Optional[str], jobs: List[PrefetchJob]) -> Dict[str, str]:
+        """Queues `jobs` (one page's modes) and returns each mode's status:
+        queued, duplicate (already queued, running or prefetched) or dropped."""
+        keys = [job.key for job in jobs]
+        if tab is not None:
+            self._supersede(tab, keep=keys)
+        self._expire()
+        statuses: Dict[str, str] = {}
+        for job in jobs:
+            if job.key in self._done or self._pending(job.key):
+                statuses[job.mode] = "duplicate"
+                self.outcomes["duplicate"] += 1
+                continue
+            if len(self._queue) >= self.max_queue and len(self._running) >= self.workers:
+                statuses[job.mode] = "dropped"
+                self.outcomes["dropped_saturated"] += 1
+                continue
+            self._queue.append(job)
+            if tab is not None:
+                self._tabs.setdefault(tab, []).append(job.key)
+            statuses[job.mode] = "queued"
+            self.outcomes["queued"] += 1
+        self._pump()
+        return statuses
+
+    def _supersede(self, tab: str, keep: List[str]) -> None:
+        stale = [key for key in self._tabs.get(tab, ()) if key not in keep]
+        if not stale:
+            return
+        for job in list(self._queue):
+            if job.tab == tab and job.key in stale:
+                self._queue.remove(job)
+                self.outcomes["superseded_queued"] += 1
+        for key in stale:
+            job = self._running.get(key)
+            if job is not None and job.tab == tab and job.task is not None:
+                # Cancelling leaves a call shared with a real request running
+                job.task.cancel()
+        self._tabs[tab] = [key for key in self._tabs[tab] if key not in stale]
+
+    def _pump(self) -> None:
+        while self._queue and len(self._running) < self.workers:
+            job = self._queue.popleft()
+            if self.busy is not None and self.busy():
+                self.outcomes["dropped_busy"] += 1
+                self._forget_tab(job)
+                continue
+            self._running[job.key] = job
+            # A fresh context: the job must not inherit the submitting
+            # request's timings or priority
+            job.task = contextvars.Context().run(asyncio.ensure_future, job.run())
+            job.task.add_done_callback(lambda task, job=job: self._finished(job, task))
+
+    def _finished(self, job: PrefetchJob, task: "asyncio.Future[str]") -> None:
+        self._running.pop(job.key, None)
+        self._forget_tab(job)
+        if task.cancelled():
+            self.outcomes["superseded_running"] += 1
+            self.wasted += 1
+        elif task.exception() is not None:
+            self.outcomes["failed"] += 1
+        else:
+            outcome = task.result()
+            self.outcomes[outcome] += 1
+            if job.served:
+                self.useful += 1
+            if outcome == "computed":
+                self._done[job.key] = [time.monotonic() + job.ttl, job.served]
+                self._done.move_to_end(job.key)
+                self._expire()
+        self._pump()
+
+    def _forget_tab(self, job: PrefetchJob) -> None:
+        if job.tab is not None and job.key in self._tabs.get(job.tab, ()):
+            self._tabs[job.tab].remove(job.key)
+            if not self._tabs[job.tab]:
+                del self._tabs[job.tab]
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        # TTLs differ by mode, so an expired result may sit behind a live one
+        stale = [key for key, (expires_at, _) in self._done.items() if expires_at <= now]
+        for key in stale:
+            if not self._done.pop(key)[1]:
+                self.wasted += 1
+        while len(self._done) > self.track:
+            if not self._done.popitem(last=False)[1][1]:
+                self.wasted += 1
+
+    def note_served(self, key: str) -> None:
+        """A request was answered with this content key's result (cache hit
+        or joined call); counts it if a prefetch produced that result."""
+        entry = self._done.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            if not entry[1]:
+                self.useful += 1
+            entry[1] += 1
+            self.served += 1
+        elif key in self._running:
+            self._running[key].served += 1
+            self.served_in_flight += 1
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        judged = self.useful + self.wasted
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": len(self._running),
+            "queue_depth": len(self._queue),
+            "tracked_results": len(self._done),
+            "outcomes": dict(self.outcomes),
+            "served": self.served,
+            "served_in_flight": self.served_in_flight,
+            "useful": self.useful,
+            "wasted": self.wasted,
+            "useful_ratio": round(self.useful / judged, 4) if judged else None,
+        }
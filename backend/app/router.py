@@ -0,0 +1,366 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Sequence, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from .metrics import record_stage, stage
+from .upstream import UpstreamClient, UpstreamStatusError
+
+# Upstream statuses that mean "this input shape is not accepted; try text"
+FALLBACK_STATUSES = (400, 415, 422)
+
+# (kind, payload) where kind is "multimodal" or "text"; tried in order
+Attempt = Tuple[str, Dict[str, Any]]
+# Error text that blames the image blocks themselves, not just this request
+_IMAGE_ERRORS = ("image", "vision", "multimodal")
+# Rejections without such text before a model is taken to be text-only
+MULTIMODAL_REJECTIONS = 3
+# Error text of a rejected `text.format` (JSON schema) rather than a rejected input;
+# a bare "schema" could just as well be an input validation error
+_FORMAT_ERRORS = ("text.format", "response_format", "json_schema")
+
+
+class FormatRejectedError(UpstreamStatusError):
+    """The upstream refused the payload's `text.format` (e.g. an unsupported
+    or invalid JSON schema). Says nothing about the input, so it is neither
+    retried as text nor remembered as a multimodal capability."""
+
+
+def _format_rejected(payload: Dict[str, Any], status: int, body: str) -> bool:
+    if status not in FALLBACK_STATUSES or "format" not in (payload.get("text") or {}):
+        return False
+    try:
+        param = str(json.loads(body)["error"].get("param") or "")
+    except (ValueError, TypeError, KeyError, AttributeError):
+        param = ""
+    if param.startswith(("text.format", "response_format")):
+        return True
+    lowered = body.lower()
+    return any(marker in lowered for marker in _FORMAT_ERRORS)
+
+
+def _is_failure(status: int) -> bool:
+    # Statuses that count against an endpoint's health
+    return status >= 500 or status == 429
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; after
+    `reset_timeout` one probe is let through (half-open) and its outcome
+    closes or re-opens the circuit."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def release_probe(self) -> None:
+        # A cancelled probe says nothing about health; let the next call probe
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_count += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class Endpoint:
+    def __init__(self, base_url: str, breaker: CircuitBreaker, capability_ttl: float) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.url = f"{self.base_url}/responses"
+        self.breaker = breaker
+        self.capability_ttl = capability_ttl
+        self.latencies: Deque[float] = deque(maxlen=256)
+        self.requests = 0
+        self.failures = 0
+        # upstream status code (or "error" for transport failures) -> responses
+        self.statuses: Dict[str, int] = {}
+        # model -> (accepts image blocks, learned at)
+        self._multimodal: Dict[str, Tuple[bool, float]] = {}
+        # model -> multimodal attempts rejected in a row without naming images
+        self._rejections: Dict[str, int] = {}
+
+    def count_status(self, status: str) -> None:
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def supports_multimodal(self, model: str) -> Optional[bool]:
+        known = self._multimodal.get(model)
+        if known is None or time.monotonic() - known[1] > self.capability_ttl:
+            return None
+        return known[0]
+
+    def remember_multimodal(self, model: str, supported: bool) -> None:
+        self._multimodal[model] = (supported, time.monotonic())
+        self._rejections.pop(model, None)
+
+    def multimodal_rejected(self, model: str, body: str) -> None:
+        """A multimodal attempt got a fallback status. One bad screenshot or an
+        unrelated validation error says little, so the model is only marked
+        text-only when the error names image input or keeps recurring."""
+        lowered = body.lower()
+        count = self._rejections.get(model, 0) + 1
+        if count >= MULTIMODAL_REJECTIONS or any(marker in lowered for marker in _IMAGE_ERRORS):
+            self.remember_multimodal(model, False)
+        else:
+            self._rejections[model] = count
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "base_url": self.base_url,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened_count,
+            "requests": self.requests,
+            "failures": self.failures,
+            "statuses": dict(self.statuses),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "multimodal": {m: v for m, (v, _) in self._multimodal.items()},
+        }
+
+
+class UpstreamRouter:
+    """Routes Responses API calls across one or more configured endpoints.
+
+    - remembers per endpoint and model whether image blocks are accepted, so
+      text-only upstreams are not sent a doomed multimodal attempt every call;
+      a rejection counts only if it names image input or keeps recurring
+    - sheds endpoints whose circuit breaker is open and fails over to the next
+    - optionally hedges: if the first attempt has not answered after the
+      endpoint's p95 latency, a second one is fired and the first reply wins
+    """
+
+    def __init__(
+        self,
+        transport: UpstreamClient,
+        base_urls: Sequence[str],
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        capability_ttl: float = 3600.0,
+        hedge: bool = False,
+        hedge_min_delay: float = 1.0,
+        hedge_default_delay: float = 8.0,
+    ) -> None:
+        self.transport = transport
+        self.endpoints = [
+            Endpoint(url, CircuitBreaker(failure_threshold, reset_timeout), capability_ttl) for url in base_urls
+        ]
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.fallbacks = 0
+        self.skipped_multimodal = 0
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _pick(self, exclude: Sequence[Endpoint] = ()) -> Optional[Endpoint]:
+        for ep in self.endpoints:
+            if ep not in exclude and ep.breaker.allow():
+                return ep
+        return None
+
+    def _hedge_delay(self, ep: Endpoint) -> float:
+        p95 = ep.percentile(0.95)
+        return max(self.hedge_min_delay, p95 if p95 is not None else self.hedge_default_delay)
+
+    async def _send(self, ep: Endpoint, kind: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        ep.requests += 1
+        started = time.perf_counter()
+        try:
+            resp = await self.transport.post(ep.url, headers=headers, payload=payload)
+        except asyncio.CancelledError:
+            ep.breaker.release_probe()
+            raise
+        except httpx.HTTPError as e:
+            ep.failures += 1
+            ep.count_status("error")
+            ep.breaker.record_failure()
+            raise UpstreamStatusError(status_code=502, detail=f"upstream unreachable: {e!r}")
+        ep.count_status(str(resp.status_code))
+        if _is_failure(resp.status_code):
+            ep.failures += 1
+            ep.breaker.record_failure()
+            raise UpstreamStatusError(status_code=resp.status_code, detail=resp.text)
+        ep.breaker.record_success()
+        ep.latencies.append(time.perf_counter() - started)
+        if _format_rejected(payload, resp.status_code, resp.text):
+            raise FormatRejectedError(status_code=resp.status_code, detail=resp.text)
+        if kind == "multimodal":
+            # Learned on the endpoint that actually answered, failover or not
+            model = str(payload.get("model", ""))
+            if resp.status_code in FALLBACK_STATUSES:
+                ep.multimodal_rejected(model, resp.text)
+            elif resp.status_code < 400:
+                ep.remember_multimodal(model, True)
+        if resp.status_code >= 400:
+            raise UpstreamStatusError(status_code=resp.status_code, detail=resp.text)
+        return resp.json()
+
+    async def _send_with_failover(
+        self, ep: Endpoint, kind: str, payload: Dict[str, Any], headers: Dict[str, str]
+    ) -> Dict[str, Any]:
+        try:
+            return await self._send(ep, kind, payload, headers)
+        except UpstreamStatusError as he:
+            if not _is_failure(he.status_code):
+                raise
+            alt = self._pick(exclude=[ep])
+            if alt is None:
+                raise
+            self.failovers += 1
+            return await self._send(alt, kind, payload, headers)
+
+    async def _send_hedged(
+        self, ep: Endpoint, kind: str, payload: Dict[str, Any], headers: Dict[str, str]
+    ) -> Dict[str, Any]:
+        if not self.hedge:
+            return await self._send_with_failover(ep, kind, payload, headers)
+        primary = asyncio.ensure_future(self._send_with_failover(ep, kind, payload, headers))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self._hedge_delay(ep))
+            if primary in done:
+                return primary.result()
+            alt = self._pick(exclude=[ep]) or ep
+            hedge = asyncio.ensure_future(self._send(alt, kind, payload, headers))
+            self.hedges += 1
+            pending = {primary, hedge}
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    first_error = first_error or task.exception()
+            assert first_error is not None
+            raise first_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _next(self, attempts: Sequence[Attempt], start: int) -> Tuple[Endpoint, int]:
+        """Healthy endpoint for attempt `start`, skipping a multimodal attempt
+        the endpoint is known to reject when a text attempt follows."""
+        ep = self._pick()
+        if ep is None:
+            raise HTTPException(status_code=503, detail="all upstream endpoints are unavailable")
+        kind, payload = attempts[start]
+        if kind == "multimodal" and start < len(attempts) - 1:
+            if ep.supports_multimodal(str(payload.get("model", ""))) is False:
+                self.skipped_multimodal += 1
+                start += 1
+        return ep, start
+
+    async def complete(self, attempts: Sequence[Attempt], headers: Dict[str, str]) -> Dict[str, Any]:
+        i = 0
+        stage_name = "upstream"
+        while True:
+            ep, i = self._next(attempts, i)
+            kind, payload = attempts[i]
+            try:
+                with stage(stage_name):
+                    return await self._send_hedged(ep, kind, payload, headers)
+            except FormatRejectedError:
+                raise
+            except HTTPException as he:
+                if i == len(attempts) - 1 or he.status_code not in FALLBACK_STATUSES:
+                    raise
+                self.fallbacks += 1
+                stage_name = "upstream_fallback"
+                i += 1
+
+    async def stream(self, attempts: Sequence[Attempt], headers: Dict[str, str]) -> AsyncIterator[Dict[str, Any]]:
+        """Streamed counterpart of `complete`. Falls back to the next attempt
+        only when one is rejected before any event arrives."""
+        i = 0
+        while True:
+            ep, i = self._next(attempts, i)
+            kind, payload = attempts[i]
+            model = str(payload.get("model", ""))
+            started = False
+            ep.requests += 1
+            t0 = time.perf_counter()
+            try:
+                async for event in self.transport.stream(ep.url, headers=headers, payload=payload):
+                    if not started:
+                        started = True
+                        ep.count_status("200")
+                        ep.breaker.record_success()
+                        ep.latencies.append(time.perf_counter() - t0)
+                        record_stage("upstream_first_event", time.perf_counter() - t0)
+                        if kind == "multimodal":
+                            ep.remember_multimodal(model, True)
+                    yield event
+                return
+            except asyncio.CancelledError:
+                ep.breaker.release_probe()
+                raise
+            except httpx.HTTPError as e:
+                ep.failures += 1
+                ep.count_status("error")
+                ep.breaker.record_failure()
+                raise UpstreamStatusError(status_code=502, detail=f"upstream unreachable: {e!r}")
+            except UpstreamStatusError as he:
+                if not started:
+                    ep.count_status(str(he.status_code))
+                if _is_failure(he.status_code):
+                    ep.failures += 1
+                    ep.breaker.record_failure()
+                if started or i == len(attempts) - 1 or he.status_code not in FALLBACK_STATUSES:
+                    raise
+                if kind == "multimodal":
+                    ep.multimodal_rejected(model, str(he.detail))
+                self.fallbacks += 1
+                i += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoints": [ep.stats() for ep in self.endpoints],
+            "fallbacks": self.fallbacks,
+            "skipped_multimodal": self.skipped_multimodal,
+            "failovers": self.failovers,
+            "hedging": self.hedge,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
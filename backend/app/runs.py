@@ -0,0 +1,290 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Union
+
+from fastapi import HTTPException
+
+from .events import EventLog
+
+
+class RunState:
+    IDLE = "idle"
+    RUNNING = "running"
+    PAUSED = "paused"
+    STOPPED = "stopped"
+    DONE = "done"
+
+
+FINISHED_STATES = (RunState.STOPPED, RunState.DONE, "error")
+
+
+class Run:
+    def __init__(self, task: str, event_buffer: int = 1000, run_id: Optional[str] = None) -> None:
+        self.id: str = run_id or str(uuid.uuid4())
+        self.task: str = task
+        self.state: str = RunState.RUNNING
+        self.created_at: float = time.time()
+        self.finished_at: Optional[float] = None
+        self.last_activity: float = self.created_at
+        self.last_message: Optional[str] = None
+        # Ordered log/chat/status events shared by every stream subscriber
+        self.events = EventLog(capacity=event_buffer)
+        # Timings of the most recent steps executed by the scheduler
+        self.steps: Deque[Dict[str, Any]] = deque(maxlen=100)
+        self._worker: Optional[asyncio.Task[Any]] = None
+        # Set while the run may make progress / once it has finished; the
+        # scheduler waits on these instead of polling the state
+        self._runnable = asyncio.Event()
+        self._runnable.set()
+        self._finished = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def _touch(self) -> None:
+        self.last_activity = time.time()
+
+    def apply_state(self, state: str) -> None:
+        """Sets the state locally (no event) and wakes anything waiting on it."""
+        self.state = state
+        if state == RunState.PAUSED:
+            self._runnable.clear()
+        else:
+            self._runnable.set()
+        if self.finished:
+            if self.finished_at is None:
+                self.finished_at = time.time()
+            self._finished.set()
+
+    async def wait_runnable(self) -> None:
+        await self._runnable.wait()
+
+    async def wait_finished(self) -> None:
+        await self._finished.wait()
+
+    def record_step(self, name: str, started_at: float, seconds: float, outcome: str) -> None:
+        self.steps.append({"name": name, "started_at": started_at, "seconds": round(seconds, 4), "outcome": outcome})
+
+    async def _emit(self, data: str, event: Optional[str] = None) -> None:
+        self.events.append(data, event=event)
+
+    async def finish(self) -> None:
+        """Emits the closing `done` event once the run has nothing more to say."""
+        if not self.events.closed:
+            await self._emit(json.dumps({"state": self.state}), event="done")
+
+    def evicted(self, was_finished: bool) -> None:
+        """Called by the registry once the run has been dropped from memory."""
+
+    async def log(self, message: str) -> None:
+        self._touch()
+        self.last_message = message
+        await self._emit(json.dumps({"type": "log", "message": message}))
+
+    async def chat(self, role: str, content: str) -> None:
+        self._touch()
+        self.last_message = content
+        payload = json.dumps({
+            "type": "chat",
+            "message": {
+                "role": role,
+                "content": content
+            }
+        })
+        await self._emit(payload)
+
+    async def set_state(self, next_state: str) -> None:
+        self._touch()
+        self.apply_state(next_state)
+        await self._emit(json.dumps({"state": self.state}), event="status")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "runId": self.id,
+            "task": self.task,
+            "state": self.state,
+            "archived": False,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "last_activity": self.last_activity,
+            "events": self.events.last_seq,
+            "subscribers": self.events.subscribers,
+            "final_message": self.last_message if self.finished else None,
+            "steps": list(self.steps),
+        }
+
+
+class ArchivedRun:
+    """What is left of an evicted run: no queues, buffers or task."""
+
+    __slots__ = ("id", "task", "state", "created_at", "finished_at", "last_activity", "events", "final_message")
+
+    def __init__(
+        self,
+        run_id: str,
+        task: str,
+        state: str,
+        created_at: float,
+        finished_at: Optional[float],
+        last_activity: float,
+        events: int,
+        final_message: Optional[str],
+    ) -> None:
+        self.id = run_id
+        self.task = task[:200]
+        self.state = state
+        self.created_at = created_at
+        self.finished_at = finished_at
+        self.last_activity = last_activity
+        self.events = events
+        self.final_message = final_message
+
+    @classmethod
+    def from_run(cls, run: Run) -> "ArchivedRun":
+        return cls(
+            run.id, run.task, run.state, run.created_at, run.finished_at,
+            run.last_activity, run.events.last_seq, run.last_message,
+        )
+
+    @property
+    def finished(self) -> bool:
+        return True
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "runId": self.id,
+            "task": self.task,
+            "state": self.state,
+            "archived": True,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "last_activity": self.last_activity,
+            "events": self.events,
+            "subscribers": 0,
+            "final_message": self.final_message,
+        }
+
+
+class RunRegistry:
+    """Live runs with a hard cap, plus a bounded archive of evicted ones.
+
+    Finished runs are archived `finished_ttl` seconds after they finish;
+    unfinished runs nobody is streaming and that have been quiet for
+    `idle_ttl` seconds are treated as orphaned, their worker is cancelled and
+    they are archived as stopped. When the live cap is reached, finished and
+    then unwatched runs are evicted oldest first; if none can go, new runs
+    are refused with 429.
+    """
+
+    def __init__(
+        self,
+        max_live: int = 1000,
+        idle_ttl: float = 1800.0,
+        finished_ttl: float = 300.0,
+        max_archived: int = 10000,
+    ) -> None:
+        self.max_live = max(1, max_live)
+        self.idle_ttl = idle_ttl
+        self.finished_ttl = finished_ttl
+        self.max_archived = max_archived
+        self._live: "OrderedDict[str, Run]" = OrderedDict()
+        self._archived: "OrderedDict[str, ArchivedRun]" = OrderedDict()
+        self.evicted_finished = 0
+        self.evicted_idle = 0
+        self.refused = 0
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __iter__(self) -> Iterator[Run]:
+        return iter(list(self._live.values()))
+
+    def get(self, run_id: str) -> Optional[Run]:
+        return self._live.get(run_id)
+
+    def lookup(self, run_id: str) -> Optional[Union[Run, ArchivedRun]]:
+        return self._live.get(run_id) or self._archived.get(run_id)
+
+    def add(self, run: Run) -> None:
+        if len(self._live) >= self.max_live:
+            self._make_room()
+        if len(self._live) >= self.max_live:
+            self.refused += 1
+            raise HTTPException(status_code=429, detail="too many live runs; retry later")
+        self._live[run.id] = run
+
+    def _make_room(self) -> None:
+        for run in self:
+            if run.finished:
+                self.evict(run)
+                self.evicted_finished += 1
+                return
+        for run in self:
+            if run.events.subscribers == 0:
+                self.evict(run)
+                self.evicted_idle += 1
+                return
+
+    def evict(self, run: Run) -> ArchivedRun:
+        """Drops a live run to an archived record, cancelling its worker."""
+        if run._worker is not None and not run._worker.done():
+            run._worker.cancel()
+        was_finished = run.finished
+        if not was_finished:
+            run.apply_state(RunState.STOPPED)
+            run.last_message = run.last_message or "Evicted while idle"
+        if not run.events.closed:
+            run.events.append(json.dumps({"state": run.state}), event="done")
+        self._live.pop(run.id, None)
+        run.evicted(was_finished)
+        record = ArchivedRun.from_run(run)
+        self._archived[run.id] = record
+        while len(self._archived) > self.max_archived:
+            self._archived.popitem(last=False)
+        return record
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        evicted = 0
+        for run in self:
+            if run.finished and run.finished_at is not None:
+                # Keep finished runs around while someone is still watching
+                if now - run.finished_at >= self.finished_ttl and run.events.subscribers == 0:
+                    self.evict(run)
+                    self.evicted_finished += 1
+                    evicted += 1
+            elif run.events.subscribers == 0 and now - run.last_activity >= self.idle_ttl:
+                self.evict(run)
+                self.evicted_idle += 1
+                evicted += 1
+        return evicted
+
+    async def sweep_forever(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    def shutdown(self) -> List[Run]:
+        live = list(self)
+        for run in live:
+            if run._worker is not None and not run._worker.done():
+                run._worker.cancel()
+        return live
+
+    def stats(self) -> Dict[str, Any]:
+        states: Dict[str, int] = {}
+        for run in self._live.values():
+            states[run.state] = states.get(run.state, 0) + 1
+        return {
+            "live": len(self._live),
+            "max_live": self.max_live,
+            "archived": len(self._archived),
+            "states": states,
+            "evicted_finished": self.evicted_finished,
+            "evicted_idle": self.evicted_idle,
+            "refused": self.refused,
+        }
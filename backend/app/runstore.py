@@ -0,0 +1,425 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from .events import RunEvent
+from .runs import ArchivedRun, Run, RunRegistry, RunState
+from .upstream import env_float, env_int
+
+
+class RunBackend(ABC):
+    """Where agent runs and their events live.
+
+    `get` returns a handle usable from this process: `log`, `chat` and
+    `set_state` on it are seen by every process sharing the backend, and its
+    `events` log receives events appended anywhere. Each process keeps its
+    handles in a bounded `RunRegistry`.
+    """
+
+    name = "base"
+
+    def __init__(self, registry: RunRegistry, event_buffer: int = 1000, sweep_interval: float = 30.0) -> None:
+        self.registry = registry
+        self.event_buffer = event_buffer
+        self.sweep_interval = sweep_interval
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    async def start(self) -> None:
+        self._tasks.append(asyncio.create_task(self.registry.sweep_forever(self.sweep_interval)))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        self.registry.shutdown()
+
+    @abstractmethod
+    async def create(self, task: str) -> Run:
+        """Registers a new run owned by this process."""
+
+    @abstractmethod
+    async def get(self, run_id: str) -> Optional[Run]:
+        """Live run, or None if unknown or archived."""
+
+    @abstractmethod
+    async def lookup(self, run_id: str) -> Optional[Union[Run, ArchivedRun]]:
+        """Live or archived run, or None if unknown."""
+
+    async def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self.registry.stats()}
+
+
+class MemoryRunBackend(RunBackend):
+    """Single-process backend: runs only exist in this worker."""
+
+    name = "memory"
+
+    async def create(self, task: str) -> Run:
+        run = Run(task, event_buffer=self.event_buffer)
+        self.registry.add(run)
+        return run
+
+    async def get(self, run_id: str) -> Optional[Run]:
+        return self.registry.get(run_id)
+
+    async def lookup(self, run_id: str) -> Optional[Union[Run, ArchivedRun]]:
+        return self.registry.lookup(run_id)
+
+
+class _SqliteRunStore:
+    """Runs and their events in one SQLite file shared by all workers."""
+
+    def __init__(self, path: str) -> None:
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS agent_runs ("
+                " id TEXT PRIMARY KEY, task TEXT NOT NULL, state TEXT NOT NULL, owner TEXT NOT NULL,"
+                " created_at REAL NOT NULL, finished_at REAL, last_activity REAL NOT NULL,"
+                " last_message TEXT, last_seq INTEGER NOT NULL DEFAULT 0, archived INTEGER NOT NULL DEFAULT 0)"
+            )
+            # id orders events across runs for the pollers; seq numbers them within a run
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS agent_events ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT NOT NULL, seq INTEGER NOT NULL,"
+                " event TEXT, data TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS agent_events_run ON agent_events (run_id, seq)")
+
+    def create(self, run: Run, owner: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO agent_runs (id, task, state, owner, created_at, last_activity) VALUES (?, ?, ?, ?, ?, ?)",
+                (run.id, run.task, run.state, owner, run.created_at, run.last_activity),
+            )
+
+    def append(self, run: Run, event: Optional[str], data: str, keep: int) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT last_seq FROM agent_runs WHERE id = ?", (run.id,)).fetchone()
+                seq = (row[0] if row else 0) + 1
+                self._conn.execute(
+                    "INSERT INTO agent_events (run_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                    (run.id, seq, event, data),
+                )
+                if event == "status":
+                    # Only status events move the shared state, so a worker that
+                    # has not yet seen a remote pause cannot overwrite it
+                    self._conn.execute(
+                        "UPDATE agent_runs SET state = ?, finished_at = ?, last_activity = ?, last_seq = ?"
+                        " WHERE id = ?",
+                        (run.state, run.finished_at, run.last_activity, seq, run.id),
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE agent_runs SET last_message = ?, last_activity = ?, last_seq = ? WHERE id = ?",
+                        (run.last_message, run.last_activity, seq, run.id),
+                    )
+                if seq % 64 == 0:
+                    self._conn.execute("DELETE FROM agent_events WHERE run_id = ? AND seq <= ?", (run.id, seq - keep))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return seq
+
+    def load(self, run_id: str, limit: int) -> Optional[Tuple[Dict[str, Any], List[RunEvent]]]:
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM agent_runs WHERE id = ?", (run_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            record = dict(zip([c[0] for c in cur.description], row))
+            events = self._conn.execute(
+                "SELECT seq, event, data FROM agent_events WHERE run_id = ? ORDER BY seq DESC LIMIT ?",
+                (run_id, limit),
+            ).fetchall()
+        return record, [(int(s), e, d) for s, e, d in reversed(events)]
+
+    def events_after(self, after_id: int, limit: int = 1000) -> List[Tuple[int, str, int, Optional[str], str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, run_id, seq, event, data FROM agent_events WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit),
+            ).fetchall()
+
+    def max_event_id(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(id) FROM agent_events").fetchone()
+            return int(row[0] or 0)
+
+    def archive(self, run_id: str, max_archived: int) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE agent_runs SET archived = 1 WHERE id = ?", (run_id,))
+            # The last event stays so other workers' pollers still see the final status
+            self._conn.execute(
+                "DELETE FROM agent_events WHERE run_id = ?"
+                " AND seq < (SELECT last_seq FROM agent_runs WHERE id = ?)",
+                (run_id, run_id),
+            )
+            pruned = self._conn.execute(
+                "DELETE FROM agent_runs WHERE archived = 1 AND id NOT IN"
+                " (SELECT id FROM agent_runs WHERE archived = 1 ORDER BY last_activity DESC LIMIT ?)",
+                (max_archived,),
+            ).rowcount
+            if pruned:
+                self._conn.execute("DELETE FROM agent_events WHERE run_id NOT IN (SELECT id FROM agent_runs)")
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT archived, COUNT(*) FROM agent_runs GROUP BY archived").fetchall()
+        counts = {"shared_live": 0, "shared_archived": 0}
+        for archived, n in rows:
+            counts["shared_archived" if archived else "shared_live"] = n
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SharedRun(Run):
+    """A run whose events go through the shared store.
+
+    The owner (the process running its worker) and any number of mirrors in
+    other processes hold one each; the local event log is filled only by the
+    backend's poller, in store order, so every handle sees the same sequence.
+    """
+
+    def __init__(
+        self,
+        backend: "SqliteRunBackend",
+        task: str,
+        event_buffer: int = 1000,
+        run_id: Optional[str] = None,
+        owned: bool = True,
+    ) -> None:
+        super().__init__(task, event_buffer=event_buffer, run_id=run_id)
+        self.owned = owned
+        self._backend = backend
+
+    async def _emit(self, data: str, event: Optional[str] = None) -> None:
+        await self._backend.append(self, data, event)
+
+    def mirror(self, seq: int, event: Optional[str], data: str) -> None:
+        if seq <= self.events.last_seq:
+            return
+        self.last_activity = time.time()
+        if event in ("status", "done"):
+            # Pause/stop through another worker reaches the owner's scheduler here;
+            # archiving keeps only the final `done`, which carries the state too
+            self.apply_state(str(json.loads(data).get("state") or self.state))
+        self.events.append(data, event=event, seq=seq)
+
+    def evicted(self, was_finished: bool) -> None:
+        # Mirrors are just dropped; the owner decides when the shared run ends
+        if self.owned:
+            self._backend.archive_soon(self, was_finished)
+
+
+class SqliteRunBackend(RunBackend):
+    """Shares runs between worker processes through a SQLite file in WAL mode.
+
+    Each process polls the event table once per `poll_interval` (one query
+    for all runs, woken early by its own writes) and feeds new events into
+    the handles it holds, so pause/resume/stop and streams work from any
+    worker. Workers are owned by the process that started the run.
+    """
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        path: str,
+        registry: RunRegistry,
+        event_buffer: int = 1000,
+        sweep_interval: float = 30.0,
+        poll_interval: float = 0.1,
+        max_archived: int = 10000,
+    ) -> None:
+        super().__init__(registry, event_buffer=event_buffer, sweep_interval=sweep_interval)
+        # Archived records live in the shared store, not per process
+        registry.max_archived = 0
+        self.poll_interval = poll_interval
+        self.max_archived = max_archived
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._store = _SqliteRunStore(path)
+        self._cursor = 0
+        self._kick = asyncio.Event()
+        # run id -> events the poller saw while `get` was loading that run
+        self._loading: Dict[str, List[RunEvent]] = {}
+        self._archiving: Set["asyncio.Task[None]"] = set()
+        self.polls = 0
+        self.mirrored = 0
+
+    async def start(self) -> None:
+        self._cursor = await asyncio.to_thread(self._store.max_event_id)
+        await super().start()
+        self._tasks.append(asyncio.create_task(self._poll_forever()))
+
+    async def close(self) -> None:
+        for run in self.registry:
+            if isinstance(run, SharedRun) and run.owned and not run.finished:
+                # Its worker dies with this process
+                run.apply_state(RunState.STOPPED)
+                await asyncio.to_thread(self._finish, run)
+        await super().close()
+        await asyncio.gather(*self._archiving, return_exceptions=True)
+        await asyncio.to_thread(self._store.close)
+
+    def _finish(self, run: Run) -> None:
+        # Ends a run whose owner can no longer do it through `set_state`/`finish`
+        self._store.append(run, "status", json.dumps({"state": run.state}), self.event_buffer)
+        self._store.append(run, "done", json.dumps({"state": run.state}), self.event_buffer)
+
+    async def _poll_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._kick.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._kick.clear()
+            try:
+                rows = await asyncio.to_thread(self._store.events_after, self._cursor)
+            except sqlite3.Error:
+                continue
+            self.polls += 1
+            for event_id, run_id, seq, event, data in rows:
+                self._cursor = event_id
+                run = self.registry.get(run_id)
+                if isinstance(run, SharedRun):
+                    run.mirror(seq, event, data)
+                    self.mirrored += 1
+                elif run_id in self._loading:
+                    self._loading[run_id].append((seq, event, data))
+            if len(rows) >= 1000:
+                self._kick.set()
+
+    async def append(self, run: Run, data: str, event: Optional[str]) -> None:
+        await asyncio.to_thread(self._store.append, run, event, data, self.event_buffer)
+        self._kick.set()
+
+    def archive_soon(self, run: Run, was_finished: bool) -> None:
+        """Archives an evicted run off the loop; eviction itself stays synchronous."""
+        task = asyncio.create_task(self.archive(run, was_finished))
+        self._archiving.add(task)
+        task.add_done_callback(self._archiving.discard)
+
+    async def archive(self, run: Run, was_finished: bool) -> None:
+        def write() -> None:
+            if not was_finished:
+                # Evicted while idle: record it as stopped for everyone else
+                self._finish(run)
+            self._store.archive(run.id, self.max_archived)
+
+        await asyncio.to_thread(write)
+
+    async def create(self, task: str) -> Run:
+        run = SharedRun(self, task, event_buffer=self.event_buffer)
+        self.registry.add(run)
+        await asyncio.to_thread(self._store.create, run, self.owner)
+        return run
+
+    async def get(self, run_id: str) -> Optional[Run]:
+        run = self.registry.get(run_id)
+        if run is not None:
+            return run
+        # Events the poller sees while the load runs are kept and replayed;
+        # anything it processed earlier is already in the loaded backfill
+        self._loading.setdefault(run_id, [])
+        try:
+            loaded = await asyncio.to_thread(self._store.load, run_id, self.event_buffer)
+        finally:
+            missed = self._loading.pop(run_id, [])
+        run = self.registry.get(run_id)
+        if run is not None:
+            # Registered by a concurrent `get` meanwhile
+            return run
+        if loaded is None or loaded[0]["archived"]:
+            return None
+        record, events = loaded
+        mirror = SharedRun(self, record["task"], event_buffer=self.event_buffer, run_id=run_id, owned=False)
+        mirror.created_at = record["created_at"]
+        mirror.finished_at = record["finished_at"]
+        mirror.apply_state(record["state"])
+        mirror.last_activity = record["last_activity"]
+        mirror.last_message = record["last_message"]
+        for seq, event, data in events:
+            mirror.events.append(data, event=event, seq=seq)
+        for seq, event, data in missed:
+            mirror.mirror(seq, event, data)
+        self.registry.add(mirror)
+        return mirror
+
+    async def lookup(self, run_id: str) -> Optional[Union[Run, ArchivedRun]]:
+        run = self.registry.get(run_id)
+        if run is None:
+            # A new mirror is read straight from the store, so it is current
+            return await self.get(run_id) or await self._archived(run_id)
+        loaded = await asyncio.to_thread(self._store.load, run_id, 0)
+        if loaded is None:
+            return None
+        r = loaded[0]
+        if r["archived"]:
+            return await self._archived(run_id)
+        # A held handle may trail the store by one poll; reads should see
+        # writes already acknowledged by other workers
+        run.finished_at = run.finished_at or r["finished_at"]
+        run.apply_state(r["state"])
+        run.last_activity = max(run.last_activity, r["last_activity"])
+        run.last_message = r["last_message"]
+        return run
+
+    async def _archived(self, run_id: str) -> Optional[ArchivedRun]:
+        loaded = await asyncio.to_thread(self._store.load, run_id, 0)
+        if loaded is None:
+            return None
+        r = loaded[0]
+        return ArchivedRun(
+            run_id, r["task"], r["state"], r["created_at"], r["finished_at"],
+            r["last_activity"], r["last_seq"], r["last_message"],
+        )
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            **await super().stats(),
+            "owner": self.owner,
+            "polls": self.polls,
+            "mirrored_events": self.mirrored,
+            **await asyncio.to_thread(self._store.counts),
+        }
+
+
+def run_backend_from_env(event_buffer: int = 1000) -> RunBackend:
+    """AGENT_RUN_BACKEND=memory (default) or sqlite (with AGENT_SQLITE_PATH)."""
+    max_archived = env_int("AGENT_MAX_ARCHIVED_RUNS", 10000)
+    registry = RunRegistry(
+        max_live=env_int("AGENT_MAX_LIVE_RUNS", 1000),
+        idle_ttl=env_float("AGENT_IDLE_TTL", 1800.0),
+        finished_ttl=env_float("AGENT_FINISHED_TTL", 300.0),
+        max_archived=max_archived,
+    )
+    sweep_interval = env_float("AGENT_SWEEP_INTERVAL", 30.0)
+    kind = os.getenv("AGENT_RUN_BACKEND", "memory").strip().lower()
+    if kind == "sqlite":
+        return SqliteRunBackend(
+            os.getenv("AGENT_SQLITE_PATH", "agent_runs.sqlite3"),
+            registry,
+            event_buffer=event_buffer,
+            sweep_interval=sweep_interval,
+            poll_interval=env_float("AGENT_POLL_INTERVAL", 0.1),
+            max_archived=max_archived,
+        )
+    if kind != "memory":
+        raise ValueError(f"unknown AGENT_RUN_BACKEND: {kind!r}")
+    return MemoryRunBackend(registry, event_buffer=event_buffer, sweep_interval=sweep_interval)
@@ -0,0 +1,213 @@
+import asyncio
+import importlib
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Set, Tuple
+
+from fastapi import HTTPException
+
+from .runs import Run, RunState
+from .upstream import ConcurrencyLimiter
+
+# One unit of agent work; it may log/chat on the run and is timed by the scheduler
+StepFn = Callable[[Run], Awaitable[None]]
+Step = Tuple[str, StepFn]
+# Turns a run into its steps; swap in real agent steps with AGENT_PLANNER
+Planner = Callable[[Run], Sequence[Step]]
+
+DEMO_STEPS = [
+    "Analyzing the page…",
+    "Planning actions…",
+    "Executing step 1…",
+    "Executing step 2…",
+    "Finalizing…",
+]
+
+
+def _demo_step(message: str) -> StepFn:
+    async def step(run: Run) -> None:
+        await run.log(message)
+        await asyncio.sleep(0.8)
+
+    return step
+
+
+def demo_plan(run: Run) -> List[Step]:
+    return [(message, _demo_step(message)) for message in DEMO_STEPS]
+
+
+def load_planner(spec: str) -> Planner:
+    """`package.module:function` to a planner; empty means the demo steps."""
+    if not spec:
+        return demo_plan
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+class RunStopped(Exception):
+    """The run was stopped (or finished elsewhere) between or during steps."""
+
+
+class RunScheduler:
+    """Executes agent runs with at most `max_concurrent` running at once.
+
+    Extra runs wait in a FIFO queue of up to `max_queued`. Runs check in
+    between steps. A paused run gives its slot to the next queued run and
+    waits on an event until it is resumed, so paused and queued runs cost no
+    CPU. A run stopped mid-step gets `stop_grace` seconds to finish the step
+    before the step is cancelled.
+    """
+
+    def __init__(
+        self,
+        planner: Planner = demo_plan,
+        max_concurrent: int = 64,
+        max_queued: int = 1000,
+        stop_grace: float = 2.0,
+    ) -> None:
+        self.planner = planner
+        self.slots = ConcurrencyLimiter(max_concurrent, max_queued, None)
+        self.stop_grace = stop_grace
+        self._queued: Set[str] = set()
+        # Places held for runs being created, and runs whose worker has not
+        # reached the slot queue yet; both count against capacity
+        self._reserved = 0
+        self._starting: Set[str] = set()
+        self.submitted = 0
+        self.completed = 0
+        self.stopped = 0
+        self.failed = 0
+        self.steps = 0
+        self.step_seconds = 0.0
+
+    def check_capacity(self) -> None:
+        admitted = self.slots.in_flight + self.slots.queue_depth + self._reserved + len(self._starting)
+        if admitted >= self.slots.max_concurrency + self.slots.max_queue:
+            raise HTTPException(status_code=429, detail="agent run queue full; retry later")
+
+    def reserve(self) -> None:
+        """Holds a place for a run about to be created, so nothing can take it
+        between the check and `submit(run, reserved=True)`. Hand it back with
+        `release` if the run is never submitted."""
+        self.check_capacity()
+        self._reserved += 1
+
+    def release(self) -> None:
+        self._reserved -= 1
+
+    def submit(self, run: Run, reserved: bool = False) -> None:
+        if reserved:
+            self.release()
+        else:
+            self.check_capacity()
+        self.submitted += 1
+        self._starting.add(run.id)
+        run._worker = asyncio.create_task(self._execute(run))
+        # Also covers a worker cancelled before it ever ran
+        run._worker.add_done_callback(lambda _: self._starting.discard(run.id))
+
+    async def join(self, run: Run) -> None:
+        """Waits for a stopped run's worker to wind down."""
+        worker = run._worker
+        if worker is None or worker.done():
+            return
+        if run.id in self._queued:
+            # Still waiting for a slot: nothing to wind down
+            worker.cancel()
+        done, _ = await asyncio.wait({worker}, timeout=self.stop_grace + 1.0)
+        if not done:
+            worker.cancel()
+
+    async def _execute(self, run: Run) -> None:
+        held = False
+
+        async def acquire() -> None:
+            nonlocal held
+            self._starting.discard(run.id)
+            self._queued.add(run.id)
+            try:
+                await self.slots.acquire()
+                held = True
+            finally:
+                self._queued.discard(run.id)
+
+        async def checkpoint() -> None:
+            nonlocal held
+            if run.state == RunState.PAUSED:
+                # Give the slot to the next queued run while paused
+                self.slots.release()
+                held = False
+                await run.wait_runnable()
+                if not run.finished:
+                    await acquire()
+            if run.finished:
+                raise RunStopped
+
+        try:
+            await acquire()
+            await checkpoint()
+            await run.log("Worker started")
+            await run.chat("assistant", f"Starting task: {run.task}")
+            for name, step in self.planner(run):
+                await checkpoint()
+                await self._run_step(run, name, step)
+            await checkpoint()
+            await run.chat("assistant", "Task completed successfully.")
+            await run.set_state(RunState.DONE)
+            await run.log("Worker finished")
+            await run.finish()
+            self.completed += 1
+        except RunStopped:
+            self.stopped += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            await run.log(f"Worker error: {e}")
+            await run.set_state("error")
+            await run.finish()
+        finally:
+            if held:
+                self.slots.release()
+
+    async def _run_step(self, run: Run, name: str, step: StepFn) -> None:
+        started_at = time.time()
+        t0 = time.perf_counter()
+        task = asyncio.ensure_future(step(run))
+        stop = asyncio.ensure_future(run.wait_finished())
+        outcome = "ok"
+        try:
+            await asyncio.wait({task, stop}, return_when=asyncio.FIRST_COMPLETED)
+            if not task.done():
+                await asyncio.wait({task}, timeout=self.stop_grace)
+            if not task.done():
+                outcome = "cancelled"
+                raise RunStopped
+            try:
+                task.result()
+            except Exception:
+                outcome = "error"
+                raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            stop.cancel()
+            task.cancel()
+            elapsed = time.perf_counter() - t0
+            self.steps += 1
+            self.step_seconds += elapsed
+            run.record_step(name, started_at, elapsed, outcome)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.slots.max_concurrency,
+            "max_queued": self.slots.max_queue,
+            "executing": self.slots.in_flight,
+            "queued": self.slots.queue_depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "stopped": self.stopped,
+            "failed": self.failed,
+            "steps": self.steps,
+            "avg_step_ms": round(1000 * self.step_seconds / self.steps, 1) if self.steps else 0.0,
+        }
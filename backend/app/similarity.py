@@ -0,0 +1,178 @@
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# One-permutation MinHash: features are hashed once into BINS ranges and the
+# minimum of each range is kept. Only the low byte of each minimum is stored
+# (b-bit MinHash), so a signature is BINS bytes and comparing two is one XOR
+# and a byte count.
+BINS = 128
+_BIN_SHIFT = 64 - (BINS.bit_length() - 1)
+# LSH bands over the signature: pages at the default threshold share at
+# least one band with near certainty, unrelated pages practically never
+BANDS = 16
+ROWS = BINS // BANDS
+# Counters, timestamps and prices churn on every load; they are dropped
+_DIGITS = b"0123456789"
+
+
+def page_features(dom_html: str) -> set:
+    """Distinct HTML segments (text between tags, or lines) of the page,
+    lowercased and without digits. Python's hash of these is per-process,
+    which is fine for an in-memory index."""
+    data = dom_html.encode("utf-8", "replace").lower().translate(None, _DIGITS)
+    return set(data.replace(b"\n", b"<").split(b"<"))
+
+
+def signature(dom_html: str, min_features: int = 16) -> Optional[bytes]:
+    """BINS-byte MinHash signature, or None for pages too small to judge."""
+    hashes = sorted(map(hash, page_features(dom_html)))
+    if len(hashes) < min_features:
+        return None
+    n = len(hashes)
+    mins: List[Optional[int]] = []
+    for b in range(BINS):
+        # hash() is signed: bins span [-2**63, 2**63) in order
+        low = (b - BINS // 2) << _BIN_SHIFT
+        i = bisect_left(hashes, low)
+        mins.append(hashes[i] & 0xFF if i < n and hashes[i] < low + (1 << _BIN_SHIFT) else None)
+    # Empty bins borrow the next filled bin's value (rotation densification)
+    filled = [m for m in mins if m is not None]
+    out = bytearray(BINS)
+    nxt = filled[0]
+    for b in range(BINS - 1, -1, -1):
+        if mins[b] is not None:
+            nxt = mins[b]
+        out[b] = nxt
+    return bytes(out)
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Estimated Jaccard similarity of two pages' feature sets."""
+    equal = (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(BINS, "little").count(0)
+    # Unrelated bytes still match 1 time in 256
+    return max(0.0, (equal / BINS - 1 / 256) / (1 - 1 / 256))
+
+
+def url_scope(url: Optional[str], scope: str) -> Optional[str]:
+    """The page's bucket: scheme://host/path ("url", query and fragment
+    dropped) or scheme://host ("origin"). None without a usable URL."""
+    if not url:
+        return None
+    parts = urlsplit(url.strip())
+    if not parts.netloc:
+        return None
+    origin = f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+    return origin if scope == "origin" else origin + (parts.path.rstrip("/") or "/")
+
+
+class _Entry:
+    __slots__ = ("bucket", "sig")
+
+    def __init__(self, bucket: int, sig: bytes) -> None:
+        self.bucket = bucket
+        self.sig = sig
+
+
+class NearDuplicateIndex:
+    """Signatures of recently analyzed pages, keyed by their result's cache
+    key and grouped in buckets (mode, model, prompt, URL or origin...).
+
+    `find` returns the most similar page in the same bucket at or above
+    `threshold`, looking only at pages sharing an LSH band, so a lookup costs
+    BANDS dict probes however many pages are indexed. At most `max_entries`
+    pages are kept, least recently used first out.
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 10000, min_features: int = 16) -> None:
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.min_features = min_features
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # hash(bucket, band, band bytes) -> newest key with that band
+        self._bands: Dict[int, str] = {}
+        # Signatures computed by `find`, reused by `add` for the same key
+        self._recent: "OrderedDict[str, Optional[bytes]]" = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.signatures = 0
+        self.signature_time = 0.0
+        self.lookup_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _signature(self, key: str, dom_html: str) -> Optional[bytes]:
+        if key in self._recent:
+            return self._recent.pop(key)
+        t0 = time.perf_counter()
+        sig = signature(dom_html, self.min_features)
+        self.signatures += 1
+        self.signature_time += time.perf_counter() - t0
+        return sig
+
+    @staticmethod
+    def _band_keys(bucket: int, sig: bytes) -> List[int]:
+        return [hash((bucket, i, sig[i * ROWS:(i + 1) * ROWS])) for i in range(BANDS)]
+
+    def find(self, bucket: Hashable, key: str, dom_html: str) -> Optional[Tuple[str, float]]:
+        """(cache key, similarity) of the closest indexed page, if any."""
+        self.lookups += 1
+        sig = self._signature(key, dom_html)
+        self._recent[key] = sig
+        while len(self._recent) > 256:
+            self._recent.popitem(last=False)
+        if sig is None:
+            return None
+        t0 = time.perf_counter()
+        b = hash(bucket)
+        best: Optional[Tuple[str, float]] = None
+        for band in self._band_keys(b, sig):
+            other = self._bands.get(band)
+            entry = self._entries.get(other) if other is not None else None
+            if entry is None or entry.bucket != b or other == key:
+                continue
+            score = similarity(sig, entry.sig)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (other, score)
+        if best is not None:
+            self.hits += 1
+            self._entries.move_to_end(best[0])
+        self.lookup_time += time.perf_counter() - t0
+        return best
+
+    def add(self, bucket: Hashable, key: str, dom_html: str) -> None:
+        sig = self._signature(key, dom_html)
+        if sig is None:
+            return
+        b = hash(bucket)
+        self.discard(key)
+        self._entries[key] = _Entry(b, sig)
+        for band in self._band_keys(b, sig):
+            self._bands[band] = key
+        while len(self._entries) > self.max_entries:
+            self.discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band in self._band_keys(entry.bucket, entry.sig):
+            if self._bands.get(band) == key:
+                del self._bands[band]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "evictions": self.evictions,
+            "avg_signature_ms": round(1000 * self.signature_time / self.signatures, 3) if self.signatures else 0.0,
+            "avg_lookup_us": round(1e6 * self.lookup_time / self.lookups, 2) if self.lookups else 0.0,
+        }
@@ -0,0 +1,80 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    __slots__ = ("task", "waiters", "tag")
+
+    def __init__(self, task: "asyncio.Task[T]", tag: Any = None) -> None:
+        self.task = task
+        self.waiters = 0
+        self.tag = tag
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls with the same key onto one task.
+
+    Every caller awaits the shared task through `asyncio.shield`, so one
+    caller being cancelled (e.g. its client went away) does not cancel the
+    work for the others. The shared task is cancelled only when its last
+    waiter leaves.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call[T]] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[T]],
+        tag: Any = None,
+        on_join: Optional[Callable[[Any], None]] = None,
+    ) -> Tuple[T, bool]:
+        """Run `fn` once per key at a time. Returns (result, shared) where
+        `shared` is True if this caller joined a call already in flight.
+        A new call keeps the leader's `tag`; a caller joining it runs
+        `on_join(tag)` first."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()), tag)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            if on_join is not None:
+                on_join(call.tag)
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self.cancelled += 1
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Nobody may be left to observe a failure; mark it retrieved
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "cancelled": self.cancelled,
+        }
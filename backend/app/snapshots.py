@@ -0,0 +1,126 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+
+def snapshot_id_for(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()[:32]
+
+
+class Snapshot:
+    __slots__ = ("id", "text", "page_url", "created_at", "results")
+
+    def __init__(self, snapshot_id: str, text: str, page_url: Optional[str]) -> None:
+        self.id = snapshot_id
+        self.text = text
+        self.page_url = page_url
+        self.created_at = time.time()
+        # Latest parsed result per mode, used to summarize unchanged regions
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.text)
+
+
+class SnapshotStore:
+    """Bounded LRU of recently analyzed page texts, addressed by content hash.
+
+    Clients that already sent a page can send `{base_snapshot_id, delta}`
+    instead of the whole text; if the base has been evicted the request is
+    answered with 409 and the client resends the full page.
+    """
+
+    def __init__(self, max_entries: int, max_chars: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Snapshot]" = OrderedDict()
+        self.chars_used = 0
+        self.evictions = 0
+        self.delta_requests = 0
+        self.delta_misses = 0
+        self.delta_chars_saved = 0
+
+    def get(self, snapshot_id: str) -> Optional[Snapshot]:
+        snap = self._items.get(snapshot_id)
+        if snap is None:
+            return None
+        if time.time() - snap.created_at > self.ttl:
+            self._drop(snapshot_id)
+            return None
+        self._items.move_to_end(snapshot_id)
+        return snap
+
+    def put(self, text: str, page_url: Optional[str]) -> Snapshot:
+        snapshot_id = snapshot_id_for(text)
+        snap = self.get(snapshot_id)
+        if snap is not None:
+            snap.created_at = time.time()
+            return snap
+        snap = Snapshot(snapshot_id, text, page_url)
+        if self.max_entries <= 0 or snap.size > self.max_chars:
+            return snap
+        self._items[snapshot_id] = snap
+        self.chars_used += snap.size
+        while self._items and (len(self._items) > self.max_entries or self.chars_used > self.max_chars):
+            self._drop(next(iter(self._items)))
+            self.evictions += 1
+        return snap
+
+    def _drop(self, snapshot_id: str) -> None:
+        snap = self._items.pop(snapshot_id, None)
+        if snap is not None:
+            self.chars_used -= snap.size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._items),
+            "chars_used": self.chars_used,
+            "max_entries": self.max_entries,
+            "max_chars": self.max_chars,
+            "evictions": self.evictions,
+            "delta_requests": self.delta_requests,
+            "delta_misses": self.delta_misses,
+            "delta_chars_saved": self.delta_chars_saved,
+        }
+
+
+def apply_delta(base: str, hunks: Sequence[Any]) -> Tuple[str, List[Tuple[int, int]]]:
+    """Applies line hunks to `base` (lines are `base.split("\\n")`).
+
+    Each hunk replaces base lines [start, end) with `lines`. Hunks must be
+    sorted and non-overlapping. Returns the new text and the changed line
+    ranges in new-document coordinates.
+    """
+    old = base.split("\n")
+    out: List[str] = []
+    changed: List[Tuple[int, int]] = []
+    cursor = 0
+    for h in hunks:
+        if h.start < cursor or h.end < h.start or h.end > len(old):
+            raise HTTPException(status_code=422, detail=f"invalid delta hunk [{h.start}, {h.end})")
+        out.extend(old[cursor:h.start])
+        begin = len(out)
+        out.extend(h.lines)
+        # Pure deletions still mark the spot so the model sees the context
+        changed.append((begin, max(len(out), begin + 1)))
+        cursor = h.end
+    out.extend(old[cursor:])
+    return "\n".join(out), changed
+
+
+def changed_regions(text: str, ranges: Sequence[Tuple[int, int]], context: int = 2) -> str:
+    """The changed lines plus a little surrounding context, merged."""
+    lines = text.split("\n")
+    spans: List[List[int]] = []
+    for start, end in ranges:
+        lo, hi = max(0, start - context), min(len(lines), end + context)
+        if spans and lo <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], hi)
+        else:
+            spans.append([lo, hi])
+    return "\n...\n".join("\n".join(lines[lo:hi]) for lo, hi in spans)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from typing import AsyncGenerator, Awaitable, Callable, Optional
+
+from .events import EventLog
+
+
+def sse_event(data: str, event: Optional[str] = None, id: Optional[int] = None) -> str:
+    """One SSE frame. JSON payloads are a single line, so the common case is
+    one format call; multi-line data gets a `data:` field per line."""
+    head = ""
+    if id is not None:
+        head = f"id: {id}\n"
+    if event:
+        head += f"event: {event}\n"
+    if "\n" not in data and "\r" not in data:
+        return f"{head}data: {data}\n\n" if data else head + "\n"
+    return head + "".join(f"data: {line}\n" for line in data.splitlines()) + "\n"
+
+
+async def stream_event_log(
+    log: EventLog,
+    cursor: int,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    heartbeat: float = 15.0,
+    coalesce: float = 0.02,
+) -> AsyncGenerator[bytes, None]:
+    """SSE frames for the events after `cursor` until the log closes.
+
+    Everything pending is sent as one chunk. Under heavy logging, events
+    arriving within `coalesce` seconds of the previous write are held back
+    and go out together, so a busy stream costs at most one write per
+    window; the first event after a quiet spell is sent at once. A `: ping`
+    comment is sent only after `heartbeat` seconds without any write.
+    """
+    last_write = time.monotonic()
+    while True:
+        events = log.since(cursor)
+        if events:
+            pause = coalesce - (time.monotonic() - last_write)
+            if pause > 0 and not log.closed:
+                await asyncio.sleep(pause)
+                events = log.since(cursor)
+            cursor = events[-1][0]
+            yield "".join(sse_event(data, event=event, id=seq) for seq, event, data in events).encode()
+            last_write = time.monotonic()
+            continue
+        if log.closed:
+            return
+        idle = time.monotonic() - last_write
+        if not await log.wait(cursor, timeout=max(0.0, heartbeat - idle)):
+            if await is_disconnected():
+                return
+            # Comment frame: keeps proxies from timing out, ignored by EventSource
+            yield b": ping\n\n"
+            last_write = time.monotonic()
@@ -0,0 +1,236 @@
+import hashlib
+import re
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from .upstream import env_int
+
+# name="value" or name=value pairs in Content-Type / Content-Disposition
+_PARAM = re.compile(r';\s*([\w*-]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;\s]+))')
+# Part headers larger than this are not a browser talking to us
+MAX_PART_HEADER_BYTES = 16 * 1024
+
+
+def _params(value: str) -> Tuple[str, Dict[str, str]]:
+    main, _, rest = value.partition(";")
+    params = {}
+    for m in _PARAM.finditer(";" + rest):
+        quoted = m.group(2)
+        params[m.group(1).lower()] = quoted.replace('\\"', '"') if quoted is not None else m.group(3)
+    return main.strip().lower(), params
+
+
+class UploadLimits:
+    def __init__(
+        self,
+        max_body: int = 64 * 1024 * 1024,
+        max_file: int = 25 * 1024 * 1024,
+        max_files: int = 8,
+        max_field: int = 8 * 1024 * 1024,
+        spool_bytes: int = 1024 * 1024,
+    ) -> None:
+        self.max_body = max_body
+        self.max_file = max_file
+        self.max_files = max_files
+        self.max_field = max_field
+        self.spool_bytes = spool_bytes
+
+    @classmethod
+    def from_env(cls) -> "UploadLimits":
+        return cls(
+            max_body=env_int("UPLOAD_MAX_BYTES", 64 * 1024 * 1024),
+            max_file=env_int("UPLOAD_MAX_FILE_BYTES", 25 * 1024 * 1024),
+            max_files=env_int("UPLOAD_MAX_FILES", 8),
+            max_field=env_int("UPLOAD_MAX_FIELD_BYTES", 8 * 1024 * 1024),
+            spool_bytes=env_int("UPLOAD_SPOOL_BYTES", 1024 * 1024),
+        )
+
+
+class UploadedFile:
+    """A file part spooled in memory up to the spool size, then on disk.
+    `sha256` is computed while the part streams in."""
+
+    __slots__ = ("name", "filename", "content_type", "file", "size", "sha256")
+
+    def __init__(self, name: str, filename: str, content_type: str, spool_bytes: int) -> None:
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.file: Any = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.size += len(data)
+        self.sha256.update(data)
+
+
+class MultipartForm:
+    def __init__(self) -> None:
+        self.fields: Dict[str, str] = {}
+        self.files: List[UploadedFile] = []
+
+    def close(self) -> None:
+        for f in self.files:
+            f.file.close()
+
+
+class _Part:
+    __slots__ = ("name", "upload", "field", "size")
+
+    def __init__(self, name: str, upload: Optional[UploadedFile]) -> None:
+        self.name = name
+        self.upload = upload
+        self.field = bytearray()
+        self.size = 0
+
+
+class MultipartReader:
+    """Incremental multipart/form-data parser fed with body chunks.
+
+    Limits are checked as bytes arrive, so an oversized upload is refused
+    with 413 after reading at most one chunk past the limit rather than
+    after buffering the whole body.
+    """
+
+    def __init__(self, boundary: bytes, limits: UploadLimits) -> None:
+        self.limits = limits
+        self.form = MultipartForm()
+        self._delimiter = b"\r\n--" + boundary
+        # A boundary only counts at the start of a line; the leading CRLF lets
+        # one at the very start of the body match like any other
+        self._buf = bytearray(b"\r\n")
+        self._state = "preamble"
+        self._part: Optional[_Part] = None
+        self.received = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self.received += len(chunk)
+        if self.received > self.limits.max_body:
+            raise HTTPException(status_code=413, detail=f"request body over {self.limits.max_body} bytes")
+        self._buf += chunk
+        while self._step():
+            pass
+
+    def finish(self) -> MultipartForm:
+        if self._state != "done":
+            raise HTTPException(status_code=400, detail="truncated multipart body")
+        return self.form
+
+    def _step(self) -> bool:
+        buf = self._buf
+        if self._state == "preamble":
+            at = buf.find(self._delimiter)
+            if at < 0:
+                # Keep a possible partial boundary; the preamble itself is ignored
+                del buf[: max(0, len(buf) - len(self._delimiter) + 1)]
+                return False
+            del buf[: at + len(self._delimiter)]
+            self._state = "after_boundary"
+            return True
+        if self._state == "after_boundary":
+            if buf[:2] == b"--":
+                self._state = "done"
+                return True
+            # Transport padding (RFC 2046) may follow a boundary
+            padding = len(buf) - len(buf.lstrip(b" \t"))
+            del buf[:padding]
+            if len(buf) < 2:
+                return False
+            if buf[:2] != b"\r\n":
+                raise HTTPException(status_code=400, detail="malformed multipart boundary")
+            del buf[:2]
+            self._state = "headers"
+            return True
+        if self._state == "headers":
+            if buf[:2] == b"\r\n":
+                # No headers at all, so no form-data name: refused as such
+                self._start_part("")
+            end = buf.find(b"\r\n\r\n")
+            if end < 0:
+                if len(buf) > MAX_PART_HEADER_BYTES:
+                    raise HTTPException(status_code=400, detail="multipart part headers too large")
+                return False
+            self._start_part(bytes(buf[:end]).decode("utf-8", "replace"))
+            del buf[: end + 4]
+            self._state = "body"
+            return True
+        if self._state == "body":
+            at = buf.find(self._delimiter)
+            if at < 0:
+                # Everything but a possible partial delimiter belongs to the part
+                keep = len(self._delimiter) - 1
+                if len(buf) > keep:
+                    self._write(bytes(buf[: len(buf) - keep]))
+                    del buf[: len(buf) - keep]
+                return False
+            self._write(bytes(buf[:at]))
+            del buf[: at + len(self._delimiter)]
+            self._end_part()
+            self._state = "after_boundary"
+            return True
+        # done: the epilogue is ignored
+        buf.clear()
+        return False
+
+    def _start_part(self, raw_headers: str) -> None:
+        headers: Dict[str, str] = {}
+        for line in raw_headers.split("\r\n"):
+            key, sep, value = line.partition(":")
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        disposition, params = _params(headers.get("content-disposition", ""))
+        if disposition != "form-data" or "name" not in params:
+            raise HTTPException(status_code=400, detail="multipart part without a form-data name")
+        upload = None
+        if "filename" in params:
+            if len(self.form.files) >= self.limits.max_files:
+                raise HTTPException(status_code=413, detail=f"at most {self.limits.max_files} files per upload")
+            content_type, _ = _params(headers.get("content-type", "application/octet-stream"))
+            upload = UploadedFile(params["name"], params["filename"], content_type, self.limits.spool_bytes)
+            self.form.files.append(upload)
+        self._part = _Part(params["name"], upload)
+
+    def _write(self, data: bytes) -> None:
+        part = self._part
+        if part is None or not data:
+            return
+        part.size += len(data)
+        if part.upload is not None:
+            if part.size > self.limits.max_file:
+                raise HTTPException(status_code=413, detail=f"file part over {self.limits.max_file} bytes")
+            part.upload.write(data)
+        else:
+            if part.size > self.limits.max_field:
+                raise HTTPException(status_code=413, detail=f"field {part.name!r} over {self.limits.max_field} bytes")
+            part.field += data
+
+    def _end_part(self) -> None:
+        part = self._part
+        if part is not None and part.upload is None:
+            self.form.fields[part.name] = part.field.decode("utf-8", "replace")
+        self._part = None
+
+
+async def read_multipart(request: Request, limits: UploadLimits) -> MultipartForm:
+    """Streams a multipart/form-data body into a MultipartForm. The caller
+    closes the form (its spooled files) when done with it."""
+    content_type, params = _params(request.headers.get("content-type", ""))
+    if content_type != "multipart/form-data" or not params.get("boundary"):
+        raise HTTPException(status_code=415, detail="expected multipart/form-data with a boundary")
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limits.max_body:
+        raise HTTPException(status_code=413, detail=f"request body over {limits.max_body} bytes")
+
+    reader = MultipartReader(params["boundary"].encode("latin-1"), limits)
+    chunks: AsyncIterator[bytes] = request.stream()
+    try:
+        async for chunk in chunks:
+            reader.feed(chunk)
+        return reader.finish()
+    except BaseException:
+        reader.form.close()
+        raise
@@ -0,0 +1,311 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from .admission import NORMAL, PRIORITY_NAMES, ModelRateLimiter, current_budget, estimate_tokens
+from .metrics import record_stage
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None or raw == "":
+        return default
+    return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
+class UpstreamStatusError(HTTPException):
+    """An error status (or transport failure) from the upstream itself, as
+    opposed to a local one such as a full queue."""
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent upstream calls. Excess callers wait in a bounded queue
+    ordered by priority (lower first, FIFO within a priority) for at most
+    `max_wait` seconds. When the queue is full a caller that outranks the
+    lowest-priority waiter takes its place and that waiter gets the 503;
+    otherwise the caller is rejected immediately so clients can back off
+    instead of piling up."""
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_wait: Optional[float]) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.in_flight = 0
+        # Heap of [priority, arrival, future, owner]; `promote` may lower an entry's priority
+        self._waiters: List[List[Any]] = []
+        self._arrivals = itertools.count()
+        # Counters for sizing the pool
+        self.acquired = 0
+        self.rejected = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.peak_queue = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        # priority -> [acquired, total wait]
+        self.by_priority: Dict[int, List[float]] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _count(self, priority: int, waited: float) -> None:
+        self.acquired += 1
+        counts = self.by_priority.setdefault(priority, [0, 0.0])
+        counts[0] += 1
+        counts[1] += waited
+
+    def _shed_for(self, priority: int) -> bool:
+        if not self._waiters:
+            return False
+        worst = max(self._waiters, key=lambda w: (w[0], w[1]))
+        if worst[0] <= priority:
+            return False
+        self._waiters.remove(worst)
+        heapq.heapify(self._waiters)
+        self.shed += 1
+        worst[2].set_exception(HTTPException(status_code=503, detail="displaced by higher-priority work, retry later"))
+        return True
+
+    def promote(self, owner: Any, priority: int) -> None:
+        """Moves `owner`'s queued calls up to `priority`, e.g. when a more
+        urgent request starts waiting on their result."""
+        moved = False
+        for entry in self._waiters:
+            if entry[3] is owner and entry[0] > priority:
+                entry[0] = priority
+                moved = True
+        if moved:
+            heapq.heapify(self._waiters)
+
+    async def acquire(self, priority: int = NORMAL, max_wait: Optional[float] = None, owner: Any = None) -> float:
+        """Take a slot; returns the seconds spent queued. `max_wait` (e.g.
+        what is left of the request's deadline) can only shorten the
+        limiter's own wait bound; running out of it is a 504. `owner`
+        identifies the call for `promote`."""
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            self._count(priority, 0.0)
+            return 0.0
+        if len(self._waiters) >= self.max_queue and not self._shed_for(priority):
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="upstream queue full, retry later")
+
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._arrivals), fut, owner]
+        heapq.heappush(self._waiters, entry)
+        self.peak_queue = max(self.peak_queue, len(self._waiters))
+        deadline_bound = max_wait is not None and (self.max_wait is None or max_wait < self.max_wait)
+        timeout = max_wait if deadline_bound else self.max_wait
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, timeout=max(0.0, timeout) if timeout is not None else None)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            if deadline_bound:
+                raise HTTPException(status_code=504, detail="request deadline passed while queued for an upstream slot")
+            raise HTTPException(status_code=503, detail="timed out waiting for an upstream slot")
+        except asyncio.CancelledError:
+            # The slot may have been handed to us right before cancellation
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+        finally:
+            # Granted and shed futures were already popped; only abandoned ones are still queued
+            if fut.cancelled():
+                try:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                except ValueError:
+                    pass
+        waited = time.perf_counter() - started
+        self._count(entry[0], waited)
+        self.total_wait += waited
+        self.max_observed_wait = max(self.max_observed_wait, waited)
+        return waited
+
+    def release(self) -> None:
+        # Hand the slot straight to the next live waiter so it cannot be stolen
+        while self._waiters:
+            fut = heapq.heappop(self._waiters)[2]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = NORMAL, max_wait: Optional[float] = None, owner: Any = None) -> AsyncIterator[float]:
+        waited = await self.acquire(priority, max_wait, owner)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_s": self.max_wait,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(1000 * self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+            "max_wait_ms": round(1000 * self.max_observed_wait, 3),
+            "by_priority": {
+                PRIORITY_NAMES.get(p, str(p)): {"acquired": int(n), "avg_wait_ms": round(1000 * total / n, 3) if n else 0.0}
+                for p, (n, total) in sorted(self.by_priority.items())
+            },
+        }
+
+
+class UpstreamClient:
+    """One pooled httpx client for the life of the app plus the limiter that
+    guards it. Opened and closed from the FastAPI lifespan."""
+
+    def __init__(
+        self,
+        timeout: float = 60.0,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        max_wait: float = 10.0,
+        model_rpm: float = 0.0,
+        model_tpm: float = 0.0,
+    ) -> None:
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and _h2_available()
+        self.limiter = ConcurrencyLimiter(max_concurrency, max_queue, max_wait)
+        self.rate_limits = ModelRateLimiter(model_rpm, model_tpm)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def from_env(cls) -> "UpstreamClient":
+        return cls(
+            timeout=env_float("UPSTREAM_TIMEOUT", 60.0),
+            max_connections=env_int("UPSTREAM_MAX_CONNECTIONS", 100),
+            max_keepalive=env_int("UPSTREAM_MAX_KEEPALIVE", 20),
+            keepalive_expiry=env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0),
+            http2=env_bool("UPSTREAM_HTTP2", False),
+            max_concurrency=env_int("UPSTREAM_MAX_CONCURRENCY", 16),
+            max_queue=env_int("UPSTREAM_MAX_QUEUE", 64),
+            max_wait=env_float("UPSTREAM_QUEUE_TIMEOUT", 10.0),
+            model_rpm=env_float("UPSTREAM_MODEL_RPM", 0.0),
+            model_tpm=env_float("UPSTREAM_MODEL_TPM", 0.0),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily as well so callers outside the lifespan still work
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, http2=self.http2)
+        return self._client
+
+    async def start(self) -> None:
+        _ = self.client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def _admitted(self, payload: Dict[str, Any]) -> AsyncIterator[None]:
+        """Per-model rate budget, then a limiter slot at the current request's
+        priority. Both waits are bounded by the request's deadline and show
+        up as the `rate_limit` and `queue` stages."""
+        budget = current_budget()
+        remaining = budget.remaining()
+        if remaining is not None and remaining <= 0:
+            raise HTTPException(status_code=504, detail="request deadline exceeded")
+        max_wait = self.limiter.max_wait
+        if remaining is not None and (max_wait is None or remaining < max_wait):
+            max_wait = remaining
+        delayed = await self.rate_limits.acquire(str(payload.get("model", "")), estimate_tokens(payload), max_wait)
+        if delayed:
+            record_stage("rate_limit", delayed)
+        async with self.limiter.slot(budget.priority, budget.remaining(), owner=budget) as waited:
+            record_stage("queue", waited)
+            yield
+
+    async def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> httpx.Response:
+        async with self._admitted(payload):
+            return await self.client.post(url, headers=headers, json=payload)
+
+    async def stream(
+        self, url: str, headers: Dict[str, str], payload: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """POST with `stream: true` and yield each server-sent event's JSON.
+
+        Holds a limiter slot for the life of the stream. Error statuses are
+        raised as HTTPException before the first event is yielded.
+        """
+        async with self._admitted(payload):
+            async with self.client.stream("POST", url, headers=headers, json={**payload, "stream": True}) as resp:
+                if resp.status_code >= 400:
+                    body = await resp.aread()
+                    raise UpstreamStatusError(status_code=resp.status_code, detail=body.decode("utf-8", "replace"))
+                data_lines: List[str] = []
+                async for line in resp.aiter_lines():
+                    if line.startswith("data:"):
+                        data_lines.append(line[5:].lstrip())
+                    elif not line and data_lines:
+                        data = "\n".join(data_lines)
+                        data_lines = []
+                        if data == "[DONE]":
+                            return
+                        try:
+                            yield json.loads(data)
+                        except ValueError:
+                            continue
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "limiter": self.limiter.stats(),
+            "rate_limits": self.rate_limits.stats(),
+        }
+
+
+def _h2_available() -> bool:
+    # httpx needs the optional `h2` package for HTTP/2; stay on HTTP/1.1 without it
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
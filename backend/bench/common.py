@@ -0,0 +1,77 @@
+"""Helpers shared by the benchmark and check scripts."""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+
+def spawn_uvicorn(app: str, port: int, env: Optional[Dict[str, str]] = None, log_level: str = "warning") -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", log_level],
+        env={**os.environ, **(env or {})},
+    )
+
+
+def stop_all(procs: Sequence[subprocess.Popen]) -> None:
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+async def wait_ready(client: httpx.AsyncClient, urls: Sequence[str], path: str = "/", timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                if (await client.get(f"{url}{path}")).status_code < 500:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not start")
+            await asyncio.sleep(0.2)
+
+
+def percentile(ordered: Sequence[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(seconds: List[float], prefix: str = "") -> Dict[str, Optional[float]]:
+    ordered = sorted(seconds)
+    out: Dict[str, Optional[float]] = {}
+    for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        v = percentile(ordered, q)
+        out[f"{prefix}{name}_ms"] = round(v * 1000, 2) if v is not None else None
+    out[f"{prefix}max_ms"] = round(ordered[-1] * 1000, 2) if ordered else None
+    return out
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    """Resident set size of a process (Linux /proc); None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
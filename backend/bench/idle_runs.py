@@ -0,0 +1,84 @@
+"""CPU cost of many paused agent runs: the run scheduler vs the old polling loop.
+
+Starts N runs through RunScheduler and pauses them all, then measures process
+CPU time over a window while they sit paused. The same is repeated with the
+previous worker's pause loop (`while paused: await asyncio.sleep(0.2)`).
+
+    python -m backend.bench.idle_runs --runs 100 1000 10000 --window 5
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+from backend.app.runs import Run, RunState
+from backend.app.scheduler import RunScheduler, demo_plan
+
+
+async def measure(window: float) -> Dict[str, float]:
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    await asyncio.sleep(window)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    return {"cpu_seconds": round(cpu, 4), "cpu_percent": round(100 * cpu / wall, 2)}
+
+
+async def scheduler_case(n: int, window: float) -> Dict[str, Any]:
+    scheduler = RunScheduler(demo_plan, max_concurrent=64, max_queued=n)
+    runs: List[Run] = []
+    for i in range(n):
+        run = Run(f"bench {i}", event_buffer=16)
+        run.apply_state(RunState.PAUSED)
+        scheduler.submit(run)
+        runs.append(run)
+    # Let every run take a slot, see the pause and hand the slot on
+    while scheduler.slots.in_flight or scheduler.slots.queue_depth:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+    result = await measure(window)
+    for run in runs:
+        await run.set_state(RunState.STOPPED)
+    await asyncio.gather(*(run._worker for run in runs if run._worker is not None))
+    return {**result, "stopped": scheduler.stopped}
+
+
+async def polling_case(n: int, window: float) -> Dict[str, Any]:
+    state = {"value": RunState.PAUSED}
+
+    async def worker() -> None:
+        while state["value"] == RunState.PAUSED:
+            await asyncio.sleep(0.2)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(n)]
+    await asyncio.sleep(0.5)
+    result = await measure(window)
+    state["value"] = RunState.STOPPED
+    await asyncio.gather(*tasks)
+    return result
+
+
+async def main_async(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    report: List[Dict[str, Any]] = []
+    for n in args.runs:
+        row: Dict[str, Any] = {"runs": n, "window_s": args.window}
+        row["scheduler"] = await scheduler_case(n, args.window)
+        if not args.skip_polling:
+            row["polling"] = await polling_case(n, args.window)
+        report.append(row)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--window", type=float, default=5.0)
+    parser.add_argument("--skip-polling", action="store_true", help="only measure the scheduler")
+    report = asyncio.run(main_async(parser.parse_args()))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""Load driver: throughput and latency percentiles per endpoint, SSE fan-out
+and memory growth, written as JSON so runs can be compared across commits.
+
+By default it starts the mock upstream and a backend on local ports and
+tears them down afterwards; pass --backend-url to load an existing server.
+
+    python -m backend.bench.load --requests 200 --concurrency 16 --out bench.json
+    python -m backend.bench.load --compare bench.json          # after a change
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from . import mock_upstream
+from .common import git_commit, latency_summary, rss_kb, spawn_uvicorn, stop_all, wait_ready
+from .payloads import load_recorded, make_requests
+
+JSON_SCENARIOS = {
+    "summarize": "/api/summarize",
+    "suggest": "/api/suggest",
+    "analysis": "/api/analysis",
+    "summarize_cached": "/api/summarize",
+    "summarize_stream": "/api/summarize/stream",
+    "suggest_stream": "/api/suggest/stream",
+}
+ALL_SCENARIOS = list(JSON_SCENARIOS) + ["batch", "agent_fanout"]
+PLACEHOLDER = "\u0000PROMPT\u0000"
+
+
+class BodyTemplate:
+    """A request body serialized once, with `user_prompt` swappable so each
+    request can be unique (a cache miss) without re-encoding megabytes."""
+
+    def __init__(self, body: Dict[str, Any]) -> None:
+        encoded = json.dumps({**body, "user_prompt": PLACEHOLDER}).encode()
+        marker = json.dumps(PLACEHOLDER).encode()
+        self.prefix, _, self.suffix = encoded.partition(marker)
+
+    def render(self, prompt: str) -> bytes:
+        return self.prefix + json.dumps(prompt).encode() + self.suffix
+
+
+class MemorySampler:
+    def __init__(self, pid: Optional[int], interval: float = 0.5) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Tuple[float, int]] = []
+        self._started = time.perf_counter()
+
+    async def run(self) -> None:
+        while self.pid is not None:
+            kb = rss_kb(self.pid)
+            if kb is not None:
+                self.samples.append((round(time.perf_counter() - self._started, 2), kb))
+            await asyncio.sleep(self.interval)
+
+    def current(self) -> Optional[int]:
+        return rss_kb(self.pid) if self.pid is not None else None
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.samples:
+            return {"available": False}
+        values = [kb for _, kb in self.samples]
+        return {
+            "available": True,
+            "start_kb": values[0],
+            "peak_kb": max(values),
+            "end_kb": values[-1],
+            "growth_kb": values[-1] - values[0],
+            "samples": self.samples,
+        }
+
+
+async def drive(
+    count: int, concurrency: int, one: Callable[[int], Any]
+) -> Tuple[List[Dict[str, Any]], float]:
+    results: List[Dict[str, Any]] = []
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal next_index
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            results.append(await one(i))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+async def timed_post(client: httpx.AsyncClient, url: str, content: bytes, accept: Optional[str] = None) -> Dict[str, Any]:
+    headers = {"Content-Type": "application/json"}
+    if accept:
+        headers["Accept"] = accept
+    t0 = time.perf_counter()
+    ttfb: Optional[float] = None
+    size = 0
+    try:
+        async with client.stream("POST", url, content=content, headers=headers) as resp:
+            async for chunk in resp.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - t0
+                size += len(chunk)
+            status = resp.status_code
+    except httpx.HTTPError as e:
+        return {"status": 0, "error": type(e).__name__, "seconds": time.perf_counter() - t0, "ttfb": None, "bytes": 0}
+    return {"status": status, "seconds": time.perf_counter() - t0, "ttfb": ttfb, "bytes": size}
+
+
+def summarize_results(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    ok = [r for r in results if 200 <= r["status"] < 300]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    out: Dict[str, Any] = {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        **latency_summary([r["seconds"] for r in ok]),
+    }
+    ttfbs = [r["ttfb"] for r in ok if r.get("ttfb") is not None]
+    out.update(latency_summary(ttfbs, prefix="ttfb_"))
+    return out
+
+
+async def json_scenario(
+    client: httpx.AsyncClient, base: str, name: str, templates: Sequence[BodyTemplate], args: argparse.Namespace
+) -> Dict[str, Any]:
+    url = base + JSON_SCENARIOS[name]
+    tag = uuid.uuid4().hex[:8]
+    cached = name.endswith("_cached")
+    accept = "text/event-stream" if name.endswith("_stream") else None
+    if cached:
+        # Warm the cache so every measured request is a hit
+        await timed_post(client, url, templates[0].render("cached"))
+
+    async def one(i: int) -> Dict[str, Any]:
+        template = templates[0] if cached else templates[i % len(templates)]
+        prompt = "cached" if cached else f"bench {tag} {i}"
+        return await timed_post(client, url, template.render(prompt), accept)
+
+    results, elapsed = await drive(args.requests, args.concurrency, one)
+    return summarize_results(results, elapsed)
+
+
+async def batch_scenario(
+    client: httpx.AsyncClient, base: str, bodies: Sequence[Dict[str, Any]], args: argparse.Namespace
+) -> Dict[str, Any]:
+    tag = uuid.uuid4().hex[:8]
+    modes = ("summary", "suggest", "analysis")
+    batches = max(1, args.requests // args.batch_size)
+
+    async def one(i: int) -> Dict[str, Any]:
+        items = [
+            {**bodies[(i + j) % len(bodies)], "mode": modes[j % 3], "id": str(j), "user_prompt": f"batch {tag} {i} {j}"}
+            for j in range(args.batch_size)
+        ]
+        return await timed_post(client, f"{base}/api/batch", json.dumps({"items": items}).encode())
+
+    results, elapsed = await drive(batches, max(1, args.concurrency // 4), one)
+    out = summarize_results(results, elapsed)
+    out["items_per_batch"] = args.batch_size
+    out["items_per_second"] = round(out["ok"] * args.batch_size / elapsed, 2) if elapsed else None
+    return out
+
+
+async def agent_fanout_scenario(client: httpx.AsyncClient, base: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Several runs, many subscribers each; how evenly and completely events fan out."""
+    received: Dict[Tuple[str, int], List[float]] = {}
+    counts: List[int] = []
+    connect: List[float] = []
+
+    async def subscribe(run_id: str) -> None:
+        t0 = time.perf_counter()
+        n = 0
+        first = True
+        async with client.stream("GET", f"{base}/api/agent/stream", params={"runId": run_id}) as resp:
+            seq: Optional[int] = None
+            async for line in resp.aiter_lines():
+                if first:
+                    connect.append(time.perf_counter() - t0)
+                    first = False
+                if line.startswith("id:"):
+                    seq = int(line[3:])
+                elif line.startswith("data:") and seq is not None:
+                    received.setdefault((run_id, seq), []).append(time.perf_counter())
+                    n += 1
+                    if '"state": "done"' in line or '"state": "stopped"' in line:
+                        break
+        counts.append(n)
+
+    started = time.perf_counter()
+    run_ids = []
+    for _ in range(args.fanout_runs):
+        resp = await client.post(f"{base}/api/agent/start", json={"task": "bench fan-out"})
+        run_ids.append(resp.json()["runId"])
+    await asyncio.gather(
+        *(asyncio.wait_for(subscribe(r), timeout=60) for r in run_ids for _ in range(args.fanout_subscribers)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    # Spread between the first and last subscriber receiving the same event
+    skews = [max(ts) - min(ts) for ts in received.values() if len(ts) > 1]
+    delivered = sum(len(ts) for ts in received.values())
+    expected = len(received) * args.fanout_subscribers
+    return {
+        "runs": args.fanout_runs,
+        "subscribers_per_run": args.fanout_subscribers,
+        "events": len(received),
+        "deliveries": delivered,
+        "delivery_ratio": round(delivered / expected, 4) if expected else None,
+        "seconds": round(elapsed, 3),
+        **latency_summary(connect, prefix="connect_"),
+        **latency_summary(skews, prefix="skew_"),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Dict[str, Optional[float]]]:
+    """Relative change (current / baseline - 1) of the headline numbers."""
+    out: Dict[str, Dict[str, Optional[float]]] = {}
+    for name, cur in current.get("scenarios", {}).items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        row: Dict[str, Optional[float]] = {}
+        for metric in ("rps", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms", "skew_p99_ms"):
+            a, b = cur.get(metric), base.get(metric)
+            if isinstance(a, (int, float)) and isinstance(b, (int, float)) and b:
+                row[metric] = round(a / b - 1, 4)
+        out[name] = row
+    mem, base_mem = current.get("memory", {}), baseline.get("memory", {})
+    if mem.get("available") and base_mem.get("available"):
+        out["memory"] = {"growth_kb": mem["growth_kb"] - base_mem["growth_kb"], "peak_kb": mem["peak_kb"] - base_mem["peak_kb"]}
+    return out
+
+
+async def run_suite(args: argparse.Namespace) -> Dict[str, Any]:
+    bodies = load_recorded(args.payload_dir) if args.payload_dir else make_requests(
+        args.pages, dom_kb=args.dom_kb, screenshots=args.screenshots
+    )
+    templates = [BodyTemplate(b) for b in bodies]
+    procs = []
+    backend_pid = args.backend_pid
+    base = args.backend_url
+    if base is None:
+        mock_args = [
+            "--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+            "--reject-images-rate", str(args.reject_images_rate), "--output-items", str(args.output_items),
+            "--token-interval", str(args.token_interval),
+        ]
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "backend.bench.mock_upstream", "--port", str(args.mock_port), *mock_args]
+        ))
+        backend = spawn_uvicorn("backend.app.main:app", args.port, {
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+            "OPENAI_BASE_URLS": "",
+            "OPENAI_API_KEY": "bench",
+            "UPSTREAM_MAX_CONCURRENCY": str(max(16, args.concurrency)),
+            "UPSTREAM_MAX_QUEUE": str(max(64, args.concurrency * 4)),
+        })
+        procs.append(backend)
+        backend_pid = backend.pid
+        base = f"http://127.0.0.1:{args.port}"
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+            "payload_bytes": [len(t.prefix) + len(t.suffix) for t in templates],
+        },
+        "scenarios": {},
+    }
+    sampler = MemorySampler(backend_pid)
+    limits = httpx.Limits(max_connections=args.concurrency + args.fanout_runs * args.fanout_subscribers + 8)
+    try:
+        async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+            await wait_ready(client, [base])
+            if args.backend_url is None:
+                await wait_ready(client, [f"http://127.0.0.1:{args.mock_port}"])
+            sampling = asyncio.create_task(sampler.run())
+            for name in args.scenarios:
+                rss_before = sampler.current()
+                if name in JSON_SCENARIOS:
+                    result = await json_scenario(client, base, name, templates, args)
+                elif name == "batch":
+                    result = await batch_scenario(client, base, bodies, args)
+                elif name == "agent_fanout":
+                    result = await agent_fanout_scenario(client, base, args)
+                else:
+                    raise SystemExit(f"unknown scenario {name!r}; choose from {ALL_SCENARIOS}")
+                rss_after = sampler.current()
+                if rss_before is not None and rss_after is not None:
+                    result["rss_delta_kb"] = rss_after - rss_before
+                report["scenarios"][name] = result
+                print(f"{name}: {json.dumps({k: v for k, v in result.items() if not isinstance(v, (list, dict))})}", file=sys.stderr)
+            sampling.cancel()
+            server: Dict[str, Any] = {}
+            for path in ("/api/upstream/stats", "/api/cache/stats", "/api/agent/stats"):
+                try:
+                    server[path] = (await client.get(base + path)).json()
+                except (httpx.HTTPError, ValueError):
+                    pass
+            report["server"] = server
+    finally:
+        stop_all(procs)
+    report["memory"] = sampler.summary()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=ALL_SCENARIOS, choices=ALL_SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pages", type=int, default=8, help="distinct synthetic pages")
+    parser.add_argument("--dom-kb", type=int, default=300)
+    parser.add_argument("--screenshots", type=int, default=1, help="screenshots per request")
+    parser.add_argument("--payload-dir", help="use recorded request bodies (*.json) instead of synthetic ones")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--fanout-runs", type=int, default=5)
+    parser.add_argument("--fanout-subscribers", type=int, default=50)
+    parser.add_argument("--backend-url", help="load an already running backend instead of starting one")
+    parser.add_argument("--backend-pid", type=int, help="pid of that backend, for memory sampling")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    mock_upstream.add_arguments(parser)
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="baseline report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_suite(args))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Local stand-in for the Responses API used by the benchmarks.
+
+Serves `POST /v1/responses` (point OPENAI_BASE_URL at http://host:port/v1)
+with configurable latency, error and image-rejection rates, long outputs and
+SSE streaming when the request has `"stream": true`. Requests with a
+`json_schema` text format get a JSON reply of that shape, and replies longer
+than `max_output_tokens` are cut off and marked incomplete.
+
+    python -m backend.bench.mock_upstream --port 9100 --latency 0.4 --jitter 0.1 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "page article update market report section result product price review feature release team "
+    "customer service account support policy data analysis summary detail option button form link"
+).split()
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        reject_images_rate: float = 0.0,
+        output_items: int = 10,
+        item_words: int = 40,
+        chunk_chars: int = 24,
+        chunk_interval: float = 0.005,
+        token_interval: float = 0.0,
+        reject_schema: bool = False,
+        seed: int = 1,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.reject_images_rate = reject_images_rate
+        self.output_items = output_items
+        self.item_words = item_words
+        self.chunk_chars = chunk_chars
+        self.chunk_interval = chunk_interval
+        # Generation time per output token for non-streamed replies
+        self.token_interval = token_interval
+        # Answer json_schema text formats with a 400, like upstreams without structured output
+        self.reject_schema = reject_schema
+        self.seed = seed
+
+
+def _has_images(body: Dict[str, Any]) -> bool:
+    items = body.get("input")
+    if not isinstance(items, list):
+        return False
+    # Image blocks come either directly in `input` or inside message content
+    blocks = [b for item in items if isinstance(item, dict) for b in [item, *(item.get("content") or [])]]
+    return any(isinstance(block, dict) and block.get("type") == "input_image" for block in blocks)
+
+
+def _output_text(rng: random.Random, cfg: MockConfig) -> str:
+    """Bullets followed by Reasoning/Content lines, so every mode's parser finds its part."""
+    sentence = lambda n: " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."  # noqa: E731
+    bullets = [f"• {sentence(cfg.item_words)}" for _ in range(cfg.output_items)]
+    return "\n".join(bullets + [f"Reasoning: {sentence(3 * cfg.item_words)}", f"Content: {sentence(cfg.item_words)}"])
+
+
+def _structured_text(rng: random.Random, cfg: MockConfig, schema: Dict[str, Any]) -> str:
+    """A JSON reply for the summary, suggest or analysis schema."""
+    sentence = lambda n: " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."  # noqa: E731
+    properties = schema.get("properties") or {}
+    if "summary" in properties:
+        reply: Dict[str, Any] = {"summary": [sentence(cfg.item_words) for _ in range(cfg.output_items)]}
+    elif "reasoning" in properties:
+        reply = {"reasoning": sentence(3 * cfg.item_words), "content": sentence(cfg.item_words)}
+    else:
+        reply = {"suggestions": [
+            {"description": sentence(cfg.item_words // 2), "actions": [sentence(6)]} for _ in range(cfg.output_items)
+        ]}
+    return json.dumps(reply)
+
+
+def _cached_tokens(prompt: str, recent: Deque[str]) -> int:
+    """Prefix caching as the Responses API reports it: the longest prefix
+    shared with an earlier prompt, from 1024 tokens up in 128-token steps."""
+    best = max((len(os.path.commonprefix([prompt, seen])) for seen in recent), default=0) // 4
+    return 0 if best < 1024 else 1024 + (best - 1024) // 128 * 128
+
+
+def create_app(cfg: MockConfig) -> FastAPI:
+    app = FastAPI(title="mock responses api")
+    rng = random.Random(cfg.seed)
+    counters = {
+        "requests": 0, "streams": 0, "errors": 0, "rejected_images": 0, "rejected_schemas": 0, "bytes_in": 0, "cached_tokens": 0,
+    }
+    # Prompts already processed, for the simulated prefix cache
+    recent: Deque[str] = deque(maxlen=64)
+
+    @app.get("/")
+    async def root() -> Dict[str, Any]:
+        return {"ok": True}
+
+    @app.get("/stats")
+    async def stats() -> Dict[str, Any]:
+        return counters
+
+    @app.post("/v1/responses")
+    async def responses(request: Request) -> Any:
+        raw = await request.body()
+        body = json.loads(raw)
+        counters["requests"] += 1
+        counters["bytes_in"] += len(raw)
+        await asyncio.sleep(max(0.0, rng.gauss(cfg.latency, cfg.jitter)))
+        if rng.random() < cfg.error_rate:
+            counters["errors"] += 1
+            return JSONResponse({"error": {"message": "mock failure"}}, status_code=cfg.error_status)
+        if rng.random() < cfg.reject_images_rate and _has_images(body):
+            counters["rejected_images"] += 1
+            return JSONResponse({"error": {"message": "image input not supported"}}, status_code=400)
+
+        prompt = json.dumps(body.get("input"))
+        cached = _cached_tokens(prompt, recent)
+        recent.append(prompt)
+        counters["cached_tokens"] += cached
+        text_format = (body.get("text") or {}).get("format") or {}
+        if cfg.reject_schema and text_format.get("type") == "json_schema":
+            counters["rejected_schemas"] += 1
+            error = {"message": "Invalid schema for response_format", "param": "text.format.schema", "code": "invalid_json_schema"}
+            return JSONResponse({"error": error}, status_code=400)
+        if text_format.get("type") == "json_schema":
+            text = _structured_text(rng, cfg, text_format.get("schema") or {})
+        else:
+            text = _output_text(rng, cfg)
+        reply: Dict[str, Any] = {"status": "completed"}
+        limit = body.get("max_output_tokens")
+        if limit and len(text) // 4 > limit:
+            text = text[:limit * 4]
+            reply = {"status": "incomplete", "incomplete_details": {"reason": "max_output_tokens"}}
+        usage = {
+            "input_tokens": len(raw) // 4,
+            "input_tokens_details": {"cached_tokens": cached},
+            "output_tokens": len(text) // 4,
+            "total_tokens": (len(raw) + len(text)) // 4,
+        }
+        reply.update(output_text=text, usage=usage)
+        if not body.get("stream"):
+            await asyncio.sleep(cfg.token_interval * usage["output_tokens"])
+            return reply
+
+        counters["streams"] += 1
+
+        async def events() -> AsyncGenerator[bytes, None]:
+            for i in range(0, len(text), cfg.chunk_chars):
+                delta = {"type": "response.output_text.delta", "delta": text[i:i + cfg.chunk_chars]}
+                yield f"event: response.output_text.delta\ndata: {json.dumps(delta)}\n\n".encode()
+                await asyncio.sleep(cfg.chunk_interval)
+            # An incomplete reply ends with response.incomplete instead
+            etype = "response.completed" if reply["status"] == "completed" else "response.incomplete"
+            done = {"type": etype, "response": reply}
+            yield f"event: {etype}\ndata: {json.dumps(done)}\n\n".encode()
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=float, default=0.3, help="mean seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.1, help="std dev of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--reject-images-rate", type=float, default=0.0)
+    parser.add_argument("--output-items", type=int, default=10)
+    parser.add_argument("--chunk-chars", type=int, default=24)
+    parser.add_argument("--chunk-interval", type=float, default=0.005)
+    parser.add_argument("--token-interval", type=float, default=0.0, help="seconds per output token (non-streamed)")
+    parser.add_argument("--reject-schema", action="store_true", help="answer json_schema text formats with 400")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        reject_images_rate=args.reject_images_rate,
+        output_items=args.output_items,
+        chunk_chars=args.chunk_chars,
+        chunk_interval=args.chunk_interval,
+        token_interval=args.token_interval,
+        reject_schema=args.reject_schema,
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
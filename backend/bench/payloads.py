@@ -0,0 +1,107 @@
+"""Real-shaped request bodies for the benchmarks.
+
+Synthetic pages mimic what the extension sends: a few hundred KB of DOM
+with navigation, article text, sidebars, scripts and footers, plus
+full-HD PNG screenshots. Recorded requests (JSON files holding an
+AnalysisRequest body) can be used instead with `load_recorded`.
+"""
+
+import base64
+import glob
+import io
+import json
+import os
+import random
+from typing import Any, Dict, List, Tuple
+
+try:  # Pillow renders realistic screenshots; without it random bytes stand in
+    from PIL import Image, ImageDraw
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None  # type: ignore[assignment]
+
+VOCAB = (
+    "the a of to and in for on with by from at as is are was were be this that it new report "
+    "market city council school season team player price growth energy climate policy study "
+    "research health science technology company customer product service review update data "
+    "analysis results users feature release version support account security privacy terms"
+).split()
+
+
+def _sentence(rng: random.Random, lo: int = 8, hi: int = 24) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(rng.randint(lo, hi))).capitalize() + "."
+
+
+def make_dom(rng: random.Random, target_kb: int = 300) -> str:
+    head = (
+        "<html><head><title>{}</title><style>{}</style><script>{}</script></head><body>"
+    ).format(_sentence(rng, 4, 8), ".c{color:#333;margin:0 auto}" * 40, "window.__STATE__={};" * 60)
+    nav = "<nav><ul>" + "".join(f"<li><a href='/s{i}'>Section {i}</a></li>" for i in range(30)) + "</ul></nav>"
+    parts = [head, nav]
+    size = sum(len(p) for p in parts)
+    i = 0
+    while size < target_kb * 1024:
+        i += 1
+        if i % 7 == 0:
+            block = "<aside class='ad'>Advertisement. Subscribe to our newsletter. Accept cookies.</aside>"
+        elif i % 5 == 0:
+            block = "<div class='related'><h3>Related</h3>" + "".join(
+                f"<a href='/r{i}-{j}'>{_sentence(rng, 4, 9)}</a>" for j in range(6)
+            ) + "</div>"
+        else:
+            block = f"<article><h2>{_sentence(rng, 4, 10)}</h2>" + "".join(
+                f"<p>{' '.join(_sentence(rng) for _ in range(4))}</p>" for _ in range(3)
+            ) + "</article>"
+        parts.append(block)
+        size += len(block)
+    parts.append("<footer>© Example. Privacy policy. Terms of use. All rights reserved.</footer></body></html>")
+    return "".join(parts)
+
+
+def make_screenshot(rng: random.Random, width: int = 1920, height: int = 1080) -> Tuple[str, str]:
+    """(mime_type, data_base64) of a page-like PNG."""
+    if Image is None:
+        return "image/png", base64.b64encode(rng.randbytes(width * height // 8)).decode("ascii")
+    img = Image.new("RGB", (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width, 80), fill=(30, 40, 60))
+    y = 120
+    while y < height - 40:
+        # Lines of "text": short dark bars of varying length
+        x = 80
+        while x < width - 400:
+            w = rng.randint(20, 90)
+            shade = rng.randint(20, 90)
+            draw.rectangle((x, y, x + w, y + 12), fill=(shade, shade, shade))
+            x += w + rng.randint(6, 14)
+        y += rng.choice((22, 22, 22, 48))
+    # A photo-like region that does not compress, as hero images and video frames don't
+    photo = (min(640, width // 3), min(400, height // 3))
+    img.paste(Image.frombytes("RGB", photo, rng.randbytes(photo[0] * photo[1] * 3)), (width - photo[0] - 40, 120))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return "image/png", base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def make_requests(count: int, seed: int = 1, dom_kb: int = 300, screenshots: int = 1) -> List[Dict[str, Any]]:
+    """`count` distinct AnalysisRequest bodies; screenshots are shared between
+    them since generating PNGs is slow and only their size matters here."""
+    rng = random.Random(seed)
+    shots = [make_screenshot(rng) for _ in range(screenshots)]
+    return [
+        {
+            "page_url": f"https://news.example.com/story/{i}",
+            "dom_html": make_dom(rng, dom_kb),
+            "screenshots": [{"mime_type": m, "data_base64": d} for m, d in shots],
+            "user_prompt": None,
+        }
+        for i in range(count)
+    ]
+
+
+def load_recorded(directory: str) -> List[Dict[str, Any]]:
+    """Every *.json file in `directory`, each one request body."""
+    bodies = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            bodies.append(json.load(f))
+    return bodies
@@ -0,0 +1,121 @@
+import asyncio
+from typing import List
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app.admission import BACKGROUND, INTERACTIVE, NORMAL, ModelRateLimiter
+from backend.app.upstream import ConcurrencyLimiter
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_full_queue_sheds_lowest_priority_newest_first():
+    async def scenario() -> List[str]:
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=3, max_wait=None)
+        await limiter.acquire()
+        order: List[str] = []
+
+        async def call(name: str, priority: int) -> None:
+            try:
+                await limiter.acquire(priority)
+            except HTTPException as e:
+                order.append(f"{name}:{e.status_code}")
+                return
+            order.append(name)
+            limiter.release()
+
+        tasks = []
+        for name, priority in [("bg1", BACKGROUND), ("bg2", BACKGROUND), ("normal", NORMAL)]:
+            tasks.append(asyncio.create_task(call(name, priority)))
+            await settle()
+        # Full: each interactive caller displaces the worst waiter, latest arrival first
+        for name in ("int1", "int2"):
+            tasks.append(asyncio.create_task(call(name, INTERACTIVE)))
+            await settle()
+        # An equal or lower priority caller cannot displace anyone
+        tasks.append(asyncio.create_task(call("normal2", NORMAL)))
+        await settle()
+        assert limiter.queue_depth == 3
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert (limiter.shed, limiter.rejected, limiter.in_flight) == (2, 1, 0)
+        return order
+
+    assert asyncio.run(scenario()) == ["bg2:503", "bg1:503", "normal2:503", "int1", "int2", "normal"]
+
+
+def test_queue_timeout_is_503_and_deadline_is_504():
+    async def scenario() -> None:
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=4, max_wait=0.05)
+        await limiter.acquire()
+        with pytest.raises(HTTPException) as exc:
+            await limiter.acquire()
+        assert exc.value.status_code == 503
+        # A shorter request deadline wins over the limiter's own bound
+        with pytest.raises(HTTPException) as exc:
+            await limiter.acquire(max_wait=0.01)
+        assert exc.value.status_code == 504
+        assert limiter.timed_out == 2 and limiter.queue_depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue_and_keeps_no_slot():
+    async def scenario() -> None:
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=4, max_wait=None)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await settle()
+        waiter.cancel()
+        await settle()
+        assert limiter.queue_depth == 0
+        limiter.release()
+        assert limiter.in_flight == 0
+        assert await limiter.acquire() == 0.0
+
+    asyncio.run(scenario())
+
+
+def test_rate_limiter_refuses_when_wait_exceeds_max_wait():
+    async def scenario() -> None:
+        # 600 tokens per minute: 10 per second, bursting to 600
+        limiter = ModelRateLimiter(tpm=600)
+        assert await limiter.acquire("m", 600, max_wait=1.0) == 0.0
+        with pytest.raises(HTTPException) as exc:
+            await limiter.acquire("m", 100, max_wait=1.0)
+        assert exc.value.status_code == 429
+        assert exc.value.headers["Retry-After"] == "10"
+        # A refusal reserves nothing, so a call that fits still goes through
+        assert 0 < await limiter.acquire("m", 2, max_wait=1.0) <= 0.25
+        # Budgets are per model
+        assert await limiter.acquire("other", 600, max_wait=0) == 0.0
+        assert (limiter.refused, limiter.delayed) == (1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_rate_limiter_refunds_reservation_on_cancel():
+    async def scenario() -> None:
+        limiter = ModelRateLimiter(rpm=60, tpm=600)
+        await limiter.acquire("m", 600, max_wait=None)
+        requests, tokens = limiter._for("m")
+        before = (requests.tokens, tokens.tokens)
+        waiter = asyncio.create_task(limiter.acquire("m", 300, max_wait=None))
+        await settle()
+        assert tokens.tokens < before[1] - 250
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        # Only refill since then remains on top of the earlier level
+        assert requests.tokens == pytest.approx(before[0], abs=0.5)
+        assert tokens.tokens == pytest.approx(before[1], abs=5)
+
+    asyncio.run(scenario())
+
+
+def test_rate_limiter_disabled_never_waits():
+    assert asyncio.run(ModelRateLimiter().acquire("m", 10 ** 9, max_wait=0)) == 0.0
@@ -0,0 +1,90 @@
+"""Agent runs driven across several uvicorn workers sharing one SQLite run
+store, with every call sent to a randomly chosen worker."""
+
+import asyncio
+import json
+import os
+import random
+import socket
+from typing import List, Tuple
+
+import httpx
+import pytest
+
+from backend.bench.common import spawn_uvicorn, stop_all, wait_ready
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKERS = 3
+RUNS = 8
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def worker_urls(tmp_path):
+    env = {
+        "AGENT_RUN_BACKEND": "sqlite",
+        "AGENT_SQLITE_PATH": str(tmp_path / "runs.sqlite3"),
+        "AGENT_HEARTBEAT_INTERVAL": "1",
+        "PYTHONPATH": ROOT,
+    }
+    ports = [free_port() for _ in range(WORKERS)]
+    procs = [spawn_uvicorn("backend.app.main:app", port, env) for port in ports]
+    try:
+        yield [f"http://127.0.0.1:{port}" for port in ports]
+    finally:
+        stop_all(procs)
+
+
+async def watch(client: httpx.AsyncClient, url: str, run_id: str) -> List[Tuple[str, str]]:
+    """(event, state) for every status/done event until the stream closes."""
+    seen: List[Tuple[str, str]] = []
+    async with client.stream("GET", f"{url}/api/agent/stream", params={"runId": run_id}) as resp:
+        event = None
+        async for line in resp.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event in ("status", "done"):
+                seen.append((event, json.loads(line[5:])["state"]))
+            elif not line:
+                event = None
+    return seen
+
+
+async def one_run(client: httpx.AsyncClient, urls: List[str], rng: random.Random) -> None:
+    resp = await client.post(f"{rng.choice(urls)}/api/agent/start", json={"task": "test"})
+    assert resp.status_code == 200
+    run_id = resp.json()["runId"]
+    watcher = asyncio.create_task(watch(client, rng.choice(urls), run_id))
+    await asyncio.sleep(0.3)
+
+    for action, state in (("pause", "paused"), ("resume", "running"), ("stop", "stopped")):
+        r = await client.post(f"{rng.choice(urls)}/api/agent/{action}", json={"runId": run_id})
+        assert r.status_code == 200, (action, r.text)
+        # Shared state is visible from every worker as soon as the write commits
+        r = await client.get(f"{rng.choice(urls)}/api/agent/status", params={"runId": run_id})
+        assert r.status_code == 200 and r.json()["state"] == state, (action, r.text)
+        await asyncio.sleep(0.2)
+
+    seen = await asyncio.wait_for(watcher, timeout=10)
+    states = [state for event, state in seen if event == "status"]
+    for wanted in ("paused", "running", "stopped"):
+        assert wanted in states, (run_id, seen)
+    # The stream ends on its own after the final event
+    assert seen[-1] == ("done", "stopped"), (run_id, seen)
+    r = await client.post(f"{rng.choice(urls)}/api/agent/pause", json={"runId": run_id})
+    assert r.status_code == 409
+
+
+def test_runs_shared_across_workers(worker_urls):
+    async def go() -> None:
+        rng = random.Random(1)
+        async with httpx.AsyncClient(timeout=30) as client:
+            await wait_ready(client, worker_urls)
+            await asyncio.gather(*(one_run(client, worker_urls, rng) for _ in range(RUNS)))
+
+    asyncio.run(asyncio.wait_for(go(), timeout=60))
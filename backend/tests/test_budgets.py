@@ -0,0 +1,62 @@
+from backend.app.budgets import OutputBudget
+
+
+def feed(budget: OutputBudget, lengths, mode: str = "summary") -> None:
+    for n in lengths:
+        budget.observe(mode, n, truncated=False)
+
+
+def test_cap_until_enough_samples():
+    budget = OutputBudget(cap=800, floor=1, min_samples=5)
+    feed(budget, [10] * 4)
+    assert budget.for_mode("summary") == 800
+    feed(budget, [10])
+    assert budget.for_mode("summary") == 13
+    assert budget.for_mode("suggest") == 800
+
+
+def test_quantile_with_headroom():
+    budget = OutputBudget(cap=800, floor=1, quantile=0.5, headroom=1.25, min_samples=20)
+    feed(budget, range(1, 21))
+    # The 10th of 20 sorted samples, times 1.25, rounded up
+    assert budget.for_mode("summary") == 13
+    budget = OutputBudget(cap=800, floor=1, quantile=0.99, headroom=1.0, min_samples=20)
+    feed(budget, range(1, 21))
+    assert budget.for_mode("summary") == 20
+
+
+def test_floor_cap_and_window():
+    budget = OutputBudget(cap=100, floor=40, quantile=0.99, headroom=1.0, window=10, min_samples=5)
+    feed(budget, [5] * 10)
+    assert budget.for_mode("summary") == 40
+    feed(budget, [500])
+    assert budget.for_mode("summary") == 100
+    # The long reply slides out of the window
+    feed(budget, [50] * 10)
+    assert budget.for_mode("summary") == 50
+    assert OutputBudget(cap=50, floor=100).floor == 50
+
+
+def test_truncated_reply_counts_at_cap():
+    budget = OutputBudget(cap=800, floor=1, quantile=0.99, headroom=1.0, min_samples=20)
+    feed(budget, [100] * 19)
+    # Its reported length is the budget it ran into, not how long it wanted to be
+    budget.observe("summary", 120, truncated=True)
+    assert budget.for_mode("summary") == 800
+    assert budget.truncated == {"summary": 1}
+    budget.observe("summary", None, truncated=True)
+    assert budget.truncated == {"summary": 2} and budget.replies == {"summary": 21}
+
+
+def test_unknown_lengths_and_non_adapting_calls():
+    budget = OutputBudget(cap=800, floor=1, headroom=1.0, min_samples=2)
+    budget.observe("summary", None, truncated=False)
+    assert budget.replies == {"summary": 1} and budget.stats()["modes"]["summary"]["avg_output_tokens"] is None
+    budget.observe("summary", 30, truncated=False, adapt=False)
+    budget.observe("summary", 30, truncated=False, adapt=False)
+    assert budget.for_mode("summary") == 800
+    budget.observe("summary", 40, truncated=False)
+    assert budget.for_mode("summary") == 40
+    off = OutputBudget(cap=800, min_samples=1, adaptive=False)
+    feed(off, [10] * 5)
+    assert off.for_mode("summary") == 800
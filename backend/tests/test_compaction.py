@@ -0,0 +1,55 @@
+import time
+
+from backend.app.compaction import MIN_KEEP_FRACTION, compact_dom, estimate_tokens, html_to_text
+
+BUDGET = 12000
+
+CHAT = "\n".join(["Alice", "hi", "Bob", "hey", "Alice", "lunch?", "Bob", "sure", "Alice", "12:30 ok"])
+TODO = "\n".join(["Todo", "Buy milk", "Call mom", "Pay rent", "Book flight", "Fix bike"])
+CART = "\n".join(["Cart", "Socks x2", "$12.00", "Shoes x1", "$80.00", "Total", "$92.00", "Checkout"])
+EMAIL = "\n".join(["From: Dana", "Re: invoice", "Thanks!", "From: Lee", "Re: invoice", "Sent it", "Regards"])
+PRIVACY = "Privacy Policy\nWe use cookies to run this site.\nSee our Terms of Service for details."
+COPYRIGHT = "The quarterly report shows revenue grew 8% year over year.\nCopyright 2024 Example Inc."
+
+
+def test_pages_within_budget_are_unchanged():
+    for page in (CHAT, TODO, CART, EMAIL, PRIVACY, COPYRIGHT):
+        out, report = compact_dom(page, "page", None, BUDGET)
+        assert out == page
+        assert not report.truncated
+
+
+def test_short_boilerplate_pages_over_budget_are_not_emptied():
+    # Pages made only of menu-like or boilerplate blocks, over a tiny budget
+    for page in (CHAT, TODO, CART, EMAIL, PRIVACY, COPYRIGHT):
+        budget = max(1, estimate_tokens(page) // 2)
+        out, _ = compact_dom(page, "page", None, budget)
+        assert out.strip()
+        assert estimate_tokens(out) >= MIN_KEEP_FRACTION * budget
+
+
+def test_boilerplate_dropped_only_until_page_fits():
+    content = "\n".join(f"Paragraph {i} " + "about the quarterly report and its findings " * 8 for i in range(10))
+    menu = "\n".join(["Home", "Products", "About", "Contact"])
+    footer = "Copyright 2024 Example Inc. All rights reserved."
+    page = "\n\n".join([menu, content, footer])
+    # Just over budget: dropping the menu (the least relevant boilerplate) is enough
+    out, report = compact_dom(page, "page", None, estimate_tokens(page) - 2)
+    assert report.boilerplate_blocks == 1
+    assert "Products" not in out
+    assert "Paragraph 0 " in out and "Paragraph 9 " in out
+    assert footer in out
+
+
+def test_unclosed_tags_stay_linear():
+    page = "<html><body><p>Hello</p>" + "<svg x>" * 20000 + "<p>World</p></body></html>"
+    started = time.perf_counter()
+    out, _ = compact_dom(page, "page", None, 100)
+    assert time.perf_counter() - started < 1.0
+    assert "Hello" in out
+
+
+def test_dropped_elements_are_removed():
+    text = html_to_text("<div><p>Keep</p><script>var x = '<p>no</p>';</script><SVG><path/></svg><p>me</p></div>")
+    assert "Keep" in text and "me" in text
+    assert "var x" not in text and "path" not in text
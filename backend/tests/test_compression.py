@@ -0,0 +1,108 @@
+import asyncio
+import gzip
+import zlib
+from typing import Any, Dict, List, Tuple
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app.compression import DECODE_CHUNK, DecompressionMiddleware, _decoder
+
+zstandard = pytest.importorskip("zstandard")
+
+PAGE = b"".join(b"<div class='item'>product %d costs $%d</div>\n" % (i, i % 97) for i in range(5000))
+
+
+def gz(data: bytes) -> bytes:
+    return gzip.compress(data, mtime=0)
+
+
+def zst(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def post(body: bytes, encoding: str, chunk: int = 0, max_size: int = 64 * 1024 * 1024) -> Tuple[int, bytes, List[int]]:
+    """(status, decoded body, sizes of the pieces the app received) for a
+    body sent through DecompressionMiddleware in `chunk`-sized messages."""
+    step = chunk or len(body) or 1
+    messages = [
+        {"type": "http.request", "body": body[i:i + step], "more_body": i + step < len(body)}
+        for i in range(0, max(len(body), 1), step)
+    ]
+    received: List[bytes] = []
+    sent: List[Dict[str, Any]] = []
+    status = 200
+
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        nonlocal status
+        assert not any(k in (b"content-encoding", b"content-length") for k, _ in scope["headers"])
+        try:
+            while True:
+                message = await receive()
+                received.append(message["body"])
+                if not message["more_body"]:
+                    break
+        except HTTPException as e:
+            status = e.status_code
+
+    async def receive() -> Dict[str, Any]:
+        return messages.pop(0)
+
+    async def send(message: Dict[str, Any]) -> None:
+        sent.append(message)
+
+    headers = [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode())]
+    middleware = DecompressionMiddleware(app, max_size=max_size)
+    asyncio.run(middleware({"type": "http", "headers": headers}, receive, send))
+    if sent:
+        status = sent[0]["status"]
+    return status, b"".join(received), [len(r) for r in received]
+
+
+@pytest.mark.parametrize("encode, encoding", [(gz, "gzip"), (gz, "x-gzip"), (zst, "zstd")])
+def test_bodies_decode_in_any_chunking(encode, encoding):
+    body = encode(PAGE)
+    for chunk in (0, 1, 7, 4096):
+        status, decoded, pieces = post(body, encoding, chunk)
+        assert status == 200 and decoded == PAGE
+        assert max(pieces) <= DECODE_CHUNK or encoding == "zstd"
+
+
+def test_gzip_bomb_is_refused_without_decoding_it_all():
+    bomb = gz(b"\0" * (64 << 20))
+    status, decoded, pieces = post(bomb, "gzip", max_size=1 << 20)
+    assert status == 413
+    assert len(decoded) <= 1 << 20
+    assert max(pieces, default=0) <= DECODE_CHUNK
+
+
+def test_zstd_bomb_is_refused_with_bounded_steps():
+    bomb = zst(b"\0" * (256 << 20))
+    status, decoded, _ = post(bomb, "zstd", max_size=1 << 20)
+    assert status == 413
+    assert len(decoded) <= 1 << 20
+    # No single decode step may allocate more than a few MiB
+    steps = _decoder("zstd").feed(bomb)
+    assert max(len(next(steps)) for _ in range(64)) <= 4 << 20
+
+
+@pytest.mark.parametrize("encode, encoding", [(gz, "gzip"), (zst, "zstd")])
+def test_truncated_bodies_are_400(encode, encoding):
+    body = encode(PAGE)
+    for cut in (len(body) // 2, len(body) - 1):
+        for chunk in (0, 512):
+            status, _, _ = post(body[:cut], encoding, chunk)
+            assert status == 400
+
+
+@pytest.mark.parametrize("body, encoding", [
+    (b"not gzip at all", "gzip"),
+    (b"not zstd at all", "zstd"),
+    (zlib.compress(PAGE), "gzip"),  # zlib framing, not gzip
+])
+def test_corrupt_bodies_are_400(body, encoding):
+    assert post(body, encoding)[0] == 400
+
+
+def test_unknown_encoding_is_415():
+    assert post(b"data", "br")[0] == 415
@@ -0,0 +1,180 @@
+import random
+from typing import List, Optional, Tuple
+
+import pytest
+
+from backend.app import main
+from backend.app.parsing import (
+    ReasoningContentParser,
+    SummaryItemParser,
+    parse_reasoning_and_content,
+    parse_structured_output,
+    split_summary_items,
+)
+
+SUMMARIES = [
+    "• First point\n• Second point\n• Third point",
+    "• One • Two • Three\r\n• Four\r\n\r\n- Five -",
+    "Intro line\n  • Nested bullet\t\n\n•\n• Last • ",
+    "No bullets here. Just sentences! Does it split? Yes",
+    "Single line without terminator",
+    "\r\n\r\n• after blank lines\r• old mac line end\r\n• crlf",
+    "\n".join(f"• item {i}" for i in range(14)),
+    "",
+    "•-",
+]
+
+SECTIONS = [
+    "Reasoning: because\n- it helps\n• really\nContent: Do this\n\n  then that",
+    "reasoning:\r\n  spread over\r\n  lines\r\n\r\ncontent:\r\nline one\r\n\r\nline two\r\n",
+    "Content: only content",
+    "Reasoning: only reasoning",
+    "Preamble ignored\nReasoning: a\nContent: b\nReasoning: c\nContent: d",
+    "",
+]
+
+
+def reference_summary(text: str) -> List[str]:
+    """The batch splitter the streaming parser replaced."""
+    items: List[str] = []
+    for raw in (line.strip() for line in text.splitlines()):
+        for p in (p.strip() for p in raw.split("•")):
+            if p:
+                items.append(p.lstrip("-• \t"))
+    if not items:
+        buf, cur = [], ""
+        for ch in text.strip():
+            cur += ch
+            if ch in ".!?":
+                if cur.strip():
+                    buf.append(cur.strip())
+                cur = ""
+        if cur.strip():
+            buf.append(cur.strip())
+        items = buf
+    items = [i.strip().rstrip("-• ") for i in items]
+    return [i for i in items if i][:10]
+
+
+def reference_sections(text: str) -> Tuple[str, str]:
+    reasoning: List[str] = []
+    content: List[str] = []
+    mode: Optional[str] = None
+    for raw in (line.rstrip() for line in text.splitlines()):
+        line = raw.strip()
+        if not line:
+            if mode == "content":
+                content.append("")
+            continue
+        lower = line.lower()
+        if lower.startswith("reasoning:"):
+            mode = "reasoning"
+            if line[10:].strip():
+                reasoning.append(line[10:].strip().lstrip("-• "))
+        elif lower.startswith("content:"):
+            mode = "content"
+            if line[8:].strip():
+                content.append(line[8:].strip())
+        elif mode == "reasoning":
+            reasoning.append(line.lstrip("-• \t"))
+        elif mode == "content":
+            content.append(raw)
+    paragraph = " ".join(" ".join(r for r in (s.strip() for s in reasoning) if r).split())
+    return paragraph, "\n".join(content).strip() or "n/a"
+
+
+def chunkings(text: str) -> List[List[str]]:
+    """Every two-way split, one char at a time, and some random splits."""
+    out = [[text[:i], text[i:]] for i in range(len(text) + 1)]
+    out.append(list(text))
+    rng = random.Random(len(text))
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(1, 6))))
+        out.append([text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])])
+    return out
+
+
+@pytest.mark.parametrize("text", SUMMARIES)
+def test_summary_parser_matches_batch_split_for_any_chunking(text):
+    expected = reference_summary(text)
+    assert split_summary_items(text) == expected
+    for chunks in chunkings(text):
+        parser = SummaryItemParser()
+        streamed: List[str] = []
+        for chunk in chunks:
+            streamed.extend(parser.feed(chunk))
+        streamed.extend(parser.finish())
+        assert streamed == parser.items == expected, chunks
+
+
+@pytest.mark.parametrize("text", SECTIONS)
+def test_section_parser_matches_batch_parse_for_any_chunking(text):
+    expected = reference_sections(text)
+    assert parse_reasoning_and_content(text) == expected
+    for chunks in chunkings(text):
+        parser = ReasoningContentParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        assert parser.finish() == expected, chunks
+
+
+def test_cr_split_from_lf_is_one_line_break():
+    parser = SummaryItemParser()
+    assert parser.feed("• a\r") == []
+    # The "\n" completes the "\r\n"; no empty line or extra item in between
+    assert parser.feed("\n• b") == ["a"]
+    assert parser.finish() == ["b"]
+
+    sections = ReasoningContentParser()
+    sections.feed("Content: x\r")
+    sections.feed("\ny")
+    assert sections.finish() == ("", "x\ny")
+
+
+def test_reasoning_reported_once_content_starts():
+    parser = ReasoningContentParser()
+    assert parser.feed("Reasoning: because\nit helps\nCont") is None
+    assert parser.feed("ent: do it\n") == "because it helps"
+    assert parser.feed("more\n") is None
+
+
+def test_structured_output_parses_each_mode():
+    assert parse_structured_output('{"summary": [" a ", "", "b"]}', "summary") == {"summary": ["a", "b"]}
+    assert parse_structured_output('{"summary": ["x"] }', "summary") == {"summary": ["x"]}
+    suggest = parse_structured_output('{"reasoning": "because\\n  it helps", "content": "  "}', "suggest")
+    assert suggest == {"reasoning": "because it helps", "content": "n/a"}
+    analysis = parse_structured_output('{"suggestions": [{"description": " d ", "actions": ["click"]}]}', "analysis")
+    assert analysis == {"suggestions": [{"description": "d", "actions": ["click"]}]}
+
+
+@pytest.mark.parametrize("text, mode", [
+    ('{"summary": ["a", "b"', "summary"),  # cut off mid-object
+    ('{"summary": ["a"]} trailing', "summary"),
+    ('["a", "b"]', "summary"),
+    ('{"summary": "a"}', "summary"),
+    ('{"summary": ["a", 1]}', "summary"),
+    ('{"reasoning": "r"}', "suggest"),
+    ('{"reasoning": ["r"], "content": "c"}', "suggest"),
+    ('{"suggestions": {"description": "d"}}', "analysis"),
+    ('{"suggestions": ["d"]}', "analysis"),
+    ('{"suggestions": [{"actions": []}]}', "analysis"),
+    ('{"suggestions": [{"description": "d", "actions": "click"}]}', "analysis"),
+])
+def test_structured_output_rejects_malformed_or_misshapen_json(text, mode):
+    assert parse_structured_output(text, mode) is None
+
+
+def test_malformed_structured_reply_falls_back_to_text_parsers(monkeypatch):
+    monkeypatch.setattr(main, "STRUCTURED_OUTPUT", True)
+    monkeypatch.setitem(main.structured_results, "fallback", 0)
+    monkeypatch.setitem(main.structured_results, "parsed", 0)
+
+    def parse(text: str, mode: str):
+        return main._parse_mode_output({"output_text": text}, mode, "m")
+
+    assert parse('{"summary": ["one", "two"]}', "summary").summary == ["one", "two"]
+    truncated = '{"summary": ["one", "two'
+    assert parse(truncated, "summary").summary == split_summary_items(truncated)
+    reply = parse('{"reasoning": 1}\nContent: do it', "suggest")
+    assert (reply.reasoning, reply.content) == ("", "do it")
+    assert main.structured_results["fallback"] == 2 and main.structured_results["parsed"] == 1
@@ -0,0 +1,158 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+from fastapi import HTTPException, Request
+
+from backend.app import main
+from backend.app.admission import BACKGROUND, INTERACTIVE, NORMAL, ClientRateLimiter, RequestBudget, set_budget
+from backend.app.prefetch import PrefetchJob, Prefetcher
+from backend.app.upstream import ConcurrencyLimiter
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Jobs:
+    """Prefetch jobs that run until released, recording which started."""
+
+    def __init__(self) -> None:
+        self.gates: Dict[str, asyncio.Event] = {}
+        self.started: List[str] = []
+
+    def job(self, tab: Optional[str], key: str, mode: str = "summary", ttl: float = 60.0, outcome: str = "computed") -> PrefetchJob:
+        gate = self.gates.setdefault(key, asyncio.Event())
+
+        async def run() -> str:
+            self.started.append(key)
+            await gate.wait()
+            return outcome
+
+        return PrefetchJob(tab, key, mode, run, ttl)
+
+    async def finish(self, key: str) -> None:
+        self.gates[key].set()
+        await settle()
+
+
+def test_new_content_supersedes_the_tabs_queued_and_running_jobs():
+    async def scenario() -> None:
+        jobs, prefetcher = Jobs(), Prefetcher(workers=1, max_queue=4)
+        first = prefetcher.submit("tab", [jobs.job("tab", "k1", "summary"), jobs.job("tab", "k2", "suggest")])
+        assert first == {"summary": "queued", "suggest": "queued"}
+        other = prefetcher.submit("other", [jobs.job("other", "k9")])
+        await settle()
+        assert jobs.started == ["k1"]
+
+        prefetcher.submit("tab", [jobs.job("tab", "k3")])
+        await settle()
+        # k1 was cancelled mid-call, k2 never ran; the other tab is untouched
+        assert prefetcher.outcomes["superseded_running"] == 1
+        assert prefetcher.outcomes["superseded_queued"] == 1
+        assert prefetcher.wasted == 1
+        assert jobs.started == ["k1", "k9"] and other == {"summary": "queued"}
+
+        # Resubmitting the same content keeps it rather than restarting it
+        await jobs.finish("k9")
+        assert prefetcher.submit("tab", [jobs.job("tab", "k3")]) == {"summary": "duplicate"}
+        await jobs.finish("k3")
+        assert jobs.started == ["k1", "k9", "k3"]
+        assert prefetcher.outcomes["computed"] == 2 and prefetcher.running == 0
+
+    asyncio.run(scenario())
+
+
+def test_jobs_are_dropped_when_saturated_or_upstream_busy():
+    async def scenario() -> None:
+        busy = False
+        jobs = Jobs()
+        prefetcher = Prefetcher(workers=1, max_queue=1, busy=lambda: busy)
+        statuses = [prefetcher.submit(None, [jobs.job(None, f"k{i}")]) for i in range(3)]
+        assert [s["summary"] for s in statuses] == ["queued", "queued", "dropped"]
+        assert prefetcher.outcomes["dropped_saturated"] == 1
+        await settle()
+        # k1 is next, but real work now waits for the upstream
+        busy = True
+        await jobs.finish("k0")
+        assert jobs.started == ["k0"] and prefetcher.outcomes["dropped_busy"] == 1
+        assert prefetcher.queue_depth == 0 and prefetcher.running == 0
+
+    asyncio.run(scenario())
+
+
+def test_results_are_counted_useful_once_served_else_wasted():
+    async def scenario() -> None:
+        jobs, prefetcher = Jobs(), Prefetcher(workers=2)
+        prefetcher.submit(None, [jobs.job(None, "served", "summary"), jobs.job(None, "joined", "suggest")])
+        await settle()
+        prefetcher.note_served("joined")
+        await jobs.finish("joined")
+        await jobs.finish("served")
+        prefetcher.note_served("served")
+        prefetcher.note_served("served")
+        assert (prefetcher.useful, prefetcher.served, prefetcher.served_in_flight) == (2, 2, 1)
+
+        # Expires behind the longer-lived results above, and may be prefetched again
+        prefetcher.submit(None, [jobs.job(None, "unused", ttl=0.0)])
+        await jobs.finish("unused")
+        stats = prefetcher.stats()
+        assert (stats["useful"], stats["wasted"], stats["useful_ratio"]) == (2, 1, round(2 / 3, 4))
+        assert prefetcher.submit(None, [jobs.job(None, "unused")]) == {"summary": "queued"}
+        assert prefetcher.submit(None, [jobs.job(None, "served")]) == {"summary": "duplicate"}
+
+    asyncio.run(scenario())
+
+
+def request(token: str) -> Request:
+    headers = [(b"authorization", f"Bearer {token}".encode())]
+    return Request({"type": "http", "method": "POST", "headers": headers, "client": ("1.2.3.4", 1)})
+
+
+def test_prefetch_has_its_own_client_rate_budget(monkeypatch):
+    monkeypatch.setattr(main, "client_limits", ClientRateLimiter(rpm=1, burst=1))
+    monkeypatch.setattr(main, "prefetch_limits", ClientRateLimiter(rpm=1, burst=1))
+    main.admit(request("a"), BACKGROUND, main.prefetch_limits)
+    with pytest.raises(HTTPException) as exc:
+        main.admit(request("a"), BACKGROUND, main.prefetch_limits)
+    assert exc.value.status_code == 429
+    # Spent prefetches leave the client's real requests their whole budget
+    assert main.admit(request("a"), INTERACTIVE).priority == INTERACTIVE
+    with pytest.raises(HTTPException):
+        main.admit(request("a"), INTERACTIVE)
+    main.admit(request("b"), BACKGROUND, main.prefetch_limits)
+
+
+def test_interactive_follower_promotes_a_queued_prefetch(monkeypatch):
+    async def scenario() -> List[str]:
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=2, max_wait=None)
+        monkeypatch.setattr(main.upstream, "limiter", limiter)
+        await limiter.acquire()
+        order: List[str] = []
+
+        async def call(name: str, priority: int, owner: object = None) -> None:
+            try:
+                await limiter.acquire(priority, owner=owner)
+            except HTTPException as e:
+                order.append(f"{name}:{e.status_code}")
+                return
+            order.append(name)
+            limiter.release()
+
+        leader = RequestBudget(BACKGROUND)
+        tasks = [asyncio.create_task(call("prefetch", BACKGROUND, leader))]
+        await settle()
+        tasks.append(asyncio.create_task(call("other", BACKGROUND)))
+        await settle()
+        # An interactive request joins the prefetch's call
+        set_budget(RequestBudget(INTERACTIVE))
+        main.join_flight(leader)
+        assert leader.priority == INTERACTIVE
+        tasks.append(asyncio.create_task(call("normal", NORMAL)))
+        await settle()
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["other:503", "prefetch", "normal"]
@@ -0,0 +1,119 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List
+
+import httpx
+import pytest
+
+from backend.app.router import MULTIMODAL_REJECTIONS, FormatRejectedError, UpstreamRouter
+from backend.app.upstream import UpstreamStatusError
+
+URL = "http://upstream.test/v1"
+OK = {"output": [{"type": "message", "content": [{"type": "output_text", "text": "ok"}]}]}
+
+
+class FakeTransport:
+    """Answers multimodal payloads with `image_reply` and text payloads with 200."""
+
+    def __init__(self, image_reply: httpx.Response) -> None:
+        self.image_reply = image_reply
+        self.sent: List[str] = []
+
+    async def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> httpx.Response:
+        kind = "multimodal" if payload.get("images") else "text"
+        self.sent.append(kind)
+        return self.image_reply if kind == "multimodal" else httpx.Response(200, json=OK)
+
+    async def stream(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        resp = await self.post(url, headers, payload)
+        if resp.status_code >= 400:
+            raise UpstreamStatusError(status_code=resp.status_code, detail=resp.text)
+        yield {"type": "response.completed"}
+
+
+def attempts() -> List[Any]:
+    return [("multimodal", {"model": "m", "images": 1}), ("text", {"model": "m"})]
+
+
+def run_calls(router: UpstreamRouter, n: int) -> None:
+    async def go() -> None:
+        for _ in range(n):
+            assert await router.complete(attempts(), {}) == OK
+
+    asyncio.run(go())
+
+
+def test_image_rejection_is_learned_and_skipped():
+    transport = FakeTransport(httpx.Response(400, json={"error": {"message": "Image input is not supported"}}))
+    router = UpstreamRouter(transport, [URL])
+    run_calls(router, 3)
+    assert transport.sent == ["multimodal", "text", "text", "text"]
+    assert router.endpoints[0].supports_multimodal("m") is False
+    assert router.skipped_multimodal == 2
+    assert router.fallbacks == 1
+
+
+def test_unrelated_rejection_needs_repeats():
+    transport = FakeTransport(httpx.Response(400, json={"error": {"message": "Invalid value for 'temperature'"}}))
+    router = UpstreamRouter(transport, [URL])
+    run_calls(router, MULTIMODAL_REJECTIONS - 1)
+    assert router.endpoints[0].supports_multimodal("m") is None
+    run_calls(router, 1)
+    assert router.endpoints[0].supports_multimodal("m") is False
+    run_calls(router, 1)
+    assert transport.sent.count("multimodal") == MULTIMODAL_REJECTIONS
+    assert router.skipped_multimodal == 1
+
+
+def test_success_resets_rejection_count():
+    reply = httpx.Response(400, json={"error": {"message": "bad request"}})
+    transport = FakeTransport(reply)
+    router = UpstreamRouter(transport, [URL])
+    run_calls(router, MULTIMODAL_REJECTIONS - 1)
+    transport.image_reply = httpx.Response(200, json=OK)
+    run_calls(router, 1)
+    assert router.endpoints[0].supports_multimodal("m") is True
+    transport.image_reply = reply
+    run_calls(router, 1)
+    # One rejection after a success is not enough to flip the capability
+    assert router.endpoints[0].supports_multimodal("m") is True
+
+
+def test_stream_learns_from_image_rejection():
+    transport = FakeTransport(httpx.Response(415, text="unsupported content type: input_image"))
+    router = UpstreamRouter(transport, [URL])
+
+    async def go() -> None:
+        for _ in range(2):
+            assert [e async for e in router.stream(attempts(), {})] == [{"type": "response.completed"}]
+
+    asyncio.run(go())
+    assert transport.sent == ["multimodal", "text", "text"]
+    assert router.endpoints[0].supports_multimodal("m") is False
+
+
+def test_format_rejection_needs_a_format_marker():
+    router = UpstreamRouter(FakeTransport(httpx.Response(200, json=OK)), [URL])
+    formatted = {"model": "m", "text": {"format": {"type": "json_schema"}}}
+    rejections = [
+        {"error": {"message": "Invalid schema for response_format 'summary'", "param": "text.format.schema"}},
+        {"error": {"message": "Bad request", "param": "text.format"}},
+        {"error": {"message": "json_schema is not supported for this model"}},
+    ]
+    unrelated = [
+        {"error": {"message": "Input does not match the request schema", "param": "input"}},
+        {"error": {"message": "Invalid value for 'temperature'", "param": "temperature"}},
+    ]
+
+    def attempts_with(reply: Dict[str, Any]) -> List[Any]:
+        router.transport = FakeTransport(httpx.Response(400, json=reply))
+        return [("multimodal", {**formatted, "images": 1}), ("text", formatted)]
+
+    async def go() -> None:
+        for reply in rejections:
+            with pytest.raises(FormatRejectedError):
+                await router.complete(attempts_with(reply), {})
+        for reply in unrelated:
+            # An input error still falls back to the text attempt
+            assert await router.complete(attempts_with(reply), {}) == OK
+
+    asyncio.run(go())
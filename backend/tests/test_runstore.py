@@ -0,0 +1,17 @@
+import pytest
+
+from backend.app.runs import RunRegistry
+from backend.app.runstore import MemoryRunBackend, RunBackend
+
+
+def test_incomplete_backend_fails_at_construction():
+    class NoLookup(RunBackend):
+        async def create(self, task):
+            raise AssertionError
+
+        async def get(self, run_id):
+            raise AssertionError
+
+    with pytest.raises(TypeError):
+        NoLookup(RunRegistry())
+    MemoryRunBackend(RunRegistry())
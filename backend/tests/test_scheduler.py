@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.app.runs import Run, RunState
+from backend.app.scheduler import RunScheduler
+
+
+def test_reservation_holds_capacity_until_submit():
+    async def go() -> None:
+        scheduler = RunScheduler(max_concurrent=1, max_queued=1)
+        scheduler.reserve()
+        scheduler.reserve()
+        with pytest.raises(HTTPException) as exc:
+            scheduler.reserve()
+        assert exc.value.status_code == 429
+        # A reserved submit never re-checks, so it cannot lose the race
+        runs = [Run("a"), Run("b")]
+        for run in runs:
+            scheduler.submit(run, reserved=True)
+        with pytest.raises(HTTPException):
+            scheduler.check_capacity()
+        for run in runs:
+            await run.set_state(RunState.STOPPED)
+        await asyncio.gather(*(run._worker for run in runs), return_exceptions=True)
+        scheduler.check_capacity()
+
+    asyncio.run(go())
+
+
+def test_released_and_cancelled_places_are_returned():
+    async def go() -> None:
+        scheduler = RunScheduler(max_concurrent=1, max_queued=0)
+        scheduler.reserve()
+        scheduler.release()
+        run = Run("a")
+        scheduler.submit(run)
+        with pytest.raises(HTTPException):
+            scheduler.check_capacity()
+        # Cancelled before its worker ever ran
+        run._worker.cancel()
+        await asyncio.gather(run._worker, return_exceptions=True)
+        scheduler.check_capacity()
+
+    asyncio.run(go())
@@ -0,0 +1,77 @@
+import math
+
+from backend.app.similarity import NearDuplicateIndex, signature, similarity, url_scope
+
+
+def page(n: int = 200, changed: int = 0, prefix: str = "item") -> str:
+    rows = [f"<li>{prefix} {chr(97 + i % 26)}{i // 26 * 'x'}</li>" for i in range(n)]
+    for i in range(changed):
+        rows[i] = f"<li>edited row {chr(97 + i % 26)}{i // 26 * 'y'}</li>"
+    return "<ul>" + "".join(rows) + "</ul>"
+
+
+BASE = page()
+CLOSE = page(changed=10)
+
+
+def test_signature_ignores_digits_and_needs_enough_features():
+    assert signature(BASE) == signature(BASE.replace("item", "ITEM42"))
+    assert similarity(signature(BASE), signature(BASE)) == 1.0
+    # Unrelated pages score near zero, never below it
+    assert 0.0 <= similarity(signature(BASE), signature(page(prefix="other"))) < 0.15
+    # Features are the rows plus "", "ul>", "/li>" and "/ul>": 16 is the minimum
+    assert signature(page(11)) is None
+    assert signature(page(12)) is not None
+
+
+def test_threshold_is_inclusive():
+    score = similarity(signature(BASE), signature(CLOSE))
+    assert 0.8 < score < 1.0
+    at = NearDuplicateIndex(threshold=score)
+    above = NearDuplicateIndex(threshold=math.nextafter(score, 1.0))
+    for index in (at, above):
+        index.add("bucket", "base", BASE)
+    assert at.find("bucket", "close", CLOSE) == ("base", score)
+    assert above.find("bucket", "close", CLOSE) is None
+    assert (at.hits, above.hits) == (1, 0)
+
+
+def test_find_prefers_the_closest_page_and_skips_itself():
+    index = NearDuplicateIndex(threshold=0.5)
+    index.add("b", "far", page(changed=40))
+    index.add("b", "near", page(changed=5))
+    assert index.find("b", "query", BASE)[0] == "near"
+    # A page is never its own near duplicate
+    alone = NearDuplicateIndex(threshold=0.5)
+    alone.add("b", "query", BASE)
+    assert alone.find("b", "query", BASE) is None
+    assert alone.find("b", "other", BASE) == ("query", 1.0)
+
+
+def test_buckets_small_pages_and_discard():
+    index = NearDuplicateIndex(threshold=0.5)
+    index.add("a", "base", BASE)
+    assert index.find("b", "other", BASE) is None
+    small = page(5)
+    index.add("a", "small", small)
+    assert len(index) == 1 and index.find("a", "small2", small) is None
+    index.discard("base")
+    assert index.find("a", "again", BASE) is None and not index._bands
+
+
+def test_least_recently_used_page_is_evicted():
+    index = NearDuplicateIndex(threshold=0.9, max_entries=2)
+    index.add("b", "one", page(prefix="one"))
+    index.add("b", "two", page(prefix="two"))
+    # A hit refreshes "one", so adding a third page evicts "two"
+    assert index.find("b", "q", page(prefix="one"))[0] == "one"
+    index.add("b", "three", page(prefix="three"))
+    assert index.evictions == 1 and list(index._entries) == ["one", "three"]
+    assert index.find("b", "q2", page(prefix="two")) is None
+
+
+def test_url_scope():
+    assert url_scope("HTTPS://Example.com/a/b/?q=1#x", "url") == "https://example.com/a/b"
+    assert url_scope("https://example.com", "url") == "https://example.com/"
+    assert url_scope("https://example.com/a?q", "origin") == "https://example.com"
+    assert url_scope("not a url", "url") is None and url_scope(None, "origin") is None
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+from backend.app import main
+from backend.app.main import AnalysisRequest, DeltaHunk
+from backend.app.snapshots import SnapshotStore, apply_delta, changed_regions
+
+BASE = "\n".join(f"line {i}" for i in range(10))
+
+
+def hunk(start: int, end: int, *lines: str) -> DeltaHunk:
+    return DeltaHunk(start=start, end=end, lines=list(lines))
+
+
+def test_apply_delta_replaces_inserts_and_deletes():
+    text, changed = apply_delta(BASE, [hunk(0, 0, "new first"), hunk(2, 4, "two", "three", "extra"), hunk(8, 10)])
+    assert text.split("\n") == ["new first", "line 0", "line 1", "two", "three", "extra",
+                                "line 4", "line 5", "line 6", "line 7"]
+    # A pure deletion still marks one line at the spot
+    assert changed == [(0, 1), (3, 6), (10, 11)]
+    assert apply_delta(BASE, []) == (BASE, [])
+
+
+@pytest.mark.parametrize("hunks", [
+    [hunk(3, 2)],  # end before start
+    [hunk(9, 11)],  # past the end of the base
+    [hunk(4, 6), hunk(5, 7)],  # overlapping
+    [hunk(6, 7), hunk(1, 2)],  # out of order
+])
+def test_apply_delta_rejects_invalid_hunks(hunks):
+    with pytest.raises(HTTPException) as exc:
+        apply_delta(BASE, hunks)
+    assert exc.value.status_code == 422
+
+
+def test_changed_regions_adds_context_and_merges():
+    assert changed_regions(BASE, [(5, 6)], context=1) == "line 4\nline 5\nline 6"
+    # Regions whose context touches are merged; distant ones are separated
+    assert changed_regions(BASE, [(1, 2), (3, 4), (8, 9)], context=1) == (
+        "line 0\nline 1\nline 2\nline 3\nline 4\n...\nline 7\nline 8\nline 9"
+    )
+    assert changed_regions(BASE, [(0, 1)], context=5).startswith("line 0\n")
+
+
+def test_snapshot_store_evicts_by_size_and_count():
+    store = SnapshotStore(max_entries=2, max_chars=100, ttl=60)
+    a, b = store.put("a" * 40, None), store.put("b" * 40, None)
+    store.get(a.id)
+    store.put("c" * 40, None)
+    assert store.get(b.id) is None and store.get(a.id) is not None
+    assert store.put("x" * 200, None).id not in store._items
+    assert store.chars_used == 80
+
+
+def test_delta_needs_a_base_and_a_page_needs_content():
+    delta = {"hunks": [{"start": 0, "end": 1, "lines": ["x"]}]}
+    with pytest.raises(ValidationError):
+        AnalysisRequest(delta=delta)
+    with pytest.raises(ValidationError):
+        AnalysisRequest(base_snapshot_id="abc")
+    with pytest.raises(ValidationError):
+        AnalysisRequest()
+    assert AnalysisRequest(base_snapshot_id="abc", delta=delta).dom_html == ""
+
+
+def test_delta_endpoints_reject_missing_or_unknown_base():
+    client = TestClient(main.app)
+    delta = {"hunks": [{"start": 0, "end": 0, "lines": ["x"]}]}
+    assert client.post("/api/summarize", json={"delta": delta}).status_code == 422
+    r = client.post("/api/summarize", json={"base_snapshot_id": "0" * 32, "delta": delta})
+    assert r.status_code == 409
+
+
+def test_focus_on_changes_frames_only_changed_regions():
+    base = main.snapshots.put(BASE, None)
+    base.results["summary"] = {"summary": ["old point"]}
+    text, changed = apply_delta(BASE, [hunk(5, 6, "changed line")])
+    req = AnalysisRequest(dom_html=text)
+    framed = asyncio.run(main.focus_on_changes(req, "summary", (base, changed)))
+    assert framed._framed
+    assert "• old point" in framed.dom_html and "changed line" in framed.dom_html
+    assert "line 0" not in framed.dom_html
@@ -0,0 +1,139 @@
+import asyncio
+from typing import List
+
+import pytest
+from fastapi import HTTPException, Request
+
+from backend.app.uploads import MultipartReader, UploadLimits, read_multipart
+
+BOUNDARY = b"----formBoundary7MA4YWxk"
+
+
+def body(*parts: bytes, preamble: bytes = b"", epilogue: bytes = b"", padding: bytes = b"") -> bytes:
+    out = preamble + b"\r\n" if preamble else b""
+    for part in parts:
+        out += b"--" + BOUNDARY + padding + b"\r\n" + part + b"\r\n"
+    return out + b"--" + BOUNDARY + b"--" + padding + epilogue
+
+
+def field(name: str, value: bytes) -> bytes:
+    return f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value
+
+
+def upload(name: str, filename: str, data: bytes) -> bytes:
+    head = f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\nContent-Type: image/png\r\n\r\n'
+    return head.encode() + data
+
+
+def parse(raw: bytes, chunk: int = 0, limits: UploadLimits = None):
+    reader = MultipartReader(BOUNDARY, limits or UploadLimits())
+    step = chunk or len(raw) or 1
+    for i in range(0, len(raw), step):
+        reader.feed(raw[i : i + step])
+    return reader.finish()
+
+
+def file_bytes(form, index: int = 0) -> bytes:
+    f = form.files[index].file
+    f.seek(0)
+    return f.read()
+
+
+# Binary data that contains CRLFs and partial boundaries of its own
+PNG = b"\x89PNG\r\n\x1a\n" + b"\r\n--" + BOUNDARY[:-1] + b"\r\n-" * 50
+
+
+def test_boundary_split_across_chunks():
+    raw = body(field("page_url", b"https://example.com/a"), upload("screenshots", "a.png", PNG))
+    expected = parse(raw)
+    for chunk in (1, 2, 3, 7, len(BOUNDARY), len(BOUNDARY) + 5):
+        form = parse(raw, chunk)
+        assert form.fields == expected.fields == {"page_url": "https://example.com/a"}
+        assert file_bytes(form) == PNG
+        assert form.files[0].size == len(PNG)
+        assert form.files[0].content_type == "image/png"
+
+
+def test_preamble_epilogue_and_transport_padding():
+    raw = body(
+        field("a", b"1"),
+        field("b", b"--" + BOUNDARY + b" in a value"),
+        preamble=b"This is a preamble --" + BOUNDARY + b"X that is ignored",
+        epilogue=b"\r\nand an epilogue",
+        padding=b" \t ",
+    )
+    for chunk in (0, 1, 5):
+        assert parse(raw, chunk).fields == {"a": "1", "b": "--" + BOUNDARY.decode() + " in a value"}
+
+
+def test_empty_parts_and_values():
+    assert parse(body(field("a", b""))).fields == {"a": ""}
+    with pytest.raises(HTTPException) as exc:
+        parse(body(b""))
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "limits, raw",
+    [
+        (UploadLimits(max_file=len(PNG) - 1), body(upload("s", "a.png", PNG))),
+        (UploadLimits(max_field=3), body(field("a", b"1234"))),
+        (UploadLimits(max_files=1), body(upload("s", "a.png", b"1"), upload("s", "b.png", b"2"))),
+        (UploadLimits(max_body=100), body(field("a", b"x" * 200))),
+    ],
+)
+def test_limits_refuse_with_413(limits, raw):
+    for chunk in (0, 16):
+        with pytest.raises(HTTPException) as exc:
+            parse(raw, chunk, limits)
+        assert exc.value.status_code == 413
+
+
+def test_limits_at_exact_size_pass():
+    form = parse(body(upload("s", "a.png", PNG), field("a", b"123")), 9, UploadLimits(max_file=len(PNG), max_field=3))
+    assert file_bytes(form) == PNG and form.fields == {"a": "123"}
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        body(field("a", b"1"))[:-10],  # truncated inside the closing boundary
+        body(field("a", b"1"))[: -len(BOUNDARY) - 4] + b"more data",  # final boundary missing
+        b"--" + BOUNDARY + b"\r\n" + field("a", b"1") + b"\r\n--" + BOUNDARY,  # no closing "--"
+        b"no boundary at all",
+        b"",
+    ],
+)
+def test_truncated_or_unterminated_body_is_400(raw):
+    with pytest.raises(HTTPException) as exc:
+        parse(raw, 4)
+    assert exc.value.status_code == 400
+
+
+def test_malformed_boundary_line_is_400():
+    with pytest.raises(HTTPException) as exc:
+        parse(b"--" + BOUNDARY + b"junk\r\n" + field("a", b"1") + b"\r\n--" + BOUNDARY + b"--")
+    assert exc.value.status_code == 400
+
+
+def request(content_type: str, chunks: List[bytes]) -> Request:
+    messages = [{"type": "http.request", "body": c, "more_body": True} for c in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    scope = {"type": "http", "method": "POST", "headers": [(b"content-type", content_type.encode())]}
+    return Request(scope, receive)
+
+
+def test_read_multipart_streams_request_body():
+    raw = body(field("a", b"1"), upload("s", "a.png", PNG))
+    chunks = [raw[i : i + 10] for i in range(0, len(raw), 10)]
+    ctype = f'multipart/form-data; boundary="{BOUNDARY.decode()}"'
+    form = asyncio.run(read_multipart(request(ctype, chunks), UploadLimits()))
+    assert form.fields == {"a": "1"} and file_bytes(form) == PNG
+    form.close()
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(read_multipart(request("application/json", [b"{}"]), UploadLimits()))
+    assert exc.value.status_code == 415
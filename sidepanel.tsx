@@ -70,6 +70,14 @@ function SidePanel() {
           if (data?.state) setStatus(data.state)
         } catch {}
       })
+      es.addEventListener("done", (ev: MessageEvent) => {
+        try {
+          const data = JSON.parse(ev.data)
+          if (data?.state) setStatus(data.state)
+        } catch {}
+        // The run is over; closing keeps EventSource from reconnecting
+        closeStream()
+      })
       es.onerror = () => {
         appendLog("[stream] error or disconnected")
       }